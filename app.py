@@ -1,11 +1,34 @@
 import streamlit as st
 import pandas as pd
 import os
+import time
 from datetime import datetime
 import json
 import base64
-from PIL import Image
 import io
+from model_weight import estimate_stl_weight, material_density, DEFAULT_INFILL, DEFAULT_SHELL_RATIO
+import batch_quote
+from exports import EXPORT_FORMATS, export_file, export_frame
+from history_store import load_rollups, rollup_frames, average_margin, partition_summary, PartitionMaintainer
+from schema import PRINT_MATERIALS_SCHEMA, UNIT_ITEMS_SCHEMA, MATERIAL_LOTS_SCHEMA, format_bytes
+from catalog_store import CatalogStore
+from journal import ChangeJournal, operation_label
+from price_history import PriceHistory, recost_history
+from inventory import Inventory, UNITS, entry_threshold
+from purchase_lots import LotCostTable, COST_METHODS, cost_method, latest_lot, material_fields
+from migrations import run_migrations
+from write_queue import WriteBehindQueue
+from backup import BackupScheduler
+from file_watcher import FileWatcher
+from metrics import REGISTRY, MetricsExporter
+from image_server import ThumbnailCache, ImageServer
+from image_cache import DecodedImageCache
+from image_reconciler import ImageReconciler, repair as repair_images, ORPHAN, MISSING, CORRUPT
+from optimizer import ConfigurationIndex
+from search_index import SearchIndex, filter_frame
+from workspace import DEFAULT_WORKSPACE, open_workspace, list_workspaces, create_workspace
+import what_if
+from quote_documents import QUOTE_FORMATS, build_quote, quote_number, quotes_from_history, generate_quote_documents
 
 # 设置页面配置
 st.set_page_config(
@@ -15,37 +38,242 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# 数据文件路径
-DATA_DIR = "data"
-PRINT_MATERIALS_FILE = os.path.join(DATA_DIR, "print_materials.xlsx")
-ACCESSORIES_FILE = os.path.join(DATA_DIR, "accessories.xlsx")
-PACKAGING_FILE = os.path.join(DATA_DIR, "packaging.xlsx")
-
-# 图片目录路径
-IMAGES_DIR = os.path.join(DATA_DIR, "images")
-MATERIALS_IMAGES_DIR = os.path.join(IMAGES_DIR, "materials")
-ACCESSORIES_IMAGES_DIR = os.path.join(IMAGES_DIR, "accessories")
-PACKAGING_IMAGES_DIR = os.path.join(IMAGES_DIR, "packaging")
-
-# 确保数据目录和图片目录存在
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(IMAGES_DIR, exist_ok=True)
-os.makedirs(MATERIALS_IMAGES_DIR, exist_ok=True)
-os.makedirs(ACCESSORIES_IMAGES_DIR, exist_ok=True)
-os.makedirs(PACKAGING_IMAGES_DIR, exist_ok=True)
-
-def load_data(file_path):
-    """加载Excel数据"""
-    if os.path.exists(file_path):
-        try:
-            return pd.read_excel(file_path)
-        except:
-            return pd.DataFrame()
-    return pd.DataFrame()
+# 默认工作区的数据目录，其他工作区（各自独立的数据表、图片和历史记录）保存在 WORKSPACES_DIR 中
+DEFAULT_DATA_DIR = "data"
+WORKSPACES_DIR = os.environ.get("ASSET_WORKSPACES_DIR", "workspaces")
+
+# 历史记录保留的月数（0表示全部保留），更早的分区整个移到归档目录，不再参与查询和统计
+HISTORY_RETENTION_MONTHS = int(os.environ.get("ASSET_HISTORY_RETENTION_MONTHS", "0"))
+
+# 增量备份目录和自动备份间隔
+BACKUP_DIR = "backups"
+BACKUP_INTERVAL_HOURS = 24
+
+# 运行指标：Prometheus 抓取端口（本机，设为0时不监听）和可选的指标文件
+METRICS_PORT = int(os.environ.get("ASSET_METRICS_PORT", "9108"))
+METRICS_FILE = os.environ.get("ASSET_METRICS_FILE")
+
+# 图片缩略图目录（按内容命名，所有工作区共用），放在应用的 static/ 目录中，
+# 开启 Streamlit 静态文件服务（.streamlit/config.toml 中的 server.enableStaticServing）后与页面同源提供
+THUMBNAILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "thumbnails")
+THUMBNAILS_URL = "app/static/thumbnails/"
+# 单独的图片服务：只在设置了浏览器访问地址时启动（如放在反向代理后面），端口和监听地址
+IMAGE_URL = os.environ.get("ASSET_IMAGE_URL")
+IMAGE_PORT = int(os.environ.get("ASSET_IMAGE_PORT", "8599"))
+IMAGE_HOST = os.environ.get("ASSET_IMAGE_HOST", "127.0.0.1")
+# 没有图片地址时页面直接发送图片，解码并缩小后的图片在进程内缓存的总大小（MB）
+IMAGE_CACHE_MB = int(os.environ.get("ASSET_IMAGE_CACHE_MB", "64"))
+
+# 打开的页面检查数据是否有变化的间隔（秒）
+DATA_CHECK_SECONDS = 2
+
+# 搜索结果最多显示的条数
+SEARCH_LIMIT = 200
+
+# 超过该大小的导出文件和报价单不在浏览器中直接下载
+MAX_DOWNLOAD_SIZE = 50 * 1024 * 1024
+
+# 页面级指标（脚本每次运行都会执行到这里，同名指标只注册一次）
+QUOTES = REGISTRY.counter('quotes', '计算价格次数', ['confirmed'])
+QUOTE_SECONDS = REGISTRY.histogram('quote_seconds', '计算一次价格（含提交历史记录）的耗时')
+RERUN_SECONDS = REGISTRY.histogram('rerun_seconds', '页面每次重新运行的耗时', ['page'])
+IMAGE_LOADS = REGISTRY.counter('image_loads', '图片加载次数', ['result'])
+
+@st.cache_resource
+def get_workspace(name):
+    """工作区的各数据路径（第一次打开时创建目录）"""
+    return open_workspace(name, DEFAULT_DATA_DIR, WORKSPACES_DIR, BACKUP_DIR).ensure_dirs()
+
+def current_workspace():
+    """本会话选择的工作区"""
+    return get_workspace(st.session_state.get('workspace', DEFAULT_WORKSPACE))
+
+# 以下每个工作区各有一份（按工作区名称缓存），数据、缓存和锁互不影响；
+# 不带参数的 get_xxx() 返回本会话所选工作区的那一份
+
+@st.cache_resource
+def workspace_write_queue(name):
+    queue = WriteBehindQueue()
+    REGISTRY.gauge('write_queue_depth', '后台写入队列中等待写入的数量', ['workspace']).set_function(
+        lambda: queue.depth, workspace=name)
+    REGISTRY.gauge('write_queue_errors', '后台写入失败次数', ['workspace']).set_function(
+        lambda: queue.error_count, workspace=name)
+    REGISTRY.gauge('write_queue_coalesced', '后台写入合并次数', ['workspace']).set_function(
+        lambda: queue.coalesced_count, workspace=name)
+    return queue
+
+def get_write_queue():
+    """工作区共享的后台写入队列"""
+    return workspace_write_queue(current_workspace().name)
+
+@st.cache_resource
+def workspace_catalog_store(name):
+    workspace = get_workspace(name)
+    run_migrations(workspace.data_dir, lock=workspace.migration_lock)
+    store = CatalogStore(workspace.catalog_tables, workspace.history_file, write_queue=workspace_write_queue(name),
+                         journal=ChangeJournal(workspace.journal_dir),
+                         price_history=PriceHistory(workspace.price_history_file), search_index=SearchIndex(),
+                         history_lock=workspace.history_lock)
+    REGISTRY.gauge('catalog_version', '当前数据版本号', ['workspace']).set_function(
+        lambda: store.version, workspace=name)
+    return store
+
+def get_catalog_store():
+    """工作区共享的数据目录，打开同一工作区的会话读取同一份数据（创建前先执行数据结构迁移）"""
+    return workspace_catalog_store(current_workspace().name)
+
+@st.cache_resource
+def workspace_file_watcher(name):
+    workspace = get_workspace(name)
+    store = workspace_catalog_store(name)
+    file_names = [os.path.basename(file_path) for file_path, _ in workspace.catalog_tables.values()]
+    # 重新读取后数据版本号增加，打开这个工作区的页面在 watch_data_version 中发现后重新运行
+    return FileWatcher(workspace.data_dir, file_names, store.file_changed).start()
+
+@st.fragment(run_every=DATA_CHECK_SECONDS)
+def watch_data_version():
+    """页面打开期间定时检查：本会话所在工作区的数据版本与页面显示的不同
+    （数据文件被外部修改、其他会话修改了数据）时，重新运行整个页面"""
+    if get_catalog_store().version != st.session_state.get('shown_version'):
+        st.rerun()
+
+def get_file_watcher():
+    """监视数据目录，数据文件被外部修改（如直接用Excel编辑）时只重新读取这张表，并通知所有会话刷新；
+    会话自己不检查文件"""
+    return workspace_file_watcher(current_workspace().name)
+
+@st.cache_resource
+def get_metrics_exporter():
+    """在后台输出运行指标（整个进程一份），各工作区的数据版本、队列深度等数值在输出时读取"""
+    return MetricsExporter(port=METRICS_PORT or None, file_path=METRICS_FILE).start()
+
+@st.cache_resource
+def get_thumbnail_cache():
+    return ThumbnailCache(THUMBNAILS_DIR)
+
+@st.cache_resource
+def get_image_server():
+    """设置了 ASSET_IMAGE_URL 时在后台单独提供图片缩略图，否则不启动"""
+    server = ImageServer(get_thumbnail_cache(), IMAGE_PORT, IMAGE_HOST, IMAGE_URL)
+    return server.start() if IMAGE_URL and IMAGE_PORT else server
+
+def thumbnail_url(image_path, width):
+    """图片缩略图的地址：优先使用同源的静态文件，其次是单独的图片服务；都不可用时返回 None"""
+    if st.get_option("server.enableStaticServing"):
+        file_name = get_thumbnail_cache().thumbnail(image_path, width)
+        # 带上版本参数时静态文件设置长期缓存（文件名就是内容哈希）
+        return f"{THUMBNAILS_URL}{file_name}?v={file_name.split('-')[0]}" if file_name else None
+    return get_image_server().url(image_path, width)
+
+@st.cache_resource
+def get_image_cache():
+    """解码后的图片（整个进程一份，按大小淘汰最久未使用的图片），页面重新运行时不再解码"""
+    cache = DecodedImageCache(IMAGE_CACHE_MB * 1024 * 1024)
+    REGISTRY.gauge('image_cache_bytes', '解码图片缓存占用的字节数').set_function(lambda: cache.bytes)
+    REGISTRY.gauge('image_cache_entries', '解码图片缓存中的图片数').set_function(lambda: cache.size)
+    return cache
+
+@st.cache_resource
+def workspace_image_reconciler(name):
+    return ImageReconciler(get_workspace(name).image_check_state_file)
+
+def get_image_reconciler():
+    """图片一致性检查，打开同一工作区的会话共用同一个状态文件"""
+    return workspace_image_reconciler(current_workspace().name)
+
+@st.cache_resource
+def workspace_inventory(name):
+    workspace = get_workspace(name)
+    run_migrations(workspace.data_dir, lock=workspace.migration_lock)
+    return Inventory(workspace.inventory_file)
+
+def get_inventory():
+    """工作区共享的库存台账（创建前先执行数据结构迁移）"""
+    return workspace_inventory(current_workspace().name)
+
+@st.cache_resource
+def workspace_backup_scheduler(name):
+    workspace = get_workspace(name)
+    write_queue = workspace_write_queue(name)
+    return BackupScheduler(workspace.data_dir, workspace.backup_dir, BACKUP_INTERVAL_HOURS,
+                           before_backup=lambda: write_queue.flush(timeout=60), lock=workspace.backup_lock).start()
+
+def get_backup_scheduler():
+    """后台定时备份工作区的数据目录，备份前先等待写入队列写完"""
+    return workspace_backup_scheduler(current_workspace().name)
+
+@st.cache_resource
+def workspace_history_maintainer(name):
+    workspace = get_workspace(name)
+    store = workspace_catalog_store(name)
+    return PartitionMaintainer(workspace.history_file, HISTORY_RETENTION_MONTHS or None,
+                               workspace.history_archive_dir,
+                               on_dropped=lambda months: store.invalidate_history(),
+                               lock=workspace.history_lock).start()
+
+def get_history_maintainer():
+    """后台压缩已结束月份的历史分区，并按保留月数归档更早的分区"""
+    return workspace_history_maintainer(current_workspace().name)
+
+def load_catalog():
+    """获取当前数据快照，会话中只记录版本号"""
+    catalog = get_catalog_store().snapshot
+    st.session_state['catalog_version'] = catalog.version
+    return catalog
+
+def material_lot_costs(catalog=None):
+    """采购批次的累计成本表，每个数据版本只计算一次"""
+    catalog = catalog or get_catalog_store().snapshot
+    return catalog.derived('lot_costs', lambda: LotCostTable(catalog.get('material_lots')))
+
+def configuration_index(catalog):
+    """查找最便宜配置用的材料/包装分组，每个数据版本只计算一次"""
+    return catalog.derived('configuration_index', lambda: ConfigurationIndex(catalog.get('print_materials'),
+                                                                             catalog.get('packaging')))
+
+def update_material_lots(old_name, new_name, first_lot):
+    """材料改名时批次跟着改名；还没有批次的材料用当前购买信息创建第一个批次"""
+    store = get_catalog_store()
+    lots = store.get('material_lots')
+    if old_name != new_name and not lots.empty:
+        for lot_index in lots.index[lots['材料'] == old_name]:
+            store.update_row('material_lots', lot_index, {'材料': new_name})
+    lot_index, _ = latest_lot(store.get('material_lots'), new_name)
+    if lot_index is None:
+        store.insert_row('material_lots', {'材料': new_name, **first_lot, '备注': ''})
+
+def material_consumed(name):
+    """材料已消耗的克重，先进先出时从这里开始计价"""
+    return get_inventory().consumed('print_materials', name)
+
+def refresh_material_from_lots(index, name, method):
+    """批次变化后，按最近一次购买和计价方式更新材料行"""
+    store = get_catalog_store()
+    fields = material_fields(store.get('material_lots'), material_lot_costs(), name, method, material_consumed(name))
+    if fields:
+        store.update_row('print_materials', index, fields)
+
+def record_unit_purchase(table, row, new_name, new_quantity, new_date):
+    """配件/包装修改后更新库存：改名时库存跟着改名，购买时间变化视为补货入库，只改总数量记为调整"""
+    inventory = get_inventory()
+    inventory.rename(table, row['名称'], new_name)
+    old_date = pd.to_datetime(row['购买时间'], errors='coerce')
+    if pd.isna(old_date) or old_date.normalize() != pd.Timestamp(new_date).normalize():
+        inventory.receive(table, new_name, new_quantity, '补货')
+    elif new_quantity != row['总数量']:
+        inventory.adjust(table, new_name, new_quantity - row['总数量'], '修改总数量')
+
+def stock_label(table, balances, name):
+    """卡片标题中的库存，低于预警线时加提示"""
+    entry = balances.get(str(name))
+    if entry is None:
+        return ""
+    warning = " ⚠️" if entry['结余'] < entry_threshold(table, entry) else ""
+    return f" | 库存: {entry['结余']:.0f} {UNITS[table]}{warning}"
 
-def save_data(df, file_path):
-    """保存数据到Excel"""
-    df.to_excel(file_path, index=False)
+def trash_image(image_path, keep=False):
+    """把图片放入回收站而不是直接删除，返回回收站中的图片信息（keep=True时保留原文件）"""
+    return get_catalog_store().journal.stash_image(image_path, move=not keep)
 
 def calculate_cost_per_gram(row):
     """计算每克成本"""
@@ -72,15 +300,35 @@ def save_uploaded_image(uploaded_file, image_dir, filename):
         return file_path
     return None
 
+def show_thumbnail(image_path, width, caption=None):
+    """通过地址显示缩略图（按两倍宽度生成，高分辨率屏幕也清晰），浏览器缓存后重新运行时不再传输图片；
+    没有图片地址时发送缓存中按同样大小解码的图片"""
+    url = thumbnail_url(image_path, width * 2)
+    if url:
+        # 相对地址的静态文件不能直接传给 st.image，用 img 标签显示
+        st.markdown(f'<img src="{url}" width="{width}">', unsafe_allow_html=True)
+        if caption:
+            st.caption(caption)
+        IMAGE_LOADS.inc(result='url')
+        return
+    image = get_image_cache().get(image_path, width * 2)
+    if image is None:
+        IMAGE_LOADS.inc(result='error')
+        st.caption("图片无法读取")
+    else:
+        st.image(image, width=width, caption=caption)
+        IMAGE_LOADS.inc(result='ok')
+
 def display_image(image_path, width=200):
     """显示图片"""
     if image_path and os.path.exists(image_path):
         try:
-            image = Image.open(image_path)
-            st.image(image, width=width, caption="产品图片")
+            show_thumbnail(image_path, width, caption="产品图片")
         except Exception as e:
+            IMAGE_LOADS.inc(result='error')
             st.error(f"图片加载失败: {e}")
     else:
+        IMAGE_LOADS.inc(result='missing')
         st.info("暂无图片")
 
 def get_image_path(image_dir, filename):
@@ -98,28 +346,69 @@ def get_image_path(image_dir, filename):
         return file_path
     return None
 
-def save_history_record(record, file_path):
-    """保存历史记录到Excel"""
-    import pandas as pd
-    import os
-    if os.path.exists(file_path):
-        df = pd.read_excel(file_path)
-        df = pd.concat([df, pd.DataFrame([record])], ignore_index=True)
-    else:
-        df = pd.DataFrame([record])
-    df.to_excel(file_path, index=False)
+def quote_lookups(catalog):
+    """报价单使用的当前单价和图片路径，键为 (类别, 名称)"""
+    prices, images = {}, {}
+    sources = [('打印材料', 'print_materials', current_workspace().materials_images_dir, '每克成本'),
+               ('产品配件', 'accessories', current_workspace().accessories_images_dir, '每单位成本'),
+               ('包装', 'packaging', current_workspace().packaging_images_dir, '每单位成本')]
+    for category, table, images_dir, price_column in sources:
+        for row in catalog.get(table).to_dict('records'):
+            key = (category, row['名称'])
+            prices[key] = row.get(price_column)
+            images[key] = get_image_path(images_dir, row.get('图片路径'))
+    return prices, images
 
-def load_history_records(file_path):
-    import pandas as pd
-    import os
-    if os.path.exists(file_path):
-        return pd.read_excel(file_path)
-    return pd.DataFrame()
+def render_quotes(quotes, formats, session_key, progress=None):
+    """生成报价单并打包，压缩包路径保存在 session_state 中供下载"""
+    out_dir = os.path.join(current_workspace().quotes_dir, datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+    start = time.perf_counter()
+    zip_path, failures = generate_quote_documents(quotes, out_dir, formats, progress=progress)
+    st.session_state[session_key] = zip_path
+    st.success(f"已生成 {len(quotes) - len(failures)} 份报价单，用时 {time.perf_counter() - start:.1f} 秒")
+    for number, error in failures:
+        st.warning(f"{number} 生成失败: {error}")
 
-def clear_history_records(file_path):
-    import os
-    if os.path.exists(file_path):
-        os.remove(file_path)
+def show_quote_download(session_key):
+    zip_path = st.session_state.get(session_key)
+    if zip_path and os.path.exists(zip_path):
+        size = os.path.getsize(zip_path)
+        if size <= MAX_DOWNLOAD_SIZE:
+            with open(zip_path, "rb") as f:
+                st.download_button(f"下载 {os.path.basename(zip_path)}", f, file_name=os.path.basename(zip_path),
+                                   key=f"{session_key}_download")
+        else:
+            st.info(f"文件较大（{format_bytes(size)}），请直接从服务器获取: {os.path.abspath(zip_path)}")
+
+def get_stl_estimate(uploaded_file, density, infill, shell_ratio):
+    """估算上传STL模型的克重，结果按文件和参数缓存在session中，避免每次重新计算"""
+    file_key = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+    cache_key = (file_key, density, infill, shell_ratio)
+    cache = st.session_state.setdefault('stl_estimates', {})
+    if cache_key not in cache:
+        try:
+            cache[cache_key] = estimate_stl_weight(uploaded_file.getbuffer(), density, infill, shell_ratio)
+        except Exception:
+            cache[cache_key] = None
+    return cache[cache_key]
+
+def search_options(table, options, query, keep=()):
+    """按关键字搜索选项（按相关度排序），已选中的选项始终保留在最前面；没有输入时返回全部选项"""
+    if not query or not query.strip():
+        return options
+    matches = get_catalog_store().search_index.names(table, query, limit=SEARCH_LIMIT)
+    kept = [option for option in options if option in keep and option not in matches]
+    available = set(options)
+    return kept + [name for name in matches if name in available]
+
+def search_rows(table, df, label):
+    """管理页面的搜索框：按关键字筛选数据表（按相关度排序），没有输入时返回全部行"""
+    query = st.text_input(label, key=f"{table}_search", placeholder="名称、品牌、类型、颜色、规格或备注，多个关键字用空格分开")
+    if not query.strip():
+        return df
+    shown = filter_frame(df, get_catalog_store().search_index.names(table, query, limit=SEARCH_LIMIT))
+    st.caption(f"找到 {len(shown)} 项" if len(shown) < SEARCH_LIMIT else f"显示最相关的 {SEARCH_LIMIT} 项")
+    return shown
 
 def card_multiselect(options, images_dir, df, label, session_key):
     import streamlit as st
@@ -127,17 +416,23 @@ def card_multiselect(options, images_dir, df, label, session_key):
     if session_key not in st.session_state:
         st.session_state[session_key] = set()
     selected = st.session_state[session_key]
+    rows = {row['名称']: row for row in df.to_dict('records')}
+    # 其他会话改名或删除后不存在的选项从选择中去掉
+    missing = [option for option in selected if option not in rows]
+    if missing:
+        selected = selected - set(missing)
+        st.session_state[session_key] = selected
+        st.warning(f"以下已选项目已被改名或删除，已取消选择: {', '.join(missing)}")
     st.write(f"**{label}**（点击图片或标题选择/取消）")
     cols = st.columns(6)
     for i, option in enumerate(options):
         with cols[i % 6]:
-            row = df[df['名称'] == option].iloc[0]
-            image_path = get_image_path(images_dir, row.get('图片路径', ''))
+            image_path = get_image_path(images_dir, rows[option].get('图片路径', ''))
             is_selected = option in selected
             btn_label = f"{'✅ ' if is_selected else ''}{option}"
             # 显示图片
             if image_path:
-                st.image(image_path, width=100)
+                show_thumbnail(image_path, 100)
             # 显示标题按钮
             if st.button(btn_label, key=f"{session_key}_{option}"):
                 if is_selected:
@@ -148,31 +443,194 @@ def card_multiselect(options, images_dir, df, label, session_key):
                 st.rerun()
     return list(selected)
 
+def switch_workspace():
+    """切换工作区时清除本会话中与原工作区有关的状态（选中的材料/配件、报价单、检查结果等）"""
+    for key in list(st.session_state):
+        if key != 'workspace':
+            del st.session_state[key]
+
+def add_workspace():
+    """新建工作区并切换过去（按钮的回调，在页面运行前执行，可以修改工作区选择框的值）"""
+    try:
+        name = create_workspace(st.session_state.get('workspace_new_name'), WORKSPACES_DIR)
+    except ValueError as e:
+        st.session_state['workspace_error'] = str(e)
+        return
+    st.session_state['workspace'] = name
+    switch_workspace()
+
+def show_workspace_selector():
+    """侧边栏选择本会话使用的工作区，也可以新建工作区"""
+    workspaces = list_workspaces(WORKSPACES_DIR)
+    if st.session_state.get('workspace') not in workspaces:
+        st.session_state['workspace'] = DEFAULT_WORKSPACE
+    if len(workspaces) > 1:
+        st.sidebar.selectbox("工作区", workspaces, key="workspace", on_change=switch_workspace)
+    with st.sidebar.expander("🏪 新建工作区"):
+        st.caption("每个工作区有独立的材料、配件、包装、图片和历史记录")
+        st.text_input("名称", key="workspace_new_name")
+        st.button("新建", key="workspace_create", on_click=add_workspace)
+        if 'workspace_error' in st.session_state:
+            st.error(st.session_state.pop('workspace_error'))
+
 def main():
     st.title("📊 资产管理平台")
+    show_workspace_selector()
     
     # 侧边栏导航
     page = st.sidebar.radio(
         "选择页面",
-        ["主页面 - 产品价格计算", "打印材料管理", "产品配件管理", "包装管理"]
+        ["主页面 - 产品价格计算", "批量报价", "假设分析", "打印材料管理", "产品配件管理", "包装管理", "数据导出"]
     )
     
-    if page == "主页面 - 产品价格计算":
-        show_main_page()
-    elif page == "打印材料管理":
-        show_print_materials_page()
-    elif page == "产品配件管理":
-        show_accessories_page()
-    elif page == "包装管理":
-        show_packaging_page()
+    get_file_watcher()
+    # 记录本次运行显示的数据版本，之后定时比较
+    st.session_state['shown_version'] = get_catalog_store().version
+    watch_data_version()
+    get_metrics_exporter()
+    get_history_maintainer()
+    show_storage_status()
+    show_low_stock_alert()
+    show_image_check()
+    
+    # st.rerun() 通过异常结束本次运行，耗时同样会记录
+    with RERUN_SECONDS.time(page=page):
+        if page == "主页面 - 产品价格计算":
+            show_main_page()
+        elif page == "批量报价":
+            show_batch_quote_page()
+        elif page == "假设分析":
+            show_what_if_page()
+        elif page == "打印材料管理":
+            show_print_materials_page()
+        elif page == "产品配件管理":
+            show_accessories_page()
+        elif page == "包装管理":
+            show_packaging_page()
+        elif page == "数据导出":
+            show_export_page()
+
+def show_storage_status():
+    """侧边栏显示后台写入队列状态，以及各数据表类型化前后的内存占用"""
+    store = get_catalog_store()
+    stats = get_write_queue().stats()
+    if stats['未写入']:
+        # 写入失败的数据保留在队列中重试，页面上的修改还没有保存到文件
+        details = "，".join(f"{key}（已尝试 {attempts} 次: {error}）" for key, (attempts, error) in stats['未写入'].items())
+        st.sidebar.error(f"⚠️ 以下数据尚未保存到文件，正在重试: {details}")
+    with st.sidebar.expander("💾 后台写入"):
+        st.write(f"队列深度: {stats['队列深度']}  |  已写入: {stats['写入次数']}  |  合并: {stats['合并次数']}")
+        if stats['平均写入耗时'] is not None:
+            st.write(f"写入耗时: 最近 {stats['最近写入耗时'] * 1000:.0f} ms，"
+                     f"平均 {stats['平均写入耗时'] * 1000:.0f} ms，最大 {stats['最大写入耗时'] * 1000:.0f} ms")
+        if stats['最近错误']:
+            st.error(f"写入失败: {stats['最近错误']}")
+        scheduler = get_backup_scheduler()
+        if scheduler.last_backup:
+            backup = scheduler.last_backup
+            st.caption(f"最近备份: {backup['time'][:19].replace('T', ' ')}，{backup['文件数']} 个文件，"
+                       f"新增 {format_bytes(backup['新增大小'])}")
+        if scheduler.last_error:
+            st.error(f"备份失败: {scheduler.last_error}")
+        partitions = partition_summary(current_workspace().history_file)
+        if partitions:
+            compressed = sum(1 for p in partitions if p['状态'] == '已压缩')
+            st.caption(f"历史分区: {len(partitions)} 个月（{compressed} 个已压缩），"
+                       f"共 {format_bytes(sum(p['大小'] for p in partitions))}")
+        maintainer = get_history_maintainer()
+        if maintainer.last_error:
+            st.error(f"历史分区维护失败: {maintainer.last_error}")
+        watcher = get_file_watcher()
+        st.caption(f"数据文件监视: {watcher.mode}")
+        if watcher.last_error:
+            st.error(f"重新读取数据文件失败: {watcher.last_error}")
+        image_server = get_image_server()
+        if st.get_option("server.enableStaticServing"):
+            st.caption("图片服务: 静态文件")
+        elif image_server.running:
+            st.caption(f"图片服务: {image_server.base_url}")
+        if image_server.last_error:
+            st.caption(image_server.last_error)
+        image_cache = get_image_cache()
+        if image_cache.size:
+            st.caption(f"图片缓存: {image_cache.size} 张，{format_bytes(image_cache.bytes)}"
+                       f" / {format_bytes(image_cache.max_bytes)}")
+        exporter = get_metrics_exporter()
+        if exporter.address:
+            st.caption(f"运行指标: {exporter.address}")
+        if exporter.last_error:
+            st.caption(exporter.last_error)
+    if not store.memory_reports:
+        return
+    with st.sidebar.expander("📦 数据内存占用"):
+        st.caption(f"数据版本: {store.version}（所有会话共享）")
+        for report in list(store.memory_reports.values()):
+            st.write(f"**{report['数据']}** ({report['行数']} 行): "
+                     f"{format_bytes(report['原始'])} → {format_bytes(report['类型化'])}")
+
+def image_sources(catalog):
+    return [('print_materials', catalog.get('print_materials'), current_workspace().materials_images_dir),
+            ('accessories', catalog.get('accessories'), current_workspace().accessories_images_dir),
+            ('packaging', catalog.get('packaging'), current_workspace().packaging_images_dir)]
+
+def show_image_check():
+    """图片一致性检查：孤立图片、缺少的图片和损坏的图片，可以一键修复"""
+    with st.sidebar.expander("🖼️ 图片检查"):
+        incremental = st.checkbox("只重新检查有变化的图片", value=True, key="image_check_incremental")
+        if st.button("检查图片", key="image_check_run"):
+            st.session_state['image_check'] = get_image_reconciler().run(image_sources(load_catalog()), incremental)
+        report = st.session_state.get('image_check')
+        if not report:
+            return
+        problems = report['问题']
+        st.caption(f"{report['文件数']} 个图片文件，本次解码检查 {report['检查数']} 个，"
+                   f"用时 {report['耗时'] * 1000:.0f} ms")
+        if problems.empty:
+            st.success("图片和数据表一致")
+            return
+        counts = problems['问题'].value_counts()
+        st.warning("，".join(f"{kind} {counts[kind]} 个" for kind in (ORPHAN, MISSING, CORRUPT) if kind in counts))
+        st.dataframe(problems[['名称', '文件', '问题']], use_container_width=True)
+        st.caption("修复：缺少图片的行改为引用同名的孤立图片或清空图片路径，损坏的图片放入回收站，"
+                   f"其余孤立图片移到 {current_workspace().orphaned_images_dir}")
+        if st.button("修复", key="image_check_repair"):
+            store = get_catalog_store()
+            catalog = load_catalog()
+            updates, moved = repair_images(problems, image_sources(catalog), current_workspace().orphaned_images_dir)
+            for table, index, image_path, trash_path in updates:
+                df = store.get(table)
+                if index not in df.index:
+                    continue
+                values = df.loc[index].to_dict()
+                values['图片路径'] = image_path
+                image = trash_image(trash_path) if trash_path else None
+                store.update_row(table, index, values, image=image)
+            st.session_state.pop('image_check')
+            st.success(f"已修改 {len(updates)} 行，移走 {moved} 个孤立图片")
+            st.rerun()
+
+def show_low_stock_alert():
+    """侧边栏低库存提醒（只读取结余表）"""
+    catalog = get_catalog_store().snapshot
+    inventory = get_inventory()
+    low = []
+    for table in UNITS:
+        df = catalog.get(table)
+        names = set(df['名称'].astype(str)) if not df.empty else set()
+        low.extend((table, item) for item in inventory.low_stock(table, names))
+    if low:
+        with st.sidebar.expander(f"⚠️ {len(low)} 项库存不足"):
+            for table, (name, stock, threshold) in low:
+                st.write(f"{name}: {stock:.0f} {UNITS[table]}（预警线 {threshold:.0f}）")
 
 def show_main_page():
     st.header("🏠 主页面 - 产品价格计算")
     
     # 加载数据
-    print_materials_df = load_data(PRINT_MATERIALS_FILE)
-    accessories_df = load_data(ACCESSORIES_FILE)
-    packaging_df = load_data(PACKAGING_FILE)
+    catalog = load_catalog()
+    print_materials_df = catalog.get('print_materials')
+    accessories_df = catalog.get('accessories')
+    packaging_df = catalog.get('packaging')
     
     col1, col2 = st.columns(2)
     
@@ -184,34 +642,80 @@ def show_main_page():
         
         # 打印材料选择
         if not print_materials_df.empty:
-            print_material_options = print_materials_df['名称'].tolist()
-            selected_print_material = st.selectbox("打印材料", print_material_options)
+            material_query = st.text_input("搜索打印材料", key="main_material_search",
+                                           placeholder="名称、品牌、类型或颜色")
+            print_material_options = search_options('print_materials', print_materials_df['名称'].tolist(),
+                                                    material_query, keep=[st.session_state.get('main_material')])
+            if not print_material_options:
+                st.caption("没有匹配的材料")
+            if st.session_state.get('main_material') not in print_material_options:
+                st.session_state.pop('main_material', None)
+            selected_print_material = st.selectbox("打印材料", print_material_options, key="main_material")
             
             # 显示选中的打印材料图片
             if selected_print_material:
                 material_row = print_materials_df[print_materials_df['名称'] == selected_print_material].iloc[0]
                 if '图片路径' in material_row and material_row['图片路径']:
-                    image_path = get_image_path(MATERIALS_IMAGES_DIR, material_row['图片路径'])
+                    image_path = get_image_path(current_workspace().materials_images_dir, material_row['图片路径'])
                     display_image(image_path, width=150)
         else:
             st.warning("请先在打印材料管理页面添加材料")
             selected_print_material = None
         
+        # 从STL模型估算克重（无需切片）
+        weight_source = "手动输入"
+        with st.expander("📐 从STL模型估算克重"):
+            stl_file = st.file_uploader("上传STL模型", type=['stl'], key="stl_upload")
+            infill = st.slider("填充率 (%)", min_value=0, max_value=100, value=int(DEFAULT_INFILL * 100), step=5)
+            shell_ratio = st.slider("外壳占比 (%)", min_value=0, max_value=100, value=int(DEFAULT_SHELL_RATIO * 100), step=5,
+                                    help="墙和顶底层占模型体积的比例，按实心计算")
+            if stl_file is not None:
+                if selected_print_material:
+                    density_row = print_materials_df[print_materials_df['名称'] == selected_print_material].iloc[0]
+                else:
+                    density_row = None
+                density = material_density(density_row)
+                estimate = get_stl_estimate(stl_file, density, infill / 100, shell_ratio / 100)
+                if estimate is None:
+                    st.error("STL文件解析失败")
+                else:
+                    st.write(f"三角形数量: {estimate['三角形数量']:,}")
+                    st.write(f"模型体积: {estimate['体积']:.2f} cm³ (密度 {density:.2f} g/cm³)")
+                    st.write(f"估算克重: **{estimate['克重']:.1f} 克**")
+                    if st.checkbox("使用估算克重计算价格", value=True, key="use_stl_weight"):
+                        weight = round(estimate['克重'], 1)
+                        weight_source = f"STL估算 ({stl_file.name})"
+        
         # 产品配件卡片多选
         if not accessories_df.empty:
-            accessory_options = accessories_df['名称'].tolist()
-            selected_accessories = card_multiselect(accessory_options, ACCESSORIES_IMAGES_DIR, accessories_df, "产品配件 (可多选)", "selected_accessories")
+            accessory_query = st.text_input("搜索产品配件", key="selected_accessories_search")
+            accessory_options = search_options('accessories', accessories_df['名称'].tolist(), accessory_query,
+                                               keep=st.session_state.get('selected_accessories', ()))
+            selected_accessories = card_multiselect(accessory_options, current_workspace().accessories_images_dir, accessories_df, "产品配件 (可多选)", "selected_accessories")
+            accessory_prices = dict(zip(accessories_df['名称'], accessories_df['每单位成本']))
         else:
             st.warning("请先在产品配件管理页面添加配件")
             selected_accessories = []
+            accessory_prices = {}
         
         # 包装卡片多选
         if not packaging_df.empty:
-            packaging_options = packaging_df['名称'].tolist()
-            selected_packaging = card_multiselect(packaging_options, PACKAGING_IMAGES_DIR, packaging_df, "包装 (可多选)", "selected_packaging")
+            packaging_query = st.text_input("搜索包装", key="selected_packaging_search")
+            packaging_options = search_options('packaging', packaging_df['名称'].tolist(), packaging_query,
+                                               keep=st.session_state.get('selected_packaging', ()))
+            selected_packaging = card_multiselect(packaging_options, current_workspace().packaging_images_dir, packaging_df, "包装 (可多选)", "selected_packaging")
+            packaging_prices = dict(zip(packaging_df['名称'], packaging_df['每单位成本']))
         else:
             st.warning("请先在包装管理页面添加包装")
             selected_packaging = []
+            packaging_prices = {}
+        
+        # 售价（可选，用于统计利润率）
+        sale_price = st.number_input("售价 (元，可选)", min_value=0.0, value=0.0, step=0.1)
+        confirm_job = st.checkbox("确认生产（扣减库存）", key="confirm_job",
+                                  help="勾选后计算价格时，按克重、所选配件和包装各1个扣减库存")
+        accessories_total = sum(float(accessory_prices[name]) for name in selected_accessories)
+        show_configuration_optimizer(catalog, weight, accessories_total)
     
     with col2:
         st.subheader("计算结果")
@@ -220,24 +724,22 @@ def show_main_page():
             if selected_print_material is None:
                 st.error("请选择打印材料")
                 return
+            quote_start = time.perf_counter()
             
-            # 计算打印材料成本
+            # 计算打印材料成本（有采购批次时按材料的计价方式计算）
             material_row = print_materials_df[print_materials_df['名称'] == selected_print_material].iloc[0]
-            material_cost = weight * material_row['每克成本']
+            method = cost_method(material_row.get('计价方式'))
+            material_cost = material_lot_costs(catalog).cost(selected_print_material, weight, method,
+                                                             material_consumed(selected_print_material))
+            if material_cost is None:
+                material_cost = weight * material_row['每克成本']
+            unit_cost = material_cost / weight if weight > 0 else material_row['每克成本']
             
             # 计算配件成本
-            accessories_cost = 0
-            if selected_accessories:
-                for accessory in selected_accessories:
-                    accessory_row = accessories_df[accessories_df['名称'] == accessory].iloc[0]
-                    accessories_cost += accessory_row['每单位成本']
+            accessories_cost = sum(accessory_prices[accessory] for accessory in selected_accessories)
             
             # 计算包装成本
-            packaging_cost = 0
-            if selected_packaging:
-                for package in selected_packaging:
-                    package_row = packaging_df[packaging_df['名称'] == package].iloc[0]
-                    packaging_cost += package_row['每单位成本']
+            packaging_cost = sum(packaging_prices[package] for package in selected_packaging)
             
             # 总成本
             total_cost = material_cost + accessories_cost + packaging_cost
@@ -247,25 +749,25 @@ def show_main_page():
             st.metric("产品配件成本", f"¥{accessories_cost:.2f}")
             st.metric("包装成本", f"¥{packaging_cost:.2f}")
             st.metric("总成本", f"¥{total_cost:.2f}", delta=f"¥{total_cost:.2f}")
+            if sale_price > 0:
+                st.metric("利润", f"¥{sale_price - total_cost:.2f}", delta=f"{(sale_price - total_cost) / sale_price:.1%}")
             
             # 详细计算过程
             with st.expander("查看详细计算过程"):
                 st.write(f"**计算公式**: 克重 × 打印材料每克成本 + 产品配件 + 包装")
-                st.write(f"**克重**: {weight} 克")
-                st.write(f"**打印材料**: {selected_print_material} (每克成本: ¥{material_row['每克成本']:.4f})")
-                st.write(f"**打印材料成本**: {weight} × ¥{material_row['每克成本']:.4f} = ¥{material_cost:.2f}")
+                st.write(f"**克重**: {weight} 克 ({weight_source})")
+                st.write(f"**打印材料**: {selected_print_material} (每克成本: ¥{unit_cost:.4f}，{method})")
+                st.write(f"**打印材料成本**: {weight} × ¥{unit_cost:.4f} = ¥{material_cost:.2f}")
                 
                 if selected_accessories:
                     st.write("**产品配件**:")
                     for accessory in selected_accessories:
-                        accessory_row = accessories_df[accessories_df['名称'] == accessory].iloc[0]
-                        st.write(f"  - {accessory}: ¥{accessory_row['每单位成本']:.2f}")
+                        st.write(f"  - {accessory}: ¥{accessory_prices[accessory]:.2f}")
                 
                 if selected_packaging:
                     st.write("**包装**:")
                     for package in selected_packaging:
-                        package_row = packaging_df[packaging_df['名称'] == package].iloc[0]
-                        st.write(f"  - {package}: ¥{package_row['每单位成本']:.2f}")
+                        st.write(f"  - {package}: ¥{packaging_prices[package]:.2f}")
             
             # 保存历史记录
             from datetime import datetime
@@ -278,36 +780,385 @@ def show_main_page():
                 '配件成本': accessories_cost,
                 '包装': ','.join(selected_packaging) if selected_packaging else '',
                 '包装成本': packaging_cost,
-                '总成本': total_cost
+                '总成本': total_cost,
+                '售价': sale_price if sale_price > 0 else None,
+                '利润': sale_price - total_cost if sale_price > 0 else None
             }
-            save_history_record(record, os.path.join(DATA_DIR, 'history_costs.xlsx'))
-    
+            get_catalog_store().append_history(record)
+
+            # 保存报价明细，用于生成客户报价单
+            prices, images = quote_lookups(catalog)
+            items = [('产品配件', name, prices[('产品配件', name)], images.get(('产品配件', name)))
+                     for name in selected_accessories]
+            items += [('包装', name, prices[('包装', name)], images.get(('包装', name)))
+                      for name in selected_packaging]
+            st.session_state['last_quote'] = build_quote(
+                quote_number(datetime.now(), 1), record['时间'], selected_print_material, weight, material_cost,
+                items, sale_price=record['售价'], material_image=images.get(('打印材料', selected_print_material)))
+
+            # 确认生产时扣减库存
+            if confirm_job:
+                consumed = [('print_materials', selected_print_material, weight)]
+                consumed += [('accessories', name, 1) for name in selected_accessories]
+                consumed += [('packaging', name, 1) for name in selected_packaging]
+                inventory = get_inventory()
+                inventory.consume(consumed, f"生产 {record['时间']}")
+                st.success("已扣减库存")
+                for table, name, _ in consumed:
+                    if inventory.is_low(table, name):
+                        st.warning(f"{name} 库存不足: 剩余 {inventory.stock(table, name):.0f} {UNITS[table]}")
+            QUOTES.inc(confirmed=str(confirm_job).lower())
+            QUOTE_SECONDS.observe(time.perf_counter() - quote_start)
+
+        show_quote_document()
+
     # 历史计算成本
     st.subheader("历史计算成本")
-    history_file = os.path.join(DATA_DIR, 'history_costs.xlsx')
-    history_df = load_history_records(history_file)
-    if not history_df.empty:
-        st.dataframe(history_df, use_container_width=True)
-        if st.button("清空历史记录", type="secondary"):
-            clear_history_records(history_file)
-            st.success("历史记录已清空")
+    show_history_analytics()
+
+def show_history_analytics():
+    """历史统计：图表只读取预先汇总的小表，明细按需加载"""
+    if get_write_queue().is_pending('history'):
+        st.caption("⏳ 新的计算记录正在后台保存，稍后刷新即可看到")
+    rollups = load_rollups(current_workspace().history_file, current_workspace().history_lock)
+    if rollups['记录数'] == 0:
+        st.info("暂无历史计算记录")
+        return
+    
+    frames = rollup_frames(rollups)
+    by_day = frames['按日']
+    margin = average_margin(rollups)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("报价次数", f"{rollups['记录数']}")
+    col2.metric("累计成本", f"¥{by_day['总成本'].sum():.2f}")
+    col3.metric("平均利润率", f"{margin:.1%}" if margin is not None else "暂无售价")
+    
+    st.write("**每日成本**")
+    st.line_chart(by_day[['打印材料成本', '配件成本', '包装成本', '总成本']])
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write("**各打印材料花费**")
+        st.bar_chart(frames['按材料']['打印材料成本'])
+    with col2:
+        st.write("**常用配件**")
+        st.bar_chart(frames['配件'])
+        st.write("**常用包装**")
+        st.bar_chart(frames['包装'])
+    
+    if st.checkbox("显示历史明细", key="show_history_detail"):
+        # 只读取所选日期范围涉及的月份分区
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("开始日期", value=datetime.now().replace(day=1), key="history_detail_start")
+        with col2:
+            end_date = st.date_input("结束日期", value=datetime.now(), key="history_detail_end")
+        history = get_catalog_store().history(start_date, end_date)
+        st.dataframe(history.to_frame(), use_container_width=True)
+    show_history_recost()
+    show_history_quotes()
+    if st.button("清空历史记录", type="secondary"):
+        get_catalog_store().clear_history()
+        st.success("历史记录已清空")
+        st.rerun()
+
+def apply_configuration(material, packaging):
+    """把找到的配置填入主页面的材料和包装选择（按钮回调，在控件创建前执行）"""
+    st.session_state['main_material'] = material
+    st.session_state['selected_packaging'] = set(packaging)
+
+def show_configuration_optimizer(catalog, weight, fixed_cost):
+    """按客户约束查找成本最低的材料和包装组合，可以直接填入上面的选择"""
+    index = configuration_index(catalog)
+    options = index.options()
+    with st.expander("🔍 查找最便宜的配置"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            types = st.multiselect("耗材类型", options['耗材类型'], key="optimizer_types")
+        with col2:
+            colors = st.multiselect("耗材颜色", options['耗材颜色'], key="optimizer_colors")
+        with col3:
+            textures = st.multiselect("质感", options['质感'], key="optimizer_textures")
+        categories = st.multiselect("必须包含的包装类别", options['包装类别'], key="optimizer_packaging",
+                                    help="包装按规格分类，没有填写规格的按名称")
+        st.session_state.setdefault('optimizer_top_k', 5)
+        top_k = st.number_input("显示前几个", min_value=1, max_value=50, step=1, key="optimizer_top_k")
+        results = index.search(weight, types, colors, textures, categories, int(top_k), fixed_cost)
+        if not results:
+            st.info("没有满足条件的配置")
+            return
+        st.caption(f"按克重 {weight} 克和当前每克成本估算，已选配件 ¥{fixed_cost:.2f} 计入总成本")
+        table = pd.DataFrame([{**result, '包装': '、'.join(result['包装'])} for result in results])
+        st.dataframe(table, use_container_width=True, hide_index=True)
+        if st.session_state.get('optimizer_choice', 0) >= len(results):
+            st.session_state.pop('optimizer_choice', None)
+        choice = st.selectbox("选择配置", range(len(results)), key="optimizer_choice",
+                              format_func=lambda i: f"{i + 1}. {results[i]['材料']} "
+                                                    f"{'+ ' + '、'.join(results[i]['包装']) if results[i]['包装'] else ''}"
+                                                    f"（¥{results[i]['总成本']:.2f}）")
+        st.button("使用此配置", key="optimizer_apply", on_click=apply_configuration,
+                  args=(results[choice]['材料'], results[choice]['包装']))
+        st.write("**各耗材类型最低材料成本**")
+        st.dataframe(index.cheapest_by_type(weight), use_container_width=True, hide_index=True)
+
+def show_quote_document():
+    """把最近一次计算的明细生成客户报价单"""
+    quote = st.session_state.get('last_quote')
+    if not quote:
+        return
+    with st.expander(f"📄 生成报价单 ({quote['编号']})"):
+        st.session_state.setdefault('quote_formats', list(QUOTE_FORMATS))
+        customer = st.text_input("客户", key="quote_customer")
+        remark = st.text_input("备注", key="quote_remark")
+        formats = st.multiselect("格式", list(QUOTE_FORMATS), key="quote_formats")
+        if st.button("生成报价单", key="quote_generate", disabled=not formats):
+            render_quotes([{**quote, '客户': customer, '备注': remark}], formats, 'quote_file')
+        show_quote_download('quote_file')
+
+def show_history_quotes():
+    """按日期和材料筛选历史记录，批量生成报价单（数量较多时使用多个进程）"""
+    with st.expander("📄 从历史记录批量生成报价单"):
+        st.session_state.setdefault('quote_batch_formats', list(QUOTE_FORMATS))
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("开始日期", value=datetime.now().replace(day=1), key="quote_batch_start")
+        with col2:
+            end_date = st.date_input("结束日期", value=datetime.now(), key="quote_batch_end")
+        catalog = load_catalog()
+        materials = st.multiselect("打印材料（不选则全部）", catalog.get('print_materials')['名称'].tolist(),
+                                   key="quote_batch_materials")
+        customer = st.text_input("客户", key="quote_batch_customer")
+        formats = st.multiselect("格式", list(QUOTE_FORMATS), key="quote_batch_formats")
+        if st.button("批量生成", key="quote_batch_run", disabled=not formats):
+            store = get_catalog_store()
+            records = store.history(start_date, end_date).to_frame()
+            if materials:
+                records = records[records['打印材料'].isin(materials)]
+            if records.empty:
+                st.info("没有符合条件的历史记录")
+            else:
+                prices, images = quote_lookups(catalog)
+                quotes = quotes_from_history(records, store.price_history.load(), prices, images, customer)
+                bar = st.progress(0.0, text="正在生成报价单...")
+                render_quotes(quotes, formats, 'quote_batch_file',
+                              progress=lambda done, total: bar.progress(done / total, text=f"已生成 {done}/{total}"))
+        show_quote_download('quote_batch_file')
+
+def show_history_recost():
+    """按价格历史重新计算全部历史报价：报价当时、今天或指定日期的价格"""
+    with st.expander("💱 按价格历史重算成本"):
+        basis = st.radio("使用的价格", ["报价当时的价格", "今天的价格", "指定日期的价格"], horizontal=True,
+                         key="recost_basis")
+        as_of = None
+        if basis == "今天的价格":
+            as_of = datetime.now()
+        elif basis == "指定日期的价格":
+            as_of = datetime.combine(st.date_input("价格日期", value=datetime.now(), key="recost_date"),
+                                     datetime.max.time())
+        if not st.button("重新计算", key="recost_run"):
+            return
+        store = get_catalog_store()
+        start = datetime.now()
+        result = recost_history(store.history(), store.price_history.load(), as_of)
+        elapsed = (datetime.now() - start).total_seconds()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("原成本合计", f"¥{result['原总成本'].sum():.2f}")
+        col2.metric("重算成本合计", f"¥{result['总成本'].sum():.2f}")
+        col3.metric("差额", f"¥{result['差额'].sum():.2f}")
+        st.caption(f"重算 {len(result):,} 条记录，用时 {elapsed:.2f} 秒"
+                   + (f"，{result.attrs['缺少价格']} 项找不到价格按0计算" if result.attrs['缺少价格'] else ""))
+        st.dataframe(result.sort_values('时间', ascending=False).head(500), use_container_width=True)
+
+def show_batch_quote_page():
+    st.header("🗂️ 批量报价")
+    
+    # 加载数据
+    catalog = load_catalog()
+    print_materials_df = catalog.get('print_materials')
+    accessories_df = catalog.get('accessories')
+    packaging_df = catalog.get('packaging')
+    
+    if print_materials_df.empty:
+        st.warning("请先在打印材料管理页面添加材料")
+        return
+    
+    # 新建任务
+    with st.expander("新建批量报价任务", expanded=True):
+        job_name = st.text_input("任务名称", value="客户订单", key="batch_name")
+        uploaded_zip = st.file_uploader("上传模型压缩包 (zip，支持STL/3MF/G-code)", type=['zip'], key="batch_zip")
+        folder = st.text_input("或输入服务器上的模型文件夹路径", key="batch_folder")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            material = st.selectbox("打印材料", print_materials_df['名称'].tolist(), key="batch_material")
+        with col2:
+            accessories = st.multiselect("每个模型的产品配件", accessories_df['名称'].tolist() if not accessories_df.empty else [], key="batch_accessories")
+        with col3:
+            packaging = st.multiselect("整单包装", packaging_df['名称'].tolist() if not packaging_df.empty else [], key="batch_packaging")
+        infill = st.slider("填充率 (%)", min_value=0, max_value=100, value=int(DEFAULT_INFILL * 100), step=5, key="batch_infill")
+        shell_ratio = st.slider("外壳占比 (%)", min_value=0, max_value=100, value=int(DEFAULT_SHELL_RATIO * 100), step=5, key="batch_shell")
+        if st.button("创建并开始任务", type="primary", key="batch_create"):
+            if uploaded_zip is None and not (folder and os.path.isdir(folder)):
+                st.error("请上传压缩包或输入有效的文件夹路径")
+            else:
+                material_row = print_materials_df[print_materials_df['名称'] == material].iloc[0]
+                source_dir = folder
+                if uploaded_zip is not None:
+                    source_dir = os.path.join(current_workspace().batch_jobs_dir, "uploads", datetime.now().strftime('%Y%m%d_%H%M%S'))
+                    os.makedirs(source_dir, exist_ok=True)
+                    batch_quote.extract_model_zip(uploaded_zip, source_dir)
+                job = batch_quote.BatchQuoteJob.create(
+                    current_workspace().batch_jobs_dir, job_name, source_dir, material, accessories, packaging,
+                    material_density(material_row), infill / 100, shell_ratio / 100)
+                if job.total == 0:
+                    st.error("没有找到STL/3MF/G-code文件")
+                else:
+                    job.start()
+                    st.session_state['batch_job_dir'] = job.job_dir
+                    st.success(f"任务已开始，共 {job.total} 个文件")
+    
+    # 任务列表
+    job_dirs = batch_quote.list_jobs(current_workspace().batch_jobs_dir)
+    if not job_dirs:
+        st.info("暂无批量报价任务")
+        return
+    st.subheader("任务进度")
+    current = st.session_state.get('batch_job_dir')
+    index = job_dirs.index(current) if current in job_dirs else 0
+    job_dir = st.selectbox("选择任务", job_dirs, index=index, format_func=os.path.basename, key="batch_job_select")
+    job = batch_quote.load_job(job_dir)
+    
+    st.write(f"**状态**: {job.status}  |  **进度**: {job.done}/{job.total}")
+    if job.status == batch_quote.STATUS_FAILED:
+        st.error(f"任务失败: {job.config.get('错误', '')}，可以继续任务重新处理未完成的文件")
+    st.progress(job.done / job.total if job.total else 1.0)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("刷新进度", key="batch_refresh"):
             st.rerun()
+    with col2:
+        if job.is_running():
+            if st.button("取消任务", key="batch_cancel"):
+                job.cancel()
+                st.rerun()
+        elif job.status != batch_quote.STATUS_DONE:
+            if st.button("继续任务", key="batch_resume"):
+                job.start()
+                st.rerun()
+    with col3:
+        if job.status == batch_quote.STATUS_DONE:
+            if st.button("生成报价单", type="primary", key="batch_build"):
+                job.build_quote(print_materials_df, accessories_df, packaging_df)
+            if os.path.exists(job.quote_path):
+                with open(job.quote_path, "rb") as f:
+                    st.download_button("下载报价单", f.read(), file_name=f"{job.config['名称']}_报价单.xlsx", key="batch_download")
+    
+    results_df = job.results_dataframe()
+    if not results_df.empty:
+        st.dataframe(results_df, use_container_width=True)
+
+def what_if_products(catalog, start_date, end_date):
+    """时间段内填写了售价的历史报价，各项成本按今天的价格重算"""
+    store = get_catalog_store()
+    history = store.history(start_date, end_date)
+    records = history.to_frame()
+    if len(records):
+        current = recost_history(history, store.price_history.load(), datetime.now())
+        for column in ('打印材料成本', '配件成本', '包装成本'):
+            records[column] = current[column].to_numpy()
+    return what_if.product_line(records, catalog.get('print_materials'))
+
+def show_what_if_page():
+    st.header("📈 假设分析")
+    st.caption("以选定时间段内填写了售价的历史报价作为产品线，按当前价格计算成本，"
+               "评估耗材价格、克重、运费和配件/包装成本变化对利润率的影响")
+    catalog = load_catalog()
+    col1, col2 = st.columns(2)
+    with col1:
+        start_date = st.date_input("开始日期", value=datetime.now() - pd.Timedelta(days=90), key="what_if_start")
+    with col2:
+        end_date = st.date_input("结束日期", value=datetime.now(), key="what_if_end")
+
+    mode = st.radio("分析方式", ["网格", "蒙特卡洛"], horizontal=True, key="what_if_mode")
+    target = st.slider("目标利润率 (%)", min_value=-50, max_value=90, value=30, step=5, key="what_if_target") / 100
+    if mode == "网格":
+        ranges = {}
+        for factor, default in [('耗材价格', (-20, 20)), ('克重', (-20, 20)), ('运费', (0, 0)), ('配件包装', (0, 0))]:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                ranges[factor] = st.slider(f"{factor}变化 (%)", min_value=-50, max_value=100, value=default,
+                                           step=5, key=f"what_if_range_{factor}")
+            with col2:
+                st.session_state.setdefault(f"what_if_steps_{factor}", 21 if default != (0, 0) else 1)
+                steps = st.number_input("取值个数", min_value=1, max_value=201, step=1,
+                                        key=f"what_if_steps_{factor}")
+            ranges[factor] = what_if.factor_values(*ranges[factor], int(steps))
+        factors = what_if.factor_grid(*(ranges[factor] for factor in what_if.FACTORS))
+        st.caption(f"共 {len(factors):,} 个情景")
     else:
-        st.info("暂无历史计算记录")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            samples = st.number_input("抽样次数", min_value=1000, max_value=2_000_000, value=100_000, step=10_000,
+                                      key="what_if_samples")
+            distribution = st.selectbox("价格分布", what_if.DISTRIBUTIONS, key="what_if_distribution")
+        with col2:
+            price_spread = st.slider("耗材价格波动 (%)", 0, 50, 20, key="what_if_price_spread",
+                                     help="正态分布为标准差，均匀/三角分布为最大变化幅度")
+            per_material = st.checkbox("每种材料独立波动", value=True, key="what_if_per_material")
+            weight_range = st.slider("克重变化 (%)", -50, 50, (0, 0), step=5, key="what_if_weight_range")
+        with col3:
+            shipping_spread = st.slider("运费波动 (%)", 0, 50, 0, key="what_if_shipping_spread")
+            item_spread = st.slider("配件包装波动 (%)", 0, 50, 0, key="what_if_item_spread")
+            seed = st.number_input("随机种子", min_value=0, value=0, step=1, key="what_if_seed")
+    if not st.button("运行分析", type="primary", key="what_if_run"):
+        return
+
+    # 读取历史分区并按今天的价格重算只在运行分析时进行，调整参数重新运行页面时不读取
+    products = what_if_products(catalog, start_date, end_date)
+    if products.empty:
+        st.info("所选时间段内没有填写售价的历史报价")
+        return
+    baseline = what_if.baseline_margin(products)
+    st.write(f"产品线: **{len(products)}** 个报价，当前价格下整体利润率 **{baseline:.1%}**")
+    start = time.perf_counter()
+    if mode == "网格":
+        result = what_if.evaluate_grid(products, factors, target)
+    else:
+        result = what_if.simulate(products, int(samples), price_spread / 100, distribution, per_material,
+                                  (1 + weight_range[0] / 100, 1 + weight_range[1] / 100),
+                                  shipping_spread / 100, item_spread / 100, target, int(seed))
+    elapsed = time.perf_counter() - start
+
+    summary, histogram = what_if.distribution_summary(result['利润率'])
+    margins = result['利润率']
+    st.caption(f"计算 {len(margins):,} 个情景 × {len(products)} 个报价，用时 {elapsed:.2f} 秒")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("整体利润率 P5", f"{summary['P5']:.1%}")
+    col2.metric("整体利润率 P50", f"{summary['P50']:.1%}", delta=f"{summary['P50'] - baseline:+.1%}")
+    col3.metric("整体利润率 P95", f"{summary['P95']:.1%}")
+    col4.metric("低于目标的情景", f"{(margins < target).mean():.1%}")
+    st.write("**整体利润率分布**")
+    st.bar_chart(histogram)
+    st.write(f"平均每个情景有 {result['亏损产品数'].mean():.1f} 个报价亏损，"
+             f"{result['低于目标产品数'].mean():.1f} 个报价低于目标利润率")
+    if mode == "网格":
+        st.write("**整体利润率 %（耗材价格 × 克重，其余因子取平均）**")
+        st.dataframe((what_if.grid_table(result) * 100).round(1), use_container_width=True)
+    st.write("**各报价的利润率范围（按亏损比例排序）**")
+    per_product = result['产品'].sort_values(['亏损比例', '平均利润率'], ascending=[False, True])
+    st.dataframe(per_product.head(200), use_container_width=True, hide_index=True)
 
 def show_print_materials_page():
     st.header("🖨️ 打印材料管理")
     
-    # 加载数据
-    df = load_data(PRINT_MATERIALS_FILE)
+    # 加载数据（共享快照，修改前先复制）
+    catalog = load_catalog()
+    df = catalog.get('print_materials')
+    material_lots = catalog.get('material_lots')
+    lot_costs = material_lot_costs(catalog)
+    balances = get_inventory().balances('print_materials')
     
     # 如果没有数据，创建空的DataFrame
     if df.empty:
-        df = pd.DataFrame(columns=['名称', '品牌', '质感', '耗材颜色', '耗材类型', '购买价', '运费', '总克重', '购买时间', '每克成本', '图片路径', '链接', '备注'])
-    # 补全旧数据缺失的列
-    for col in ['品牌', '质感', '耗材颜色', '耗材类型', '链接', '备注']:
-        if col not in df.columns:
-            df[col] = ''
+        df = pd.DataFrame(columns=list(PRINT_MATERIALS_SCHEMA))
     
     # 添加新材料的表单
     with st.expander("添加新材料", expanded=True):
@@ -330,6 +1181,7 @@ def show_print_materials_page():
         with col8:
             total_weight = st.number_input("总克重 (克)", min_value=0.0, value=0.0, step=0.1)
         purchase_date = st.date_input("购买时间", value=datetime.now())
+        method = st.selectbox("计价方式", COST_METHODS, help="多次购买价格不同时，每克成本的计算方式")
         link = st.text_input("链接", placeholder="购买链接或产品链接")
         remark = st.text_area("备注", placeholder="额外说明信息")
         uploaded_image = st.file_uploader("上传图片", type=['jpg', 'jpeg', 'png', 'gif'], key="material_upload")
@@ -339,10 +1191,10 @@ def show_print_materials_page():
                 # 保存图片
                 image_path = None
                 if uploaded_image is not None:
-                    image_path = save_uploaded_image(uploaded_image, MATERIALS_IMAGES_DIR, name)
+                    image_path = save_uploaded_image(uploaded_image, current_workspace().materials_images_dir, name)
                     if image_path:
                         image_path = os.path.basename(image_path)
-                new_row = pd.DataFrame([{
+                get_catalog_store().insert_row('print_materials', {
                     '名称': name,
                     '品牌': brand,
                     '质感': texture,
@@ -353,12 +1205,21 @@ def show_print_materials_page():
                     '总克重': total_weight,
                     '购买时间': purchase_date,
                     '每克成本': cost_per_gram,
+                    '计价方式': method,
                     '图片路径': image_path,
                     '链接': link,
                     '备注': remark
-                }])
-                df = pd.concat([df, new_row], ignore_index=True)
-                save_data(df, PRINT_MATERIALS_FILE)
+                })
+                # 第一次购买作为第一个采购批次
+                get_catalog_store().insert_row('material_lots', {
+                    '材料': name,
+                    '购买时间': purchase_date,
+                    '购买价': purchase_price,
+                    '运费': shipping_fee,
+                    '克重': total_weight,
+                    '备注': ''
+                })
+                get_inventory().receive('print_materials', name, total_weight)
                 st.success(f"成功添加材料: {name}")
                 st.rerun()
             else:
@@ -367,12 +1228,14 @@ def show_print_materials_page():
     # 显示现有材料
     if not df.empty:
         st.subheader("现有材料")
-        st.dataframe(df, use_container_width=True)
+        shown = search_rows('print_materials', df, "搜索材料")
+        st.dataframe(shown, use_container_width=True)
         st.subheader("编辑材料")
-        for index, row in df.iterrows():
-            with st.expander(f"{row['名称']} - 每克成本: ¥{row['每克成本']:.4f}"):
+        for index, row in shown.iterrows():
+            with st.expander(f"{row['名称']} - 每克成本: ¥{row['每克成本']:.4f}"
+                             f"{stock_label('print_materials', balances, row['名称'])}"):
                 if '图片路径' in row and row['图片路径']:
-                    image_path = get_image_path(MATERIALS_IMAGES_DIR, row['图片路径'])
+                    image_path = get_image_path(current_workspace().materials_images_dir, row['图片路径'])
                     display_image(image_path, width=150)
                 col1, col2, col3, col4, col5, col6, col7, col8 = st.columns(8)
                 with col1:
@@ -385,55 +1248,150 @@ def show_print_materials_page():
                     new_color = st.text_input(f"耗材颜色_{index}", value=row.get('耗材颜色', ''), key=f"color_{index}")
                 with col5:
                     new_material_type = st.text_input(f"耗材类型_{index}", value=row.get('耗材类型', ''), key=f"type_{index}")
+                # 有采购批次时，购买信息在下方的采购批次中修改，这里只显示最近一次购买
+                has_lots = row['名称'] in lot_costs
                 with col6:
-                    new_purchase_price = st.number_input(f"购买价_{index}", value=row['购买价'], key=f"price_{index}")
-                    new_shipping_fee = st.number_input(f"运费_{index}", value=row['运费'], key=f"shipping_{index}")
+                    if has_lots:
+                        st.write(f"最近购买价: ¥{row['购买价']:.2f}")
+                        st.write(f"运费: ¥{row['运费']:.2f}")
+                    else:
+                        new_purchase_price = st.number_input(f"购买价_{index}", value=row['购买价'], key=f"price_{index}")
+                        new_shipping_fee = st.number_input(f"运费_{index}", value=row['运费'], key=f"shipping_{index}")
                 with col7:
-                    new_total_weight = st.number_input(f"总克重_{index}", value=row['总克重'], key=f"weight_{index}")
-                    new_purchase_date = st.date_input(f"购买时间_{index}", value=row['购买时间'], key=f"date_{index}")
+                    if has_lots:
+                        st.write(f"克重: {row['总克重']:.0f} 克")
+                        st.write(f"购买时间: {str(row['购买时间'])[:10]}")
+                    else:
+                        new_total_weight = st.number_input(f"总克重_{index}", value=row['总克重'], key=f"weight_{index}")
+                        new_purchase_date = st.date_input(f"购买时间_{index}", value=row['购买时间'], key=f"date_{index}")
                 with col8:
                     new_image = st.file_uploader(f"更新图片_{index}", type=['jpg', 'jpeg', 'png', 'gif'], key=f"material_update_{index}")
                 new_link = st.text_input(f"链接_{index}", value=row.get('链接', ''), key=f"link_{index}")
                 new_remark = st.text_area(f"备注_{index}", value=row.get('备注', ''), key=f"remark_{index}")
+                current_method = cost_method(row.get('计价方式'))
+                new_method = st.selectbox(f"计价方式_{index}", COST_METHODS, index=COST_METHODS.index(current_method),
+                                          key=f"method_{index}")
                 if st.button(f"更新_{index}", key=f"update_{index}"):
+                    if has_lots:
+                        new_purchase_price, new_shipping_fee = row['购买价'], row['运费']
+                        new_total_weight, new_purchase_date = row['总克重'], row['购买时间']
                     if new_name and new_total_weight > 0:
-                        new_cost_per_gram = (new_purchase_price + new_shipping_fee) / new_total_weight
+                        # 批次和库存跟着材料改名（没有批次时，把当前购买信息作为第一个批次），
+                        # 每克成本由所有批次按计价方式计算
+                        get_inventory().rename('print_materials', row['名称'], new_name)
+                        update_material_lots(row['名称'], new_name, {
+                            '购买时间': new_purchase_date,
+                            '购买价': new_purchase_price,
+                            '运费': new_shipping_fee,
+                            '克重': new_total_weight
+                        })
+                        new_cost_per_gram = material_lot_costs().unit_cost(new_name, new_method, material_consumed(new_name))
                         new_image_path = row.get('图片路径', '')
+                        replaced_image = None
                         if new_image is not None:
-                            new_image_path = save_uploaded_image(new_image, MATERIALS_IMAGES_DIR, new_name)
+                            # 原图片先复制到回收站，撤销修改时可以恢复
+                            replaced_image = trash_image(get_image_path(current_workspace().materials_images_dir, new_image_path), keep=True)
+                            new_image_path = save_uploaded_image(new_image, current_workspace().materials_images_dir, new_name)
                             if new_image_path:
                                 new_image_path = os.path.basename(new_image_path)
-                        df.loc[index] = [new_name, new_brand, new_texture, new_color, new_material_type, new_purchase_price, new_shipping_fee, new_total_weight, new_purchase_date, new_cost_per_gram, new_image_path, new_link, new_remark]
-                        save_data(df, PRINT_MATERIALS_FILE)
+                        get_catalog_store().update_row('print_materials', index, {
+                            '名称': new_name,
+                            '品牌': new_brand,
+                            '质感': new_texture,
+                            '耗材颜色': new_color,
+                            '耗材类型': new_material_type,
+                            '购买价': new_purchase_price,
+                            '运费': new_shipping_fee,
+                            '总克重': new_total_weight,
+                            '购买时间': new_purchase_date,
+                            '每克成本': new_cost_per_gram,
+                            '计价方式': new_method,
+                            '图片路径': new_image_path,
+                            '链接': new_link,
+                            '备注': new_remark
+                        }, image=replaced_image)
                         st.success("更新成功")
                         st.rerun()
                     else:
                         st.error("请填写完整信息且总克重大于0")
                 if st.button(f"删除_{index}", key=f"delete_{index}"):
-                    if '图片路径' in row and row['图片路径']:
-                        image_path = get_image_path(MATERIALS_IMAGES_DIR, row['图片路径'])
-                        if image_path and os.path.exists(image_path):
-                            os.remove(image_path)
-                    df = df.drop(index)
-                    save_data(df, PRINT_MATERIALS_FILE)
+                    # 图片移入回收站，撤销删除时可以恢复
+                    deleted_image = trash_image(get_image_path(current_workspace().materials_images_dir, row.get('图片路径', '')))
+                    get_catalog_store().delete_row('print_materials', index, image=deleted_image)
+                    if not material_lots.empty:
+                        for lot_index in material_lots.index[material_lots['材料'] == row['名称']]:
+                            get_catalog_store().delete_row('material_lots', lot_index)
                     st.success("删除成功")
                     st.rerun()
+                show_material_lots(index, row, material_lots, lot_costs)
     else:
         st.info("暂无材料数据，请添加新材料")
+    
+    show_inventory('print_materials', df)
+    show_change_journal('print_materials')
+
+def show_material_lots(index, row, material_lots, lot_costs):
+    """材料的采购批次：列表、添加新批次（补货）、删除批次"""
+    name = row['名称']
+    method = cost_method(row.get('计价方式'))
+    lots = material_lots[material_lots['材料'] == name] if not material_lots.empty else material_lots
+    consumed = material_consumed(name)
+    st.write(f"**采购批次** {lot_costs.lot_count(name)} 批，共 {lot_costs.total_grams(name):.0f} 克，"
+             f"已消耗 {consumed:.0f} 克")
+    if not lots.empty:
+        lots_view = lots[['购买时间', '购买价', '运费', '克重', '备注']].copy()
+        lots_view['每克成本'] = (lots_view['购买价'].fillna(0) + lots_view['运费'].fillna(0)) / lots_view['克重']
+        st.dataframe(lots_view.sort_values('购买时间'), use_container_width=True)
+        unit_cost = lot_costs.unit_cost(name, method, consumed)
+        if unit_cost is not None:
+            st.caption(f"{method}每克成本: ¥{unit_cost:.4f}（加权平均 ¥{lot_costs.average_cost(name):.4f}）")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        lot_date = st.date_input("批次购买时间", value=datetime.now(), key=f"lot_date_{index}")
+    with col2:
+        lot_price = st.number_input("批次购买价", min_value=0.0, value=0.0, step=0.01, key=f"lot_price_{index}")
+    with col3:
+        lot_shipping = st.number_input("批次运费", min_value=0.0, value=0.0, step=0.01, key=f"lot_shipping_{index}")
+    with col4:
+        lot_weight = st.number_input("批次克重", min_value=0.0, value=0.0, step=0.1, key=f"lot_weight_{index}")
+    if st.button("添加批次", key=f"lot_add_{index}"):
+        if lot_weight > 0:
+            get_catalog_store().insert_row('material_lots', {
+                '材料': name,
+                '购买时间': lot_date,
+                '购买价': lot_price,
+                '运费': lot_shipping,
+                '克重': lot_weight,
+                '备注': ''
+            })
+            get_inventory().receive('print_materials', name, lot_weight, '补货')
+            refresh_material_from_lots(index, name, method)
+            st.success("已添加批次")
+            st.rerun()
+        else:
+            st.error("批次克重需要大于0")
+    if len(lots) > 1:
+        labels = {lot_index: f"{str(lot['购买时间'])[:10]} ¥{lot['购买价']:.2f} {lot['克重']:.0f}克"
+                  for lot_index, lot in lots.iterrows()}
+        lot_to_delete = st.selectbox("选择批次", list(labels), format_func=labels.get, key=f"lot_select_{index}")
+        if st.button("删除批次", key=f"lot_delete_{index}"):
+            get_catalog_store().delete_row('material_lots', lot_to_delete)
+            get_inventory().adjust('print_materials', name, -lots.loc[lot_to_delete, '克重'], '删除批次')
+            refresh_material_from_lots(index, name, method)
+            st.success("已删除批次")
+            st.rerun()
 
 def show_accessories_page():
     st.header("🔧 产品配件管理")
     
-    # 加载数据
-    df = load_data(ACCESSORIES_FILE)
+    # 加载数据（共享快照，修改前先复制）
+    df = load_catalog().get('accessories')
+    balances = get_inventory().balances('accessories')
     
     # 如果没有数据，创建空的DataFrame
     if df.empty:
-        df = pd.DataFrame(columns=['名称', '规格', '购买价', '运费', '总数量', '购买时间', '每单位成本', '图片路径', '链接', '备注'])
-    # 补全旧数据缺失的列
-    for col in ['规格', '链接', '备注']:
-        if col not in df.columns:
-            df[col] = ''
+        df = pd.DataFrame(columns=list(UNIT_ITEMS_SCHEMA))
     
     # 添加新配件的表单
     with st.expander("添加新配件", expanded=True):
@@ -457,10 +1415,10 @@ def show_accessories_page():
                 cost_per_unit = (purchase_price + shipping_fee) / total_quantity
                 image_path = None
                 if uploaded_image is not None:
-                    image_path = save_uploaded_image(uploaded_image, ACCESSORIES_IMAGES_DIR, name)
+                    image_path = save_uploaded_image(uploaded_image, current_workspace().accessories_images_dir, name)
                     if image_path:
                         image_path = os.path.basename(image_path)
-                new_row = pd.DataFrame([{
+                get_catalog_store().insert_row('accessories', {
                     '名称': name,
                     '规格': spec,
                     '购买价': purchase_price,
@@ -471,9 +1429,8 @@ def show_accessories_page():
                     '图片路径': image_path,
                     '链接': link,
                     '备注': remark
-                }])
-                df = pd.concat([df, new_row], ignore_index=True)
-                save_data(df, ACCESSORIES_FILE)
+                })
+                get_inventory().receive('accessories', name, total_quantity)
                 st.success(f"成功添加配件: {name}")
                 st.rerun()
             else:
@@ -482,12 +1439,14 @@ def show_accessories_page():
     # 显示现有配件
     if not df.empty:
         st.subheader("现有配件")
-        st.dataframe(df, use_container_width=True)
+        shown = search_rows('accessories', df, "搜索配件")
+        st.dataframe(shown, use_container_width=True)
         st.subheader("编辑配件")
-        for index, row in df.iterrows():
-            with st.expander(f"{row['名称']} - 每单位成本: ¥{row['每单位成本']:.2f}"):
+        for index, row in shown.iterrows():
+            with st.expander(f"{row['名称']} - 每单位成本: ¥{row['每单位成本']:.2f}"
+                             f"{stock_label('accessories', balances, row['名称'])}"):
                 if '图片路径' in row and row['图片路径']:
-                    image_path = get_image_path(ACCESSORIES_IMAGES_DIR, row['图片路径'])
+                    image_path = get_image_path(current_workspace().accessories_images_dir, row['图片路径'])
                     display_image(image_path, width=150)
                 col1, col2, col3, col4, col5 = st.columns(5)
                 with col1:
@@ -508,40 +1467,52 @@ def show_accessories_page():
                     if new_name and new_total_quantity > 0:
                         new_cost_per_unit = (new_purchase_price + new_shipping_fee) / new_total_quantity
                         new_image_path = row.get('图片路径', '')
+                        replaced_image = None
                         if new_image is not None:
-                            new_image_path = save_uploaded_image(new_image, ACCESSORIES_IMAGES_DIR, new_name)
+                            # 原图片先复制到回收站，撤销修改时可以恢复
+                            replaced_image = trash_image(get_image_path(current_workspace().accessories_images_dir, new_image_path), keep=True)
+                            new_image_path = save_uploaded_image(new_image, current_workspace().accessories_images_dir, new_name)
                             if new_image_path:
                                 new_image_path = os.path.basename(new_image_path)
-                        df.loc[index] = [new_name, new_spec, new_purchase_price, new_shipping_fee, new_total_quantity, new_purchase_date, new_cost_per_unit, new_image_path, new_link, new_remark]
-                        save_data(df, ACCESSORIES_FILE)
+                        record_unit_purchase('accessories', row, new_name, new_total_quantity, new_purchase_date)
+                        get_catalog_store().update_row('accessories', index, {
+                            '名称': new_name,
+                            '规格': new_spec,
+                            '购买价': new_purchase_price,
+                            '运费': new_shipping_fee,
+                            '总数量': new_total_quantity,
+                            '购买时间': new_purchase_date,
+                            '每单位成本': new_cost_per_unit,
+                            '图片路径': new_image_path,
+                            '链接': new_link,
+                            '备注': new_remark
+                        }, image=replaced_image)
                         st.success("更新成功")
                         st.rerun()
                     else:
                         st.error("请填写完整信息且总数量大于0")
                 if st.button(f"删除_{index}", key=f"acc_delete_{index}"):
-                    if '图片路径' in row and row['图片路径']:
-                        image_path = get_image_path(ACCESSORIES_IMAGES_DIR, row['图片路径'])
-                        if image_path and os.path.exists(image_path):
-                            os.remove(image_path)
-                    df = df.drop(index)
-                    save_data(df, ACCESSORIES_FILE)
+                    # 图片移入回收站，撤销删除时可以恢复
+                    deleted_image = trash_image(get_image_path(current_workspace().accessories_images_dir, row.get('图片路径', '')))
+                    get_catalog_store().delete_row('accessories', index, image=deleted_image)
                     st.success("删除成功")
                     st.rerun()
     else:
         st.info("暂无配件数据，请添加新配件")
+    
+    show_inventory('accessories', df)
+    show_change_journal('accessories')
 
 def show_packaging_page():
     st.header("📦 包装管理")
     
-    # 加载数据
-    df = load_data(PACKAGING_FILE)
+    # 加载数据（共享快照，修改前先复制）
+    df = load_catalog().get('packaging')
+    balances = get_inventory().balances('packaging')
     
     # 如果没有数据，创建空的DataFrame
     if df.empty:
-        df = pd.DataFrame(columns=['名称', '规格', '购买价', '运费', '总数量', '购买时间', '每单位成本', '图片路径', '链接', '备注'])
-    for col in ['规格', '链接', '备注']:
-        if col not in df.columns:
-            df[col] = ''
+        df = pd.DataFrame(columns=list(UNIT_ITEMS_SCHEMA))
     
     # 添加新包装的表单
     with st.expander("添加新包装", expanded=True):
@@ -565,10 +1536,10 @@ def show_packaging_page():
                 cost_per_unit = (purchase_price + shipping_fee) / total_quantity
                 image_path = None
                 if uploaded_image is not None:
-                    image_path = save_uploaded_image(uploaded_image, PACKAGING_IMAGES_DIR, name)
+                    image_path = save_uploaded_image(uploaded_image, current_workspace().packaging_images_dir, name)
                     if image_path:
                         image_path = os.path.basename(image_path)
-                new_row = pd.DataFrame([{
+                get_catalog_store().insert_row('packaging', {
                     '名称': name,
                     '规格': spec,
                     '购买价': purchase_price,
@@ -579,9 +1550,8 @@ def show_packaging_page():
                     '图片路径': image_path,
                     '链接': link,
                     '备注': remark
-                }])
-                df = pd.concat([df, new_row], ignore_index=True)
-                save_data(df, PACKAGING_FILE)
+                })
+                get_inventory().receive('packaging', name, total_quantity)
                 st.success(f"成功添加包装: {name}")
                 st.rerun()
             else:
@@ -590,12 +1560,14 @@ def show_packaging_page():
     # 显示现有包装
     if not df.empty:
         st.subheader("现有包装")
-        st.dataframe(df, use_container_width=True)
+        shown = search_rows('packaging', df, "搜索包装")
+        st.dataframe(shown, use_container_width=True)
         st.subheader("编辑包装")
-        for index, row in df.iterrows():
-            with st.expander(f"{row['名称']} - 每单位成本: ¥{row['每单位成本']:.2f}"):
+        for index, row in shown.iterrows():
+            with st.expander(f"{row['名称']} - 每单位成本: ¥{row['每单位成本']:.2f}"
+                             f"{stock_label('packaging', balances, row['名称'])}"):
                 if '图片路径' in row and row['图片路径']:
-                    image_path = get_image_path(PACKAGING_IMAGES_DIR, row['图片路径'])
+                    image_path = get_image_path(current_workspace().packaging_images_dir, row['图片路径'])
                     display_image(image_path, width=150)
                 col1, col2, col3, col4, col5 = st.columns(5)
                 with col1:
@@ -616,27 +1588,187 @@ def show_packaging_page():
                     if new_name and new_total_quantity > 0:
                         new_cost_per_unit = (new_purchase_price + new_shipping_fee) / new_total_quantity
                         new_image_path = row.get('图片路径', '')
+                        replaced_image = None
                         if new_image is not None:
-                            new_image_path = save_uploaded_image(new_image, PACKAGING_IMAGES_DIR, new_name)
+                            # 原图片先复制到回收站，撤销修改时可以恢复
+                            replaced_image = trash_image(get_image_path(current_workspace().packaging_images_dir, new_image_path), keep=True)
+                            new_image_path = save_uploaded_image(new_image, current_workspace().packaging_images_dir, new_name)
                             if new_image_path:
                                 new_image_path = os.path.basename(new_image_path)
-                        df.loc[index] = [new_name, new_spec, new_purchase_price, new_shipping_fee, new_total_quantity, new_purchase_date, new_cost_per_unit, new_image_path, new_link, new_remark]
-                        save_data(df, PACKAGING_FILE)
+                        record_unit_purchase('packaging', row, new_name, new_total_quantity, new_purchase_date)
+                        get_catalog_store().update_row('packaging', index, {
+                            '名称': new_name,
+                            '规格': new_spec,
+                            '购买价': new_purchase_price,
+                            '运费': new_shipping_fee,
+                            '总数量': new_total_quantity,
+                            '购买时间': new_purchase_date,
+                            '每单位成本': new_cost_per_unit,
+                            '图片路径': new_image_path,
+                            '链接': new_link,
+                            '备注': new_remark
+                        }, image=replaced_image)
                         st.success("更新成功")
                         st.rerun()
                     else:
                         st.error("请填写完整信息且总数量大于0")
                 if st.button(f"删除_{index}", key=f"pkg_delete_btn_{index}"):
-                    if '图片路径' in row and row['图片路径']:
-                        image_path = get_image_path(PACKAGING_IMAGES_DIR, row['图片路径'])
-                        if image_path and os.path.exists(image_path):
-                            os.remove(image_path)
-                    df = df.drop(index)
-                    save_data(df, PACKAGING_FILE)
+                    # 图片移入回收站，撤销删除时可以恢复
+                    deleted_image = trash_image(get_image_path(current_workspace().packaging_images_dir, row.get('图片路径', '')))
+                    get_catalog_store().delete_row('packaging', index, image=deleted_image)
                     st.success("删除成功")
                     st.rerun()
     else:
         st.info("暂无包装数据，请添加新包装")
+    
+    show_inventory('packaging', df)
+    show_change_journal('packaging')
+
+def show_inventory(table, df):
+    """库存：当前结余、低库存预警、盘点和预警线设置"""
+    inventory = get_inventory()
+    unit = UNITS[table]
+    names = df['名称'].astype(str).tolist() if not df.empty else []
+    with st.expander("📦 库存"):
+        if not names:
+            st.info("暂无数据")
+            return
+        balances = inventory.balances(table)
+        rows = []
+        for name in names:
+            entry = balances.get(name)
+            if entry is None:
+                continue
+            rows.append({'名称': name, '入库': entry['入库'], '消耗': entry['消耗'], '调整': entry['调整'],
+                         '结余': entry['结余'], '预警线': inventory.threshold(table, name)})
+        for name, stock, threshold in inventory.low_stock(table, set(names)):
+            st.warning(f"{name} 库存不足: 剩余 {stock:.0f} {unit}（预警线 {threshold:.0f}）")
+        if rows:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            name = st.selectbox("物品", names, key=f"inventory_item_{table}")
+        with col2:
+            actual = st.number_input(f"实际库存 ({unit})", min_value=0.0, value=float(max(inventory.stock(table, name), 0)),
+                                     step=1.0, key=f"inventory_actual_{table}_{name}")
+            if st.button("保存盘点", key=f"inventory_count_{table}"):
+                inventory.count(table, name, actual)
+                st.success("已记录盘点")
+                st.rerun()
+        with col3:
+            threshold = st.number_input(f"预警线 ({unit})", min_value=0.0, value=float(inventory.threshold(table, name)),
+                                        step=1.0, key=f"inventory_threshold_{table}_{name}")
+            if st.button("设置预警线", key=f"inventory_set_threshold_{table}"):
+                inventory.set_threshold(table, name, threshold)
+                st.success("已设置预警线")
+                st.rerun()
+        if st.checkbox("显示台账明细", key=f"inventory_ledger_{table}"):
+            st.dataframe(inventory.ledger(table, name).iloc[::-1], use_container_width=True, hide_index=True)
+
+def show_change_journal(table):
+    """变更记录：查看最近的修改、撤销、恢复到指定时间点"""
+    store = get_catalog_store()
+    with st.expander("🕘 变更记录"):
+        # 条数和最近的记录来自日志在内存中的摘要，每次重新运行页面时不读取整个日志
+        count, entries = store.journal.summary(table)
+        if not count:
+            st.info("暂无变更记录")
+            return
+        recent = [{
+            '时间': entry['time'][:19].replace('T', ' '),
+            '操作': operation_label(entry),
+            '名称': (entry.get('after') or entry.get('before') or {}).get('名称', ''),
+            '变化字段': ', '.join(entry.get('after') or {}) if entry['op'] == 'update' else '',
+        } for entry in reversed(entries)]
+        st.dataframe(pd.DataFrame(recent), use_container_width=True)
+        st.caption(f"共 {count} 条记录")
+        if st.button("统计日志和回收站占用", key=f"{table}_journal_size"):
+            st.caption(f"日志和回收站占用 {format_bytes(store.journal.size())}")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            count = st.number_input("撤销最近几次修改", min_value=1, value=1, step=1, key=f"{table}_undo_count")
+            if st.button("撤销", key=f"{table}_undo"):
+                undone = store.undo(table, int(count))
+                if undone:
+                    st.success(f"已撤销 {undone} 次修改")
+                    st.rerun()
+                else:
+                    st.warning("没有可以撤销的修改")
+        with col2:
+            # 最早可恢复时间需要读取基准快照，只在展开恢复选项时读取
+            if not st.checkbox("恢复到指定时间点", key=f"{table}_restore_open"):
+                return
+            # 默认值只在第一次显示时设置，避免每次重新运行时控件被重置
+            now = datetime.now()
+            st.session_state.setdefault(f"{table}_restore_date", now.date())
+            st.session_state.setdefault(f"{table}_restore_time", now.time().replace(microsecond=0))
+            restore_date = st.date_input("恢复到日期", min_value=store.journal.earliest_time(table).date(),
+                                         key=f"{table}_restore_date")
+            restore_time = st.time_input("时间", key=f"{table}_restore_time")
+            if st.button("恢复到该时间点", key=f"{table}_restore"):
+                try:
+                    store.restore(table, datetime.combine(restore_date, restore_time))
+                    st.success("已恢复")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(f"恢复失败: {e}")
+
+def show_export_page():
+    st.header("📤 数据导出")
+    
+    catalog = load_catalog()
+    datasets = {
+        "历史计算记录": ('history', '时间', '打印材料'),
+        "打印材料": ('print_materials', '购买时间', '名称'),
+        "产品配件": ('accessories', '购买时间', None),
+        "包装": ('packaging', '购买时间', None),
+    }
+    dataset = st.selectbox("导出数据", list(datasets))
+    table, date_column, material_column = datasets[dataset]
+    export_format = st.radio("格式", list(EXPORT_FORMATS), horizontal=True)
+    
+    # 过滤条件
+    start_date = end_date = None
+    if st.checkbox(f"按{date_column}筛选"):
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("开始日期", value=datetime.now().replace(day=1))
+        with col2:
+            end_date = st.date_input("结束日期", value=datetime.now())
+    materials = []
+    if material_column and not catalog.get('print_materials').empty:
+        materials = st.multiselect("打印材料（不选则全部）", catalog.get('print_materials')['名称'].tolist())
+    
+    if st.button("生成导出文件", type="primary"):
+        os.makedirs(current_workspace().exports_dir, exist_ok=True)
+        out_name = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXPORT_FORMATS[export_format]}"
+        out_path = os.path.join(current_workspace().exports_dir, out_name)
+        filters = {
+            'date_column': date_column,
+            'start': start_date,
+            'end': end_date,
+            'value_filters': {material_column: materials} if material_column else None,
+        }
+        if table == 'history':
+            # 等待后台写入完成，再从文件流式导出
+            if not get_write_queue().flush(timeout=60):
+                st.warning("部分计算记录尚未写入文件，导出的数据可能不完整")
+            count = export_file(current_workspace().history_file, out_path, **filters)
+        else:
+            count = export_frame(catalog.get(table), out_path, **filters)
+        st.session_state['export_file'] = out_path
+        st.success(f"已导出 {count} 行")
+    
+    out_path = st.session_state.get('export_file')
+    if out_path and os.path.exists(out_path):
+        size = os.path.getsize(out_path)
+        if size <= MAX_DOWNLOAD_SIZE:
+            with open(out_path, "rb") as f:
+                st.download_button(f"下载 {os.path.basename(out_path)}", f, file_name=os.path.basename(out_path))
+        else:
+            st.info(f"文件较大（{format_bytes(size)}），请直接从服务器获取: {os.path.abspath(out_path)}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+数据备份脚本
+增量备份 data/ 目录：文件内容按 SHA-256 保存为 blobs/ 下的数据块（相同内容只保存一份），
+每次备份只写一份清单（文件路径 -> 哈希、大小、修改时间）。
+大小和修改时间都没变的文件直接沿用上次的哈希，不重新读取，
+所以大量图片没有变化时，备份只需要几秒，也几乎不占用额外空间。
+支持按天/周/月的保留策略、恢复时校验哈希，以及在应用中定时备份
+
+用法：
+    python backup.py create                 # 立即备份
+    python backup.py list                   # 列出备份
+    python backup.py verify <备份编号>       # 校验备份
+    python backup.py restore <备份编号> <目标目录>
+    python backup.py prune                  # 按保留策略删除旧备份
+    python backup.py schedule --hours 24    # 前台定时备份
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+DATA_DIR = "data"
+BACKUP_DIR = "backups"
+
+# 不需要备份的子目录（导出文件、批量报价任务的上传模型和结果、生成的报价单，都可以重新生成）和临时文件
+EXCLUDED_DIRS = {'exports', 'batch_jobs', 'quotes'}
+TEMP_SUFFIXES = ('.tmp',)
+
+# 最近写入的数据块可能属于另一个进程正在进行的备份，清理时跳过
+RECENT_BLOB_SECONDS = 3600
+
+# 默认保留策略：最近7次，以及最近14天、8周、12个月各保留最后一次
+DEFAULT_RETENTION = {'keep_last': 7, 'keep_daily': 14, 'keep_weekly': 8, 'keep_monthly': 12}
+
+# 同一备份目录的备份和清理需要互斥：create_backup/prune_backups 接收 lock 参数，
+# 多个线程使用同一备份目录时传入同一个锁（如工作区的 backup_lock）
+
+
+def _blob_path(backup_dir, digest):
+    return os.path.join(backup_dir, "blobs", digest[:2], digest)
+
+
+def _manifest_dir(backup_dir):
+    return os.path.join(backup_dir, "manifests")
+
+
+def _is_temp_file(name):
+    root = os.path.splitext(name)[0]
+    return name.endswith(TEMP_SUFFIXES) or root.endswith(TEMP_SUFFIXES)
+
+
+def iter_data_files(data_dir):
+    """递归列出需要备份的文件，返回 (相对路径, os.stat结果)"""
+    stack = [data_dir]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.relpath(entry.path, data_dir) not in EXCLUDED_DIRS:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and not _is_temp_file(entry.name):
+                    rel_path = os.path.relpath(entry.path, data_dir).replace(os.sep, '/')
+                    yield rel_path, entry.stat()
+
+
+def _store_blob(backup_dir, file_path):
+    """边读取边计算哈希，内容不存在时写入数据块，返回 (哈希, 新写入的字节数)"""
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(backup_dir, "blobs", f".incoming-{threading.get_ident()}")
+    with open(file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        for block in iter(lambda: src.read(1024 * 1024), b''):
+            digest.update(block)
+            dst.write(block)
+    digest = digest.hexdigest()
+    blob_path = _blob_path(backup_dir, digest)
+    if os.path.exists(blob_path):
+        os.remove(tmp_path)
+        return digest, 0
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(tmp_path, blob_path)
+    return digest, os.path.getsize(blob_path)
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """按时间从旧到新返回所有备份清单"""
+    manifest_dir = _manifest_dir(backup_dir)
+    if not os.path.isdir(manifest_dir):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(manifest_dir)):
+        if name.endswith('.json'):
+            with open(os.path.join(manifest_dir, name), encoding='utf-8') as f:
+                manifests.append(json.load(f))
+    return sorted(manifests, key=lambda m: m['time'])
+
+
+def load_manifest(backup_dir, backup_id):
+    path = os.path.join(_manifest_dir(backup_dir), f"{backup_id}.json")
+    if not os.path.exists(path):
+        raise ValueError(f"备份不存在: {backup_id}")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def create_backup(data_dir=DATA_DIR, backup_dir=BACKUP_DIR, lock=None):
+    """创建一次增量备份，返回备份清单"""
+    with lock or nullcontext():
+        os.makedirs(os.path.join(backup_dir, "blobs"), exist_ok=True)
+        os.makedirs(_manifest_dir(backup_dir), exist_ok=True)
+        start = time.perf_counter()
+        previous = list_backups(backup_dir)
+        previous_files = previous[-1]['files'] if previous else {}
+
+        files = {}
+        new_bytes = hashed = 0
+        for rel_path, stat in iter_data_files(data_dir):
+            old = previous_files.get(rel_path)
+            if (old and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns
+                    and os.path.exists(_blob_path(backup_dir, old['sha256']))):
+                digest = old['sha256']
+            else:
+                digest, written = _store_blob(backup_dir, os.path.join(data_dir, rel_path))
+                new_bytes += written
+                hashed += 1
+            files[rel_path] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        now = datetime.now()
+        backup_id = now.strftime('%Y%m%d-%H%M%S')
+        existing = {m['id'] for m in previous}
+        suffix = 1
+        while backup_id in existing:
+            suffix += 1
+            backup_id = f"{now.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        manifest = {
+            'id': backup_id,
+            'time': now.isoformat(),
+            'source': os.path.abspath(data_dir),
+            'files': files,
+            '文件数': len(files),
+            '总大小': sum(info['size'] for info in files.values()),
+            '读取文件数': hashed,
+            '新增大小': new_bytes,
+            '耗时': time.perf_counter() - start,
+        }
+        # 数据块全部写好后才写清单，中途失败不会留下不完整的备份
+        path = os.path.join(_manifest_dir(backup_dir), f"{backup_id}.json")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+        return manifest
+
+
+def verify_backup(backup_dir, backup_id):
+    """重新计算备份中每个数据块的哈希，返回问题列表（空列表表示完好）"""
+    problems = []
+    for rel_path, info in load_manifest(backup_dir, backup_id)['files'].items():
+        blob_path = _blob_path(backup_dir, info['sha256'])
+        if not os.path.exists(blob_path):
+            problems.append(f"{rel_path}: 数据块缺失")
+            continue
+        digest = hashlib.sha256()
+        with open(blob_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        if digest.hexdigest() != info['sha256']:
+            problems.append(f"{rel_path}: 数据块已损坏")
+    return problems
+
+
+def restore_backup(backup_dir, backup_id, target_dir, overwrite=False):
+    """把备份恢复到目标目录，每个文件写入前校验哈希，返回恢复的文件数
+
+    目标目录不为空时需要 overwrite=True，此时备份之后新增的文件会被删除，
+    目录内容与备份时完全一致。
+    """
+    manifest = load_manifest(backup_dir, backup_id)
+    if os.path.isdir(target_dir) and os.listdir(target_dir) and not overwrite:
+        raise ValueError(f"目标目录不为空: {target_dir}")
+    problems = verify_backup(backup_dir, backup_id)
+    if problems:
+        raise ValueError("备份校验失败: " + "; ".join(problems[:5]))
+
+    os.makedirs(target_dir, exist_ok=True)
+    for rel_path, info in manifest['files'].items():
+        file_path = os.path.join(target_dir, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = file_path + '.restoring'
+        shutil.copyfile(_blob_path(backup_dir, info['sha256']), tmp_path)
+        os.replace(tmp_path, file_path)
+        os.utime(file_path, ns=(info['mtime_ns'], info['mtime_ns']))
+    if overwrite:
+        for rel_path, _ in list(iter_data_files(target_dir)):
+            if rel_path not in manifest['files']:
+                os.remove(os.path.join(target_dir, *rel_path.split('/')))
+    return len(manifest['files'])
+
+
+def select_retained(manifests, keep_last=0, keep_daily=0, keep_weekly=0, keep_monthly=0):
+    """按保留策略选出需要保留的备份编号：最近N次，以及每天/周/月的最后一次"""
+    ordered = sorted(manifests, key=lambda m: m['time'], reverse=True)
+    keep = {m['id'] for m in ordered[:keep_last]}
+    periods = [
+        (lambda t: t.date(), keep_daily),
+        (lambda t: t.isocalendar()[:2], keep_weekly),
+        (lambda t: (t.year, t.month), keep_monthly),
+    ]
+    for period_of, count in periods:
+        seen = set()
+        for manifest in ordered:
+            period = period_of(datetime.fromisoformat(manifest['time']))
+            if period not in seen and len(seen) < count:
+                seen.add(period)
+                keep.add(manifest['id'])
+    return keep
+
+
+def prune_backups(backup_dir=BACKUP_DIR, lock=None, **retention):
+    """删除保留策略之外的备份，再删除不再被任何备份引用的数据块，返回 (删除的备份, 释放的字节数)"""
+    retention = {**DEFAULT_RETENTION, **retention}
+    with lock or nullcontext():
+        manifests = list_backups(backup_dir)
+        keep = select_retained(manifests, **retention)
+        removed = []
+        for manifest in manifests:
+            if manifest['id'] not in keep:
+                os.remove(os.path.join(_manifest_dir(backup_dir), f"{manifest['id']}.json"))
+                removed.append(manifest['id'])
+
+        referenced = {info['sha256'] for m in manifests if m['id'] in keep for info in m['files'].values()}
+        freed = 0
+        recent = time.time() - RECENT_BLOB_SECONDS
+        blobs_dir = os.path.join(backup_dir, "blobs")
+        for root, _, names in os.walk(blobs_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if name not in referenced and os.path.getmtime(path) < recent:
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return removed, freed
+
+
+class BackupScheduler:
+    """后台定时备份：距上次备份超过间隔时自动备份并执行保留策略"""
+
+    def __init__(self, data_dir=DATA_DIR, backup_dir=BACKUP_DIR, interval_hours=24,
+                 retention=None, before_backup=None, check_seconds=60, lock=None):
+        self.data_dir = data_dir
+        self.backup_dir = backup_dir
+        # 备份和清理时持有的锁，不传时使用自己的锁
+        self.lock = lock or threading.Lock()
+        self.interval = interval_hours * 3600
+        self.retention = retention or {}
+        # 备份前调用，例如等待后台写入队列写完
+        self.before_backup = before_backup
+        self.check_seconds = check_seconds
+        self.last_backup = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
+        backups = list_backups(backup_dir)
+        if backups:
+            self.last_backup = backups[-1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def due(self):
+        if self.last_backup is None:
+            return True
+        elapsed = (datetime.now() - datetime.fromisoformat(self.last_backup['time'])).total_seconds()
+        return elapsed >= self.interval
+
+    def run_now(self):
+        if self.before_backup:
+            self.before_backup()
+        try:
+            self.last_backup = create_backup(self.data_dir, self.backup_dir, self.lock)
+            prune_backups(self.backup_dir, self.lock, **self.retention)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+        return self.last_backup
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.due():
+                self.run_now()
+            self._stop.wait(self.check_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量备份数据目录")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="数据目录")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR, help="备份目录")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="立即备份")
+    commands.add_parser("list", help="列出备份")
+    verify = commands.add_parser("verify", help="校验备份")
+    verify.add_argument("backup_id")
+    restore = commands.add_parser("restore", help="恢复备份")
+    restore.add_argument("backup_id")
+    restore.add_argument("target_dir")
+    restore.add_argument("--overwrite", action="store_true", help="覆盖不为空的目标目录")
+    prune = commands.add_parser("prune", help="按保留策略删除旧备份")
+    schedule = commands.add_parser("schedule", help="前台定时备份")
+    schedule.add_argument("--hours", type=float, default=24, help="备份间隔（小时）")
+    for sub in (prune, schedule):
+        for name, value in DEFAULT_RETENTION.items():
+            sub.add_argument(f"--{name.replace('_', '-')}", type=int, default=value)
+    args = parser.parse_args()
+
+    if args.command == "create":
+        manifest = create_backup(args.data_dir, args.backup_dir)
+        print(f"✅ 备份完成: {manifest['id']}，{manifest['文件数']} 个文件，"
+              f"读取 {manifest['读取文件数']} 个，新增 {manifest['新增大小'] / 1024 / 1024:.1f} MB，"
+              f"耗时 {manifest['耗时']:.1f} 秒")
+    elif args.command == "list":
+        for manifest in list_backups(args.backup_dir):
+            print(f"{manifest['id']}  {manifest['文件数']} 个文件  "
+                  f"{manifest['总大小'] / 1024 / 1024:.1f} MB  新增 {manifest['新增大小'] / 1024 / 1024:.1f} MB")
+    elif args.command == "verify":
+        problems = verify_backup(args.backup_dir, args.backup_id)
+        for problem in problems:
+            print(f"❌ {problem}")
+        print("✅ 备份完好" if not problems else f"❌ 发现 {len(problems)} 个问题")
+    elif args.command == "restore":
+        count = restore_backup(args.backup_dir, args.backup_id, args.target_dir, args.overwrite)
+        print(f"✅ 已恢复 {count} 个文件到 {args.target_dir}")
+    else:
+        retention = {name: getattr(args, name) for name in DEFAULT_RETENTION}
+        if args.command == "prune":
+            removed, freed = prune_backups(args.backup_dir, **retention)
+            print(f"✅ 删除 {len(removed)} 个备份，释放 {freed / 1024 / 1024:.1f} MB")
+        else:
+            scheduler = BackupScheduler(args.data_dir, args.backup_dir, args.hours, retention)
+            print(f"⏰ 每 {args.hours} 小时备份一次，按 Ctrl+C 停止")
+            try:
+                scheduler._run()
+            except KeyboardInterrupt:
+                print("\n👋 已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+批量报价模块
+遍历文件夹或压缩包中的模型文件，用进程池并行获取克重，
+与打印材料/配件/包装表关联后生成一份汇总报价单。
+任务进度逐条写入结果文件，可以随时取消，之后从中断处继续。
+"""
+
+import json
+import os
+import threading
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import pandas as pd
+
+from model_weight import MODEL_EXTENSIONS, estimate_model_weight
+
+JOB_FILE = "job.json"
+RESULTS_FILE = "results.jsonl"
+QUOTE_FILE = "批量报价单.xlsx"
+
+# 任务状态
+STATUS_PENDING = "待运行"
+STATUS_RUNNING = "运行中"
+STATUS_CANCELLED = "已取消"
+STATUS_INTERRUPTED = "已中断"
+STATUS_DONE = "已完成"
+STATUS_FAILED = "失败"
+
+# 运行中的任务检查取消请求的间隔（秒）
+CANCEL_CHECK_SECONDS = 0.2
+
+# 当前进程中正在运行的任务，按任务目录索引
+_running_jobs = {}
+_running_lock = threading.Lock()
+
+
+def collect_model_files(source_dir):
+    """递归查找文件夹中的模型文件，返回排序后的相对路径列表"""
+    files = []
+    for root, dirs, names in os.walk(source_dir):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__MACOSX']
+        for name in names:
+            if not name.startswith('.') and name.lower().endswith(MODEL_EXTENSIONS):
+                files.append(os.path.relpath(os.path.join(root, name), source_dir))
+    return sorted(files)
+
+
+def extract_model_zip(zip_source, target_dir):
+    """解压压缩包中的模型文件，忽略目录穿越路径"""
+    target_root = os.path.realpath(target_dir)
+    with zipfile.ZipFile(zip_source) as archive:
+        for member in archive.infolist():
+            name = member.filename
+            if member.is_dir() or not name.lower().endswith(MODEL_EXTENSIONS):
+                continue
+            destination = os.path.realpath(os.path.join(target_root, name))
+            if not destination.startswith(target_root + os.sep):
+                continue
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with archive.open(member) as src, open(destination, 'wb') as dst:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+
+
+def _terminate_pool(pool):
+    """取消尚未开始的文件，结束正在处理文件的工作进程并等待它们退出。
+    ProcessPoolExecutor 在 Python 3.14 之前没有结束工作进程的公开接口，这里直接使用它的进程表"""
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+def _weigh_file(source_dir, relative_path, density, infill, shell_ratio):
+    """在工作进程中获取单个文件的克重"""
+    result = {'文件': relative_path, '克重': None, '克重来源': '', '体积': None, '错误': ''}
+    try:
+        result.update(estimate_model_weight(os.path.join(source_dir, relative_path),
+                                            density, infill, shell_ratio))
+    except Exception as e:
+        result['错误'] = str(e) or type(e).__name__
+    return result
+
+
+class BatchQuoteJob:
+    """一个批量报价任务，状态保存在任务目录中"""
+
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        with open(os.path.join(job_dir, JOB_FILE), encoding='utf-8') as f:
+            self.config = json.load(f)
+        self._cancel_event = threading.Event()
+        self._thread = None
+        self.done = len(self.load_results())
+
+    @classmethod
+    def create(cls, jobs_dir, name, source_dir, material, accessories, packaging,
+               density, infill, shell_ratio):
+        """创建任务目录并记录任务参数和待处理文件列表"""
+        # 时间前缀用于按创建顺序排列，随机后缀避免同一秒内创建的任务使用同一个目录
+        job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        safe_name = ''.join(c for c in name if c.isalnum() or c in '-_') or 'batch'
+        job_dir = os.path.join(jobs_dir, f"{job_id}_{safe_name}")
+        os.makedirs(job_dir, exist_ok=True)
+        config = {
+            '名称': name,
+            '创建时间': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            '模型目录': os.path.abspath(source_dir),
+            '文件列表': collect_model_files(source_dir),
+            '打印材料': material,
+            '产品配件': list(accessories),
+            '包装': list(packaging),
+            '密度': density,
+            '填充率': infill,
+            '外壳占比': shell_ratio,
+            '状态': STATUS_PENDING,
+        }
+        with open(os.path.join(job_dir, JOB_FILE), 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        return cls(job_dir)
+
+    @property
+    def total(self):
+        return len(self.config['文件列表'])
+
+    @property
+    def status(self):
+        status = self.config.get('状态', STATUS_PENDING)
+        # 进程重启后，记录为运行中但实际没有在运行的任务视为中断
+        if status == STATUS_RUNNING and not self.is_running():
+            return STATUS_INTERRUPTED
+        return status
+
+    @property
+    def quote_path(self):
+        return os.path.join(self.job_dir, QUOTE_FILE)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _save_config(self):
+        with open(os.path.join(self.job_dir, JOB_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.config, f, ensure_ascii=False, indent=2)
+
+    def load_results(self):
+        """读取已完成的文件结果，忽略中断时写了一半的最后一行"""
+        results = {}
+        results_path = os.path.join(self.job_dir, RESULTS_FILE)
+        if os.path.exists(results_path):
+            with open(results_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    results[record['文件']] = record
+        return results
+
+    def cancel(self):
+        """请求取消任务：尚未开始的文件不再处理，已完成的结果会保留，之后可以继续"""
+        self._cancel_event.set()
+
+    def start(self, max_workers=None):
+        """在后台线程中运行任务（已在运行则直接返回）"""
+        with _running_lock:
+            if self.is_running():
+                return
+            self._cancel_event.clear()
+            self._thread = threading.Thread(target=self.run, args=(max_workers,), daemon=True)
+            _running_jobs[os.path.abspath(self.job_dir)] = self
+            self._thread.start()
+
+    def run(self, max_workers=None):
+        """处理所有未完成的文件，全部完成时返回 True；取消或失败时返回 False"""
+        completed = self.load_results()
+        pending = [f for f in self.config['文件列表'] if f not in completed]
+        self.done = len(completed)
+        self.config['状态'] = STATUS_RUNNING
+        self.config.pop('错误', None)
+        self._save_config()
+
+        source_dir = self.config['模型目录']
+        params = (self.config['密度'], self.config['填充率'], self.config['外壳占比'])
+        results_path = os.path.join(self.job_dir, RESULTS_FILE)
+        remaining = set()
+        try:
+            if pending:
+                pool = ProcessPoolExecutor(max_workers=max_workers)
+                try:
+                    with open(results_path, 'a', encoding='utf-8') as results_file:
+                        remaining = {pool.submit(_weigh_file, source_dir, f, *params) for f in pending}
+                        # 定时检查取消请求，不必等到正在处理的文件完成
+                        while remaining and not self._cancel_event.is_set():
+                            finished, remaining = wait(remaining, timeout=CANCEL_CHECK_SECONDS,
+                                                       return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                # 工作进程异常退出时抛出 BrokenProcessPool
+                                results_file.write(json.dumps(future.result(), ensure_ascii=False) + '\n')
+                                results_file.flush()
+                                self.done += 1
+                finally:
+                    # 取消或失败时不等待正在处理的文件：结束工作进程，全部退出后才记录任务状态
+                    if remaining:
+                        _terminate_pool(pool)
+                    else:
+                        pool.shutdown()
+        except Exception as e:
+            self.config['状态'] = STATUS_FAILED
+            self.config['错误'] = str(e) or type(e).__name__
+            self._save_config()
+            return False
+
+        cancelled = bool(remaining)
+        self.config['状态'] = STATUS_CANCELLED if cancelled else STATUS_DONE
+        self._save_config()
+        return not cancelled
+
+    def results_dataframe(self):
+        """按文件列表顺序返回结果表"""
+        results = self.load_results()
+        rows = [results[f] for f in self.config['文件列表'] if f in results]
+        return pd.DataFrame(rows, columns=['文件', '克重', '克重来源', '体积', '错误'])
+
+    def build_quote(self, materials_df, accessories_df, packaging_df):
+        """把克重结果与材料/配件/包装表关联，生成汇总报价单，返回文件路径"""
+        results_df = self.results_dataframe()
+        failed_df = results_df[results_df['错误'] != ''][['文件', '错误']]
+        quote_df = results_df[results_df['错误'] == ''].drop(columns=['错误'])
+        quote_df['打印材料'] = self.config['打印材料']
+
+        material_costs = materials_df[['名称', '每克成本']].rename(columns={'名称': '打印材料'})
+        quote_df = quote_df.merge(material_costs.drop_duplicates('打印材料'), on='打印材料', how='left')
+        quote_df['打印材料成本'] = quote_df['克重'] * quote_df['每克成本']
+
+        # 配件按每个模型计算，包装按整单计算一次
+        accessories_cost = accessories_df.loc[
+            accessories_df['名称'].isin(self.config['产品配件']), '每单位成本'].sum()
+        packaging_cost = packaging_df.loc[
+            packaging_df['名称'].isin(self.config['包装']), '每单位成本'].sum()
+        quote_df['配件成本'] = accessories_cost
+        quote_df['单件成本'] = quote_df['打印材料成本'] + quote_df['配件成本']
+
+        summary_df = pd.DataFrame([
+            ('任务名称', self.config['名称']),
+            ('打印材料', self.config['打印材料']),
+            ('产品配件', ','.join(self.config['产品配件'])),
+            ('包装', ','.join(self.config['包装'])),
+            ('文件数', len(quote_df)),
+            ('失败文件数', len(failed_df)),
+            ('总克重', quote_df['克重'].sum()),
+            ('打印材料成本合计', quote_df['打印材料成本'].sum()),
+            ('配件成本合计', quote_df['配件成本'].sum()),
+            ('包装成本', packaging_cost),
+            ('总成本', quote_df['单件成本'].sum() + packaging_cost),
+        ], columns=['项目', '数值'])
+
+        with pd.ExcelWriter(self.quote_path, engine='xlsxwriter') as writer:
+            summary_df.to_excel(writer, sheet_name='汇总', index=False)
+            quote_df.to_excel(writer, sheet_name='报价明细', index=False)
+            if not failed_df.empty:
+                failed_df.to_excel(writer, sheet_name='失败文件', index=False)
+        return self.quote_path
+
+
+def load_job(job_dir):
+    """获取任务对象，正在运行的任务返回同一个实例"""
+    with _running_lock:
+        job = _running_jobs.get(os.path.abspath(job_dir))
+    return job if job is not None else BatchQuoteJob(job_dir)
+
+
+def list_jobs(jobs_dir):
+    """列出所有任务目录，最新的在前"""
+    if not os.path.isdir(jobs_dir):
+        return []
+    names = [n for n in os.listdir(jobs_dir) if os.path.exists(os.path.join(jobs_dir, n, JOB_FILE))]
+    return [os.path.join(jobs_dir, n) for n in sorted(names, reverse=True)]
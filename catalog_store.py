@@ -0,0 +1,314 @@
+"""
+共享数据目录模块
+整个进程只保存一份打印材料/配件/包装数据（不可变快照，带版本号），所有会话共享；
+保存时生成新快照并整体替换，会话只需要记住自己看到的版本号。
+配置了后台写入队列时，保存只更新内存中的快照，文件由队列在后台写入；
+配置了变更日志时，按行添加/修改/删除会先写入日志，可以撤销或恢复到任意时间点；
+配置了价格历史时，单价有变化的名称会追加到价格序列中；
+配置了全文索引时，每次发布新版本都把变化的名称同步到索引。
+数据文件被外部修改时（由文件监视通知），只重新读取这一张表并发布新版本；
+自己写入的文件会记住写入后的修改时间和大小，收到通知时不会重新读取
+"""
+
+import os
+import threading
+from types import MappingProxyType
+
+import pandas as pd
+
+from file_watcher import file_signature
+from history_store import load_history_records, save_history_records, clear_history_records
+from journal import diff_values, frame_to_rows, row_to_json
+from metrics import REGISTRY
+from schema import apply_schema, prepare_for_save, memory_report, set_row_values
+
+
+CATALOG_READ_SECONDS = REGISTRY.histogram('catalog_read_seconds', '读取一个数据文件并转换列类型的耗时', ['file'])
+CATALOG_WRITE_SECONDS = REGISTRY.histogram('catalog_write_seconds', '写入一个数据文件的耗时', ['file'])
+CATALOG_READ_ERRORS = REGISTRY.counter('catalog_read_errors', '数据文件读取失败次数', ['file'])
+CATALOG_SAVES = REGISTRY.counter('catalog_saves', '数据表保存次数（发布新版本）', ['table'])
+
+
+def read_catalog(file_path, schema):
+    """读取Excel数据表并转换列类型，返回 (DataFrame, 内存报告)"""
+    if not os.path.exists(file_path):
+        return pd.DataFrame(), None
+    file_name = os.path.basename(file_path)
+    with CATALOG_READ_SECONDS.time(file=file_name):
+        try:
+            raw_df = pd.read_excel(file_path)
+        except Exception:
+            CATALOG_READ_ERRORS.inc(file=file_name)
+            return pd.DataFrame(), None
+        df = apply_schema(raw_df, schema)
+    return df, memory_report(file_name, raw_df, df)
+
+
+def write_catalog(df, file_path):
+    """先写临时文件再替换，其他读取者不会读到写了一半的文件"""
+    root, extension = os.path.splitext(file_path)
+    tmp_path = f"{root}.tmp{extension}"
+    with CATALOG_WRITE_SECONDS.time(file=os.path.basename(file_path)):
+        prepare_for_save(df).to_excel(tmp_path, index=False)
+        os.replace(tmp_path, file_path)
+
+
+class CatalogSnapshot:
+    """某一版本的全部数据表，只读，调用方修改前需要先copy()"""
+
+    __slots__ = ('version', 'tables', '_derived', '_derived_lock')
+
+    def __init__(self, version, tables):
+        self.version = version
+        self.tables = MappingProxyType(dict(tables))
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def get(self, name):
+        return self.tables[name]
+
+    def derived(self, key, build):
+        """由数据表计算出的结果（如成本表、索引），每个版本只计算一次"""
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = build()
+            return self._derived[key]
+
+
+def apply_entry(df, entry):
+    """在DataFrame上执行一条日志操作（位置为行号），返回新的DataFrame"""
+    op, position = entry['op'], entry.get('position')
+    if op == 'insert':
+        new_row = pd.DataFrame([entry['after']])
+        return pd.concat([df.iloc[:position], new_row, df.iloc[position:]], ignore_index=True)
+    if op == 'delete':
+        return df.drop(df.index[position])
+    if op == 'update':
+        df = df.copy()
+        set_row_values(df, df.index[position], entry['after'])
+        return df
+    if op == 'replace':
+        return pd.DataFrame(entry['rows'], columns=list(df.columns) or None)
+    raise ValueError(f"未知的操作: {op}")
+
+
+class CatalogStore:
+    """进程内共享的数据目录"""
+
+    def __init__(self, tables, history_file=None, write_queue=None, journal=None, price_history=None,
+                 search_index=None, history_lock=None):
+        # tables: 名称 -> (文件路径, 列类型定义)
+        self.table_files = dict(tables)
+        self.history_file = history_file
+        # 写入历史记录时持有的锁，与维护历史分区的线程共用
+        self.history_lock = history_lock
+        self.write_queue = write_queue
+        self.journal = journal
+        self.price_history = price_history
+        self.search_index = search_index
+        self.memory_reports = {}
+        self._lock = threading.RLock()
+        # 数据文件的写入和外部修改检查互斥，_signatures 为每张表最后读取/写入时的文件签名
+        self._files_lock = threading.Lock()
+        self._signatures = {}
+        self._history = None
+        loaded = {}
+        for name, (file_path, schema) in self.table_files.items():
+            self._signatures[name] = file_signature(file_path)
+            loaded[name] = self._read(name, file_path, schema)
+        self._snapshot = CatalogSnapshot(1, loaded)
+        if search_index is not None:
+            for name, df in loaded.items():
+                search_index.update(name, df)
+
+    def _read(self, name, file_path, schema):
+        df, report = read_catalog(file_path, schema)
+        if report is not None:
+            self.memory_reports[name] = report
+        return df
+
+    @property
+    def snapshot(self):
+        """当前快照（读取引用本身是原子操作，不需要加锁）"""
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def get(self, name):
+        return self._snapshot.get(name)
+
+    def _replace(self, name, df):
+        tables = dict(self._snapshot.tables)
+        tables[name] = df
+        self._snapshot = CatalogSnapshot(self._snapshot.version + 1, tables)
+        if self.search_index is not None:
+            self.search_index.update(name, df)
+
+    def _write_file(self, name, df):
+        file_path = self.table_files[name][0]
+        with self._files_lock:
+            write_catalog(df, file_path)
+            self._signatures[name] = file_signature(file_path)
+
+    def _commit(self, name, df):
+        file_path, schema = self.table_files[name]
+        if self.write_queue is None:
+            self._write_file(name, df)
+        before = self._snapshot.get(name)
+        self._replace(name, apply_schema(df, schema))
+        CATALOG_SAVES.inc(table=name)
+        if self.price_history is not None:
+            self.price_history.record_changes(name, before, self._snapshot.get(name))
+        if self.write_queue is not None:
+            self.write_queue.submit(name, lambda data: self._write_file(name, data), df)
+        return self._snapshot.version
+
+    def _record(self, name, entry):
+        if self.journal is not None:
+            self.journal.record(name, self._snapshot.get(name), entry)
+
+    def save(self, name, df):
+        """保存一张表并发布新版本（有写入队列时文件在后台写入），日志中记为整表替换"""
+        with self._lock:
+            self._record(name, {'op': 'replace', 'rows': frame_to_rows(df)})
+            return self._commit(name, df)
+
+    def insert_row(self, name, values):
+        """在表末尾添加一行"""
+        with self._lock:
+            df = self._snapshot.get(name)
+            entry = {'op': 'insert', 'position': len(df), 'after': row_to_json(values)}
+            self._record(name, entry)
+            return self._commit(name, apply_entry(df, entry))
+
+    def update_row(self, name, index, values, image=None):
+        """修改一行（index为行标签），日志只记录变化的字段；image为被替换图片在回收站中的信息"""
+        with self._lock:
+            df = self._snapshot.get(name)
+            position = df.index.get_loc(index)
+            before, after = diff_values(row_to_json(df.iloc[position]), row_to_json(values))
+            if not after and image is None:
+                return self._snapshot.version
+            entry = {'op': 'update', 'position': position, 'before': before, 'after': after}
+            if image:
+                entry['image'] = image
+            self._record(name, entry)
+            return self._commit(name, apply_entry(df, entry))
+
+    def delete_row(self, name, index, image=None):
+        """删除一行（index为行标签）；image为已移入回收站的图片信息"""
+        with self._lock:
+            df = self._snapshot.get(name)
+            position = df.index.get_loc(index)
+            entry = {'op': 'delete', 'position': position, 'before': row_to_json(df.iloc[position])}
+            if image:
+                entry['image'] = image
+            self._record(name, entry)
+            return self._commit(name, apply_entry(df, entry))
+
+    def undo(self, name, count=1):
+        """撤销最近 count 次修改，返回实际撤销的次数"""
+        if self.journal is None:
+            return 0
+        with self._lock:
+            plan = self.journal.undo_plan(name, count)
+            if not plan:
+                return 0
+            df = self._snapshot.get(name)
+            for entry in plan:
+                self._record(name, entry)
+                df = apply_entry(df, entry)
+                # 撤销删除或图片替换时，把原来的图片放回去
+                if entry['op'] in ('insert', 'update'):
+                    self.journal.restore_image(entry.get('image'))
+            self._commit(name, df)
+            return len(plan)
+
+    def restore(self, name, when):
+        """把一张表恢复到指定时间点（作为一次整表替换记录，之后仍可恢复到更晚的时间）"""
+        if self.journal is None:
+            raise ValueError("没有配置变更日志")
+        with self._lock:
+            rows = self.journal.replay(name, until=when)
+            if rows is None:
+                raise ValueError("这张表还没有变更记录")
+            # 之后删除或替换掉的图片放回原位置；从新到旧处理，同一位置最后放回的是时间点当时的图片
+            for entry in reversed(self.journal.entries_after(name, when)):
+                if entry['op'] == 'delete' or (entry['op'] == 'update' and 'undo_of' not in entry):
+                    self.journal.restore_image(entry.get('image'))
+            columns = list(self._snapshot.get(name).columns) or None
+            return self.save(name, pd.DataFrame(rows, columns=columns))
+
+    def reload(self, name):
+        """重新从文件读取一张表并发布新版本"""
+        file_path, schema = self.table_files[name]
+        with self._lock:
+            self._signatures[name] = file_signature(file_path)
+            self._replace(name, self._read(name, file_path, schema))
+        return self._snapshot.version
+
+    def reload_if_changed(self, name):
+        """文件与最后一次读取/写入时不同（被外部修改）时重新读取，日志中记为整表替换。
+        返回新版本号，没有变化时返回 None。
+        这张表还有尚未写入的修改时不读取：内存中的数据更新，稍后写入文件时会覆盖外部修改"""
+        file_path, schema = self.table_files[name]
+        if self.write_queue is not None and self.write_queue.is_pending(name):
+            return None
+        with self._files_lock:
+            signature = file_signature(file_path)
+            if signature == self._signatures.get(name):
+                return None
+            df, report = read_catalog(file_path, schema)
+            if report is None:
+                # 文件被删除或正在保存、暂时无法读取，保留当前数据，等下一次通知
+                return None
+            self._signatures[name] = signature
+        with self._lock:
+            self.memory_reports[name] = report
+            self._record(name, {'op': 'replace', 'rows': frame_to_rows(df), 'source': '外部修改'})
+            before = self._snapshot.get(name)
+            self._replace(name, df)
+            if self.price_history is not None:
+                self.price_history.record_changes(name, before, df)
+            return self._snapshot.version
+
+    def file_changed(self, file_name):
+        """文件监视的回调：重新读取对应的表，返回重新读取了的表名"""
+        return [name for name, (file_path, _) in self.table_files.items()
+                if os.path.basename(file_path) == file_name and self.reload_if_changed(name) is not None]
+
+    def history(self, start=None, end=None):
+        """共享的类型化历史记录，第一次使用时加载；
+        指定日期范围时只读取重叠的月份分区，不使用也不改变共享的全部记录"""
+        if start or end:
+            return load_history_records(self.history_file, start, end)
+        with self._lock:
+            if self._history is None:
+                self._history = load_history_records(self.history_file)
+                self.memory_reports['history'] = self._history.memory_report
+            return self._history
+
+    def invalidate_history(self):
+        """历史记录变化后调用，下次使用时重新加载"""
+        with self._lock:
+            self._history = None
+
+    def _write_history(self, records):
+        save_history_records(records, self.history_file, self.history_lock)
+        self.invalidate_history()
+
+    def append_history(self, record):
+        """追加一条历史记录（有写入队列时在后台与其他记录合并写入）"""
+        if self.write_queue is None:
+            self._write_history([record])
+        else:
+            self.write_queue.submit_append('history', self._write_history, record)
+
+    def clear_history(self):
+        """清空历史记录，先等待尚未写入的记录写完，保证顺序"""
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        clear_history_records(self.history_file, self.history_lock)
+        self.invalidate_history()
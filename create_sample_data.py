@@ -7,12 +7,12 @@
 import pandas as pd
 import os
 from datetime import datetime, timedelta
+from migrations import reset_schema_version, run_migrations
 
-def create_sample_data():
-    """创建示例数据"""
+def create_sample_data(data_dir="data"):
+    """在 data_dir 中创建示例数据"""
     
     # 确保数据目录存在
-    data_dir = "data"
     os.makedirs(data_dir, exist_ok=True)
     
     # 示例打印材料数据
@@ -130,8 +130,12 @@ def create_sample_data():
     accessories_df.to_excel(os.path.join(data_dir, "accessories.xlsx"), index=False)
     packaging_df.to_excel(os.path.join(data_dir, "packaging.xlsx"), index=False)
     
+    # 示例数据是旧版结构，重新执行数据结构迁移
+    reset_schema_version(data_dir)
+    run_migrations(data_dir)
+    
     print("✅ 示例数据创建完成！")
-    print("📁 数据文件保存在 data/ 目录下：")
+    print(f"📁 数据文件保存在 {data_dir}/ 目录下：")
     print("   - print_materials.xlsx (打印材料)")
     print("   - accessories.xlsx (产品配件)")
     print("   - packaging.xlsx (包装)")
@@ -0,0 +1,161 @@
+"""
+数据导出模块
+按块流式读取数据（Excel使用openpyxl只读模式，内存中的表按块切片，按月分区的历史记录每次读取一个分区），
+过滤后逐行写入CSV或xlsx（xlsxwriter constant_memory模式），
+导出过程的内存占用与数据量无关
+"""
+
+import csv
+import os
+from datetime import date, datetime
+
+import pandas as pd
+import xlsxwriter
+from openpyxl import load_workbook
+
+from history_store import HISTORY_COLUMNS, iter_history_frames, partitions_dir
+
+CHUNK_SIZE = 5000
+
+EXPORT_FORMATS = {
+    'CSV': '.csv',
+    'Excel': '.xlsx',
+}
+
+
+def iter_excel_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """流式读取Excel，先返回表头，再按块返回数据行"""
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield list(header)
+        chunk = []
+        for row in rows:
+            chunk.append(list(row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def iter_frame_chunks(df, chunk_size=CHUNK_SIZE):
+    """按块读取内存中的DataFrame，格式与iter_excel_chunks相同"""
+    yield list(df.columns)
+    for start in range(0, len(df), chunk_size):
+        part = df.iloc[start:start + chunk_size].astype(object)
+        yield part.where(part.notna(), None).values.tolist()
+
+
+def iter_partition_chunks(frames, chunk_size=CHUNK_SIZE):
+    """按块读取依次返回的分区数据，格式与iter_excel_chunks相同"""
+    yield HISTORY_COLUMNS
+    for df in frames:
+        chunks = iter_frame_chunks(df.reindex(columns=HISTORY_COLUMNS), chunk_size)
+        next(chunks)
+        yield from chunks
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, str) and value:
+        try:
+            return pd.Timestamp(value).to_pydatetime()
+        except ValueError:
+            return None
+    return None
+
+
+def make_row_filter(header, date_column=None, start=None, end=None, value_filters=None):
+    """生成行过滤函数：日期范围（包含首尾两天）和按列取值过滤"""
+    checks = []
+    if date_column in header and (start or end):
+        index = header.index(date_column)
+        start_dt = _to_datetime(start) if start else None
+        end_dt = _to_datetime(end) if end else None
+
+        def in_range(row):
+            value = _to_datetime(row[index])
+            if value is None:
+                return False
+            if start_dt and value < start_dt:
+                return False
+            return not (end_dt and value.date() > end_dt.date())
+        checks.append(in_range)
+    for column, allowed in (value_filters or {}).items():
+        if column in header and allowed:
+            index = header.index(column)
+            allowed = set(allowed)
+            checks.append(lambda row, index=index, allowed=allowed: row[index] in allowed)
+    return lambda row: all(check(row) for check in checks)
+
+
+def export_chunks(chunks, out_path, row_filter_options=None):
+    """把 iter_*_chunks 的输出过滤后写入CSV或xlsx，返回导出的行数"""
+    header = next(chunks, None)
+    if header is None:
+        header = []
+    row_filter = make_row_filter(header, **(row_filter_options or {}))
+    count = 0
+    if out_path.lower().endswith('.csv'):
+        # utf-8-sig 让Excel正确识别中文
+        with open(out_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for chunk in chunks:
+                rows = [row for row in chunk if row_filter(row)]
+                writer.writerows(rows)
+                count += len(rows)
+        return count
+
+    # 链接/备注按普通文本写入，不转换为公式或超链接
+    workbook = xlsxwriter.Workbook(out_path, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    try:
+        sheet = workbook.add_worksheet()
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+        bold = workbook.add_format({'bold': True})
+        sheet.write_row(0, 0, header, bold)
+        for chunk in chunks:
+            for row in chunk:
+                if not row_filter(row):
+                    continue
+                count += 1
+                for col, value in enumerate(row):
+                    if isinstance(value, (datetime, date, pd.Timestamp)):
+                        sheet.write_datetime(count, col, _to_datetime(value), date_format)
+                    elif value is None or (isinstance(value, float) and value != value):
+                        continue
+                    else:
+                        sheet.write(count, col, value)
+    finally:
+        workbook.close()
+    return count
+
+
+def export_file(file_path, out_path, **row_filter_options):
+    """流式导出Excel数据文件；按月分区的历史记录只读取与日期范围重叠的分区"""
+    if os.path.isdir(partitions_dir(file_path)):
+        frames = iter_history_frames(file_path, row_filter_options.get('start'), row_filter_options.get('end'))
+        return export_chunks(iter_partition_chunks(frames), out_path, row_filter_options)
+    if not os.path.exists(file_path):
+        return export_chunks(iter([]), out_path, row_filter_options)
+    return export_chunks(iter_excel_chunks(file_path), out_path, row_filter_options)
+
+
+def export_frame(df, out_path, **row_filter_options):
+    """按块导出内存中的数据表"""
+    return export_chunks(iter_frame_chunks(df), out_path, row_filter_options)
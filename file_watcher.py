@@ -0,0 +1,136 @@
+"""
+数据文件监视模块
+在后台线程中监视数据目录，某个数据文件被外部程序（如直接用Excel编辑）修改后，
+短时间内的多次修改合并为一次，再调用回调重新读取这一个文件。
+Linux 上使用 inotify（通过 ctypes 调用，不需要额外依赖），其他系统或 inotify 不可用时定时比较文件的修改时间和大小
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+# inotify 事件：写入后关闭、改名移入（先写临时文件再替换）、删除
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_DEBOUNCE = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def file_signature(file_path):
+    """文件的 (修改时间, 大小)，文件不存在时返回 None"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _open_inotify(watch_dir):
+    """创建 inotify 并监视目录，返回文件描述符；不支持时返回 None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(watch_dir), WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def parse_events(data):
+    """解析 inotify 读取到的事件，返回发生变化的文件名"""
+    names = []
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+        _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        if name:
+            names.append(os.fsdecode(name))
+    return names
+
+
+class FileWatcher:
+    """监视目录中的指定文件，文件变化时调用 on_change(文件名)"""
+
+    def __init__(self, watch_dir, file_names, on_change, poll_interval=DEFAULT_POLL_INTERVAL,
+                 debounce=DEFAULT_DEBOUNCE, use_inotify=True):
+        self.watch_dir = watch_dir
+        self.file_names = set(file_names)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_inotify = use_inotify
+        self.mode = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            fd = _open_inotify(self.watch_dir) if self.use_inotify else None
+            self.mode = 'inotify' if fd is not None else '轮询'
+            target = self._run_inotify if fd is not None else self._run_polling
+            args = (fd,) if fd is not None else ()
+            self._thread = threading.Thread(target=target, args=args, name="file-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _notify(self, file_name):
+        try:
+            self.on_change(file_name)
+        except Exception as e:
+            # 回调出错不能让监视线程退出
+            logger.exception("数据文件 %s 变化后的处理失败", file_name)
+            self.last_error = f"{file_name}: {e}"
+
+    def _run_inotify(self, fd):
+        # 文件名 -> 最后一次事件时间，安静 debounce 秒后才通知
+        pending = {}
+        try:
+            while not self._stop.is_set():
+                timeout = self.debounce if pending else 1.0
+                readable, _, _ = select.select([fd], [], [], timeout)
+                if readable:
+                    now = time.monotonic()
+                    for name in parse_events(os.read(fd, 64 * 1024)):
+                        if name in self.file_names:
+                            pending[name] = now
+                now = time.monotonic()
+                for name in [n for n, t in pending.items() if now - t >= self.debounce]:
+                    del pending[name]
+                    self._notify(name)
+        finally:
+            os.close(fd)
+
+    def _run_polling(self):
+        signatures = {name: file_signature(os.path.join(self.watch_dir, name)) for name in self.file_names}
+        while not self._stop.wait(self.poll_interval):
+            for name in self.file_names:
+                signature = file_signature(os.path.join(self.watch_dir, name))
+                if signature != signatures[name]:
+                    signatures[name] = signature
+                    self._notify(name)
@@ -0,0 +1,428 @@
+"""
+历史计算记录模块
+历史报价记录按月分区保存在与历史记录文件同名的目录中（如 data/history_costs/2024-03.csv）：
+当月的分区只追加写入，月份结束后由后台合并、排序并压缩为 2024-03.csv.gz，之后不再修改。
+查询只打开与日期范围重叠的分区，保留策略按整个分区归档或删除。
+同时增量维护按日、按材料、按配件/包装的汇总表，统计图表只读取这些很小的汇总表，不需要每次扫描全部历史记录
+"""
+
+import csv
+import json
+import os
+import re
+import shutil
+import threading
+from contextlib import nullcontext
+from datetime import date, datetime
+
+import pandas as pd
+
+from metrics import REGISTRY
+from schema import HISTORY_SCHEMA, TypedHistory, memory_report
+
+HISTORY_APPEND_SECONDS = REGISTRY.histogram('history_append_seconds', '追加历史记录（写入分区和汇总表）的耗时')
+HISTORY_RECORDS = REGISTRY.counter('history_records_appended', '追加的历史记录条数')
+HISTORY_PARTITIONS_READ = REGISTRY.counter('history_partitions_read', '读取的历史分区文件数')
+HISTORY_PARTITIONS_COMPACTED = REGISTRY.counter('history_partitions_compacted', '压缩合并的历史分区数')
+
+# 分区文件的列（固定顺序）；名称列按文本读取，纯数字的名称不会变成数字
+HISTORY_COLUMNS = list(HISTORY_SCHEMA)
+TEXT_DTYPES = {'时间': str, '打印材料': str, '产品配件': str, '包装': str}
+OPEN_SUFFIX = '.csv'
+CLOSED_SUFFIX = '.csv.gz'
+_PARTITION_PATTERN = re.compile(r'^(\d{4}-\d{2})\.csv(\.gz)?$')
+
+# 按日/按材料汇总的数值字段
+DAY_FIELDS = ['报价数', '克重', '打印材料成本', '配件成本', '包装成本', '总成本', '定价数', '售价', '利润']
+MATERIAL_FIELDS = ['报价数', '克重', '打印材料成本', '总成本']
+
+# 汇总表的读取-修改-写入需要互斥（后台写入线程和页面可能同时访问）：
+# 下面修改历史记录的函数都接收 lock 参数，多个线程访问同一份历史记录时传入同一个可重入锁
+# （如工作区的 history_lock），只在一个线程中使用时（命令行工具、测试）可以不传
+
+
+def rollups_path(file_path):
+    """汇总表文件路径（与历史记录文件放在一起）"""
+    return os.path.splitext(file_path)[0] + '_rollups.json'
+
+
+def _empty_rollups():
+    return {'记录数': 0, '按日': {}, '按材料': {}, '配件': {}, '包装': {}}
+
+
+def _number(value):
+    """把空值/NaN转换为0"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if value != value else value
+
+
+def _split_names(value):
+    if not isinstance(value, str) or not value:
+        return []
+    return [name for name in value.split(',') if name]
+
+
+def apply_record_to_rollups(rollups, record, sign=1):
+    """把一条历史记录累加到汇总表中（sign=-1 时减去，用于丢弃分区）"""
+    day = str(record.get('时间', ''))[:10]
+    material = record.get('打印材料')
+    material = material if isinstance(material, str) and material else '未知'
+    price = _number(record.get('售价'))
+
+    day_row = rollups['按日'].setdefault(day, dict.fromkeys(DAY_FIELDS, 0.0))
+    day_row['报价数'] += sign
+    for field in ['克重', '打印材料成本', '配件成本', '包装成本', '总成本']:
+        day_row[field] += sign * _number(record.get(field))
+    if price > 0:
+        day_row['定价数'] += sign
+        day_row['售价'] += sign * price
+        day_row['利润'] += sign * (price - _number(record.get('总成本')))
+
+    material_row = rollups['按材料'].setdefault(material, dict.fromkeys(MATERIAL_FIELDS, 0.0))
+    material_row['报价数'] += sign
+    for field in ['克重', '打印材料成本', '总成本']:
+        material_row[field] += sign * _number(record.get(field))
+
+    for column, key in (('产品配件', '配件'), ('包装', '包装')):
+        counts = rollups[key]
+        for name in _split_names(record.get(column)):
+            counts[name] = counts.get(name, 0) + sign
+            if counts[name] <= 0:
+                del counts[name]
+    if day_row['报价数'] <= 0:
+        del rollups['按日'][day]
+    if material_row['报价数'] <= 0:
+        del rollups['按材料'][material]
+    rollups['记录数'] += sign
+    return rollups
+
+
+def _write_rollups(rollups, file_path):
+    path = rollups_path(file_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(rollups, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def partitions_dir(file_path):
+    """按月分区的目录（与历史记录文件同名，不含扩展名）"""
+    return os.path.splitext(file_path)[0]
+
+
+def record_month(value, default=None):
+    """记录时间所在的月份 'YYYY-MM'，时间无法解析时使用 default（默认为当前月份）"""
+    try:
+        timestamp = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        timestamp = pd.NaT
+    if pd.isna(timestamp):
+        return default or datetime.now().strftime('%Y-%m')
+    return timestamp.strftime('%Y-%m')
+
+
+def list_partitions(file_path):
+    """{月份: [分区文件]}，按月份排序；同一月份中压缩文件在前，之后是压缩后补写的记录"""
+    directory = partitions_dir(file_path)
+    partitions = {}
+    if not os.path.isdir(directory):
+        return partitions
+    for name in os.listdir(directory):
+        match = _PARTITION_PATTERN.match(name)
+        if match:
+            partitions.setdefault(match.group(1), []).append(os.path.join(directory, name))
+    return {month: sorted(paths, key=lambda path: not path.endswith(CLOSED_SUFFIX))
+            for month, paths in sorted(partitions.items())}
+
+
+def select_partitions(file_path, start=None, end=None):
+    """与日期范围（包含首尾两天）重叠的分区 {月份: [分区文件]}，不打开文件"""
+    first = pd.Timestamp(start).strftime('%Y-%m') if start else None
+    last = pd.Timestamp(end).strftime('%Y-%m') if end else None
+    return {month: paths for month, paths in list_partitions(file_path).items()
+            if (first is None or month >= first) and (last is None or month <= last)}
+
+
+def read_partition(path):
+    """读取一个分区文件（压缩文件按扩展名自动解压）"""
+    HISTORY_PARTITIONS_READ.inc()
+    return pd.read_csv(path, dtype=TEXT_DTYPES)
+
+
+def _in_range(times, start=None, end=None):
+    times = pd.to_datetime(times, errors='coerce')
+    mask = pd.Series(True, index=times.index)
+    if start:
+        mask &= times >= pd.Timestamp(start)
+    if end:
+        mask &= times < pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+    return mask
+
+
+def iter_history_frames(file_path, start=None, end=None):
+    """按月依次返回日期范围内的历史记录（配件/包装为逗号拼接字符串，时间为日期时间），每次只读取一个月的分区"""
+    for paths in select_partitions(file_path, start, end).values():
+        df = pd.concat([read_partition(path) for path in paths], ignore_index=True)
+        if start or end:
+            df = df[_in_range(df['时间'], start, end)]
+        df['时间'] = pd.to_datetime(df['时间'], errors='coerce')
+        yield df.reset_index(drop=True)
+
+
+def read_history_frame(file_path, start=None, end=None):
+    """读取日期范围内的历史记录（只打开重叠的分区），返回原始表"""
+    frames = [read_partition(path) for paths in select_partitions(file_path, start, end).values()
+              for path in paths]
+    if not frames:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    df = pd.concat(frames, ignore_index=True)
+    if start or end:
+        df = df[_in_range(df['时间'], start, end)].reset_index(drop=True)
+    return df
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return value
+
+
+def _append_partitions(records, file_path):
+    """按记录时间追加到各月份的分区（只追加，不读取已有记录）"""
+    directory = partitions_dir(file_path)
+    os.makedirs(directory, exist_ok=True)
+    by_month = {}
+    for record in records:
+        by_month.setdefault(record_month(record.get('时间')), []).append(record)
+    for month, rows in by_month.items():
+        path = os.path.join(directory, month + OPEN_SUFFIX)
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=HISTORY_COLUMNS, extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            writer.writerows({column: _csv_value(row.get(column)) for column in HISTORY_COLUMNS} for row in rows)
+
+
+def rebuild_rollups(file_path, lock=None):
+    """根据全部分区重新生成汇总表（只在汇总表缺失时使用）"""
+    with lock or nullcontext():
+        rollups = _empty_rollups()
+        paths = [path for paths in list_partitions(file_path).values() for path in paths]
+        if not paths:
+            return rollups
+        for path in paths:
+            for record in read_partition(path).to_dict('records'):
+                apply_record_to_rollups(rollups, record)
+        _write_rollups(rollups, file_path)
+        return rollups
+
+
+def load_rollups(file_path, lock=None):
+    """读取汇总表，缺失或损坏时从历史记录重建"""
+    path = rollups_path(file_path)
+    with lock or nullcontext():
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        return rebuild_rollups(file_path, lock)
+
+
+def save_history_records(records, file_path, lock=None):
+    """批量追加历史记录到所在月份的分区，并增量更新汇总表"""
+    with lock or nullcontext(), HISTORY_APPEND_SECONDS.time():
+        rollups = load_rollups(file_path, lock)
+        _append_partitions(records, file_path)
+        for record in records:
+            apply_record_to_rollups(rollups, record)
+        _write_rollups(rollups, file_path)
+    HISTORY_RECORDS.inc(len(records))
+
+
+def save_history_record(record, file_path, lock=None):
+    """保存一条历史记录，并增量更新汇总表"""
+    save_history_records([record], file_path, lock)
+
+
+def load_history_records(file_path, start=None, end=None):
+    """读取历史记录（指定日期范围时只读取重叠的分区），返回类型化的TypedHistory，
+    并在memory_report属性中记录转换前后的内存占用"""
+    raw_df = read_history_frame(file_path, start, end)
+    history = TypedHistory.from_frame(raw_df)
+    history.memory_report = memory_report('历史记录', raw_df, history)
+    return history
+
+
+def clear_history_records(file_path, lock=None):
+    with lock or nullcontext():
+        for path in (file_path, rollups_path(file_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(partitions_dir(file_path), ignore_errors=True)
+
+
+def compact_partitions(file_path, now=None, lock=None):
+    """把已结束月份的分区按时间排序、合并为一个压缩文件，返回压缩了的月份。
+    压缩文件写好后不再修改；之后补写到这个月份的记录（很少见）会在下次压缩时合并进来"""
+    current = (now or datetime.now()).strftime('%Y-%m')
+    compacted = []
+    for month, paths in list_partitions(file_path).items():
+        if month >= current or all(path.endswith(CLOSED_SUFFIX) for path in paths):
+            continue
+        with lock or nullcontext():
+            paths = list_partitions(file_path).get(month, [])
+            df = pd.concat([read_partition(path) for path in paths], ignore_index=True)
+            df = df.assign(_排序=pd.to_datetime(df['时间'], errors='coerce'))
+            df = df.sort_values('_排序', kind='stable', na_position='last').drop(columns='_排序')
+            target = os.path.join(partitions_dir(file_path), month + CLOSED_SUFFIX)
+            # 固定压缩头中的时间，内容相同的分区压缩结果也相同（增量备份不会重复保存）
+            df.to_csv(target + '.tmp', index=False, compression={'method': 'gzip', 'mtime': 0})
+            os.replace(target + '.tmp', target)
+            for path in paths:
+                if not path.endswith(CLOSED_SUFFIX):
+                    os.remove(path)
+        HISTORY_PARTITIONS_COMPACTED.inc()
+        compacted.append(month)
+    return compacted
+
+
+def drop_partitions(file_path, before, archive_dir=None, lock=None):
+    """丢弃早于 before 所在月份的整个分区：移动到 archive_dir，不指定时直接删除。
+    汇总表只减去这些分区中的记录，不需要重新汇总其余历史，返回丢弃的月份"""
+    cutoff = record_month(before)
+    dropped = []
+    with lock or nullcontext():
+        rollups = load_rollups(file_path, lock)
+        for month, paths in list_partitions(file_path).items():
+            if month >= cutoff:
+                break
+            for path in paths:
+                for record in read_partition(path).to_dict('records'):
+                    apply_record_to_rollups(rollups, record, sign=-1)
+                if archive_dir:
+                    os.makedirs(archive_dir, exist_ok=True)
+                    target = os.path.join(archive_dir, os.path.basename(path))
+                    if os.path.exists(target):
+                        # 同一月份再次归档（压缩后补写的记录），不覆盖之前归档的文件
+                        target = os.path.join(archive_dir, f"{datetime.now():%Y%m%d%H%M%S}_{os.path.basename(path)}")
+                    os.replace(path, target)
+                else:
+                    os.remove(path)
+            dropped.append(month)
+        if dropped:
+            _write_rollups(rollups, file_path)
+    return dropped
+
+
+def retention_cutoff(now, months):
+    """保留最近 months 个月（包括当月）时，第一个保留的月份"""
+    return (pd.Timestamp(now).to_period('M') - (months - 1)).strftime('%Y-%m')
+
+
+def partition_summary(file_path):
+    """各分区的状态，用于显示：月份、文件数、大小、是否已压缩"""
+    rows = []
+    for month, paths in list_partitions(file_path).items():
+        rows.append({
+            '月份': month,
+            '文件数': len(paths),
+            '大小': sum(os.path.getsize(path) for path in paths),
+            '状态': '已压缩' if all(path.endswith(CLOSED_SUFFIX) for path in paths) else '写入中',
+        })
+    return rows
+
+
+def split_legacy_history(file_path, now=None, lock=None):
+    """把旧版的单个历史记录Excel文件按月拆分为分区（已结束的月份直接压缩），
+    原文件改名为 .migrated 保留，返回拆分的记录数"""
+    if not os.path.exists(file_path):
+        return 0
+    records = pd.read_excel(file_path).to_dict('records')
+    with lock or nullcontext():
+        # 汇总表已包含这些记录，只写分区
+        _append_partitions(records, file_path)
+        os.replace(file_path, file_path + '.migrated')
+    compact_partitions(file_path, now, lock)
+    return len(records)
+
+
+def rollup_frames(rollups, top_n=10):
+    """把汇总表转换为用于图表的小DataFrame"""
+    by_day = pd.DataFrame.from_dict(rollups['按日'], orient='index', columns=DAY_FIELDS).sort_index()
+    by_day.index = pd.to_datetime(by_day.index, errors='coerce')
+    by_day.index.name = '日期'
+    by_material = pd.DataFrame.from_dict(rollups['按材料'], orient='index', columns=MATERIAL_FIELDS)
+    by_material = by_material.sort_values('总成本', ascending=False)
+    by_material.index.name = '打印材料'
+    top_accessories = pd.Series(rollups['配件'], dtype=float, name='次数').sort_values(ascending=False).head(top_n)
+    top_packaging = pd.Series(rollups['包装'], dtype=float, name='次数').sort_values(ascending=False).head(top_n)
+    return {
+        '按日': by_day,
+        '按材料': by_material,
+        '配件': top_accessories,
+        '包装': top_packaging,
+    }
+
+
+def average_margin(rollups):
+    """已定价报价的平均利润率，没有定价记录时返回None"""
+    revenue = sum(row['售价'] for row in rollups['按日'].values())
+    profit = sum(row['利润'] for row in rollups['按日'].values())
+    return profit / revenue if revenue > 0 else None
+
+
+class PartitionMaintainer:
+    """后台维护历史分区：定时压缩已结束月份的分区，设置了保留月数时把更早的分区整个归档（或删除）"""
+
+    def __init__(self, file_path, retention_months=None, archive_dir=None, interval_hours=6,
+                 on_dropped=None, lock=None):
+        self.file_path = file_path
+        # 与写入历史记录的线程共用的锁
+        self.lock = lock
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir
+        self.interval = interval_hours * 3600
+        # 丢弃分区后调用，例如让缓存的历史记录重新读取
+        self.on_dropped = on_dropped
+        self.last_run = None
+        self.last_result = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-partitions", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_now(self, now=None):
+        now = now or datetime.now()
+        try:
+            compacted = compact_partitions(self.file_path, now, self.lock)
+            dropped = []
+            if self.retention_months:
+                dropped = drop_partitions(self.file_path, retention_cutoff(now, self.retention_months),
+                                          self.archive_dir, self.lock)
+                if dropped and self.on_dropped:
+                    self.on_dropped(dropped)
+            self.last_result = {'压缩': compacted, '丢弃': dropped}
+            self.last_run = now
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+        return self.last_result
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_now()
+            self._stop.wait(self.interval)
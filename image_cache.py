@@ -0,0 +1,102 @@
+"""
+图片解码缓存模块
+图片按显示需要的大小解码：JPEG 使用 draft 模式直接按 1/2、1/4、1/8 的比例解码，不解码完整分辨率，
+其余格式解码后缩小到目标大小。解码结果在进程内按 (路径, 宽度) 缓存，并记录文件的修改时间和大小，
+文件变化后自动重新解码；按像素数据的字节数限制缓存总大小，超过时淘汰最久未使用的图片
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from metrics import REGISTRY
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+IMAGE_CACHE_REQUESTS = REGISTRY.counter('image_cache_requests', '解码图片缓存的查找次数', ['result'])
+IMAGE_CACHE_EVICTIONS = REGISTRY.counter('image_cache_evictions', '解码图片缓存淘汰的图片数')
+IMAGE_DECODE_SECONDS = REGISTRY.histogram('image_decode_seconds', '解码并缩小一张图片的耗时',
+                                          buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+
+def decode_thumbnail(image_path, width):
+    """解码图片并缩小到不超过 width×width，返回与文件无关的图片对象。
+    Image.thumbnail 对 JPEG 会先设置 draft 模式，按接近目标大小的比例解码"""
+    with IMAGE_DECODE_SECONDS.time():
+        with Image.open(image_path) as image:
+            image.thumbnail((width, width))
+            image.load()
+            return image
+
+
+def image_bytes(image):
+    """解码后像素数据的大致字节数"""
+    return image.width * image.height * len(image.getbands())
+
+
+class DecodedImageCache:
+    """进程内共享的解码图片缓存，返回的图片对象由多个会话共用，调用方不能修改"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (路径, 宽度) -> (文件签名, 图片, 字节数)，按使用顺序排列
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def get(self, image_path, width):
+        """图片缩小到 width 后的图片对象；文件不存在或无法解码时返回 None"""
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            IMAGE_CACHE_REQUESTS.inc(result='missing')
+            return None
+        key = (image_path, width)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                IMAGE_CACHE_REQUESTS.inc(result='hit')
+                return entry[1]
+            self.misses += 1
+        IMAGE_CACHE_REQUESTS.inc(result='miss')
+
+        # 解码不占用锁，其他会话可以同时读取缓存
+        try:
+            image = decode_thumbnail(image_path, width)
+        except Exception:
+            IMAGE_CACHE_REQUESTS.inc(result='error')
+            return None
+        size = image_bytes(image)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            # 单张图片超过总大小时不缓存
+            if size <= self.max_bytes:
+                self._entries[key] = (signature, image, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, _, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= evicted
+                    IMAGE_CACHE_EVICTIONS.inc()
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
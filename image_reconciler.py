@@ -0,0 +1,197 @@
+"""
+图片一致性检查模块
+对比数据表的图片路径和图片目录中的文件，找出孤立图片（没有被任何一行引用，如改名后重新上传留下的旧图片）、
+缺少的图片（图片路径指向的文件不存在）和损坏的图片（无法解码）。
+每个目录只列一次文件，引用关系在内存中比对；解码检查在线程池中并行进行。
+每次检查的结果（文件的修改时间、大小和是否损坏）保存在状态文件中，增量检查时只重新解码有变化的文件
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from PIL import Image
+
+from metrics import REGISTRY
+from migrations import IMAGE_EXTENSIONS
+
+PROBLEM_COLUMNS = ['表', '行', '名称', '文件', '问题', '详情']
+ORPHAN, MISSING, CORRUPT = '孤立图片', '缺少图片', '图片损坏'
+
+IMAGES_CHECKED = REGISTRY.counter('images_checked', '图片一致性检查中解码检查的图片数')
+
+
+def scan_directory(image_dir):
+    """目录中的图片文件 -> (修改时间, 大小)，只列一次目录"""
+    files = {}
+    if not os.path.isdir(image_dir):
+        return files
+    with os.scandir(image_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                stat = entry.stat()
+                files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def resolve_reference(value, files):
+    """与页面查找图片的规则相同：先尝试加上各扩展名，再尝试原文件名；找不到时返回 None"""
+    if not value or not isinstance(value, str) or value.lower() == 'nan':
+        return None
+    for extension in IMAGE_EXTENSIONS:
+        if value + extension in files:
+            return value + extension
+    return value if value in files else None
+
+
+def check_image(file_path):
+    """完整解码一次图片，正常时返回 None，否则返回错误信息"""
+    try:
+        with Image.open(file_path) as image:
+            image.load()
+        return None
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+
+def _reference(value):
+    return '' if value is None or pd.isna(value) else str(value).strip()
+
+
+class ImageReconciler:
+    """检查各数据表和图片目录的一致性，state_file 保存上次检查的结果"""
+
+    def __init__(self, state_file, max_workers=8):
+        self.state_file = state_file
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        tmp_path = self.state_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_file)
+
+    def run(self, sources, incremental=True):
+        """sources 为 [(表名, 数据表, 图片目录)]。增量检查时修改时间和大小与上次相同的文件沿用上次的解码结果。
+        返回 {'问题': DataFrame, '文件数', '检查数', '耗时'}"""
+        with self._lock:
+            return self._run(sources, incremental)
+
+    def _run(self, sources, incremental):
+        start = time.perf_counter()
+        state = self._load_state() if incremental else {}
+        directories = sorted({image_dir for _, _, image_dir in sources})
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            listings = dict(zip(directories, executor.map(scan_directory, directories)))
+
+            # 需要重新解码的文件：新文件或修改时间/大小有变化的文件
+            results, pending = {}, []
+            for image_dir, files in listings.items():
+                previous = state.get(image_dir, {})
+                results[image_dir] = {}
+                for file_name, (mtime, size) in files.items():
+                    cached = previous.get(file_name)
+                    if cached is not None and cached[:2] == [mtime, size]:
+                        results[image_dir][file_name] = cached
+                    else:
+                        pending.append((image_dir, file_name, mtime, size))
+            errors = executor.map(lambda item: check_image(os.path.join(item[0], item[1])), pending)
+            for (image_dir, file_name, mtime, size), error in zip(pending, errors):
+                results[image_dir][file_name] = [mtime, size, error]
+        IMAGES_CHECKED.inc(len(pending))
+        self._save_state(results)
+
+        problems, referenced = [], {image_dir: set() for image_dir in directories}
+        for table, df, image_dir in sources:
+            files = results[image_dir]
+            for index, row in df.iterrows():
+                value = _reference(row.get('图片路径'))
+                if not value:
+                    continue
+                file_name = resolve_reference(value, files)
+                if file_name is None:
+                    problems.append((table, index, row.get('名称'), value, MISSING, os.path.join(image_dir, value)))
+                    continue
+                referenced[image_dir].add(file_name)
+                if files[file_name][2]:
+                    problems.append((table, index, row.get('名称'), file_name, CORRUPT, files[file_name][2]))
+        tables = {}
+        for table, _, image_dir in sources:
+            tables.setdefault(image_dir, table)
+        for image_dir in directories:
+            for file_name, (_, _, error) in sorted(results[image_dir].items()):
+                if file_name not in referenced[image_dir]:
+                    detail = f"{CORRUPT}: {error}" if error else os.path.join(image_dir, file_name)
+                    problems.append((tables[image_dir], None, None, file_name, ORPHAN, detail))
+        frame = pd.DataFrame(problems, columns=PROBLEM_COLUMNS)
+        # 孤立图片没有对应的行，行号保持原来的标签，不转换为小数
+        frame['行'] = pd.Series([problem[1] for problem in problems], index=frame.index, dtype=object)
+        return {
+            '问题': frame,
+            '文件数': sum(len(files) for files in results.values()),
+            '检查数': len(pending),
+            '耗时': time.perf_counter() - start,
+        }
+
+
+def _unique_path(directory, file_name):
+    stem, extension = os.path.splitext(file_name)
+    path, number = os.path.join(directory, file_name), 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem}_{number}{extension}")
+        number += 1
+    return path
+
+
+def repair(problems, sources, quarantine_dir):
+    """按检查结果修复：
+    - 缺少图片的行：目录中有与名称同名的孤立图片时改为引用它，否则清空图片路径
+    - 图片损坏的行：清空图片路径（图片文件由调用方放入回收站，撤销时可以恢复）
+    - 其余孤立图片移到 quarantine_dir 下按表分开的子目录，不直接删除
+    返回需要修改的行 [(表名, 行, 新的图片路径, 需要放入回收站的图片路径)] 和移走的文件数"""
+    image_dirs = {table: image_dir for table, _, image_dir in sources}
+    orphans = problems[problems['问题'] == ORPHAN].to_dict('records')
+    by_name = {}
+    for problem in orphans:
+        if not problem['详情'].startswith(CORRUPT):
+            by_name.setdefault((problem['表'], os.path.splitext(problem['文件'])[0]), problem)
+
+    updates, relinked = [], set()
+    for problem in problems[problems['问题'] != ORPHAN].to_dict('records'):
+        table, image_dir = problem['表'], image_dirs[problem['表']]
+        if problem['问题'] == MISSING:
+            candidate = by_name.get((table, str(problem['名称'])))
+            if candidate is not None and (table, candidate['文件']) not in relinked:
+                relinked.add((table, candidate['文件']))
+                updates.append((table, problem['行'], candidate['文件'], None))
+            else:
+                updates.append((table, problem['行'], '', None))
+        else:
+            updates.append((table, problem['行'], '', os.path.join(image_dir, problem['文件'])))
+
+    moved = 0
+    for problem in orphans:
+        table = problem['表']
+        if (table, problem['文件']) in relinked:
+            continue
+        source = os.path.join(image_dirs[table], problem['文件'])
+        if os.path.exists(source):
+            target_dir = os.path.join(quarantine_dir, table)
+            os.makedirs(target_dir, exist_ok=True)
+            shutil.move(source, _unique_path(target_dir, problem['文件']))
+            moved += 1
+    return updates, moved
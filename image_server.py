@@ -0,0 +1,178 @@
+"""
+图片服务模块
+目录中的图片按内容生成缩略图，保存为以内容哈希命名的文件，由后台的 HTTP 服务按地址提供，
+并设置长期缓存（内容变化时地址也会变化，不会读到旧图片）。
+页面只引用地址，浏览器第一次下载后直接使用缓存，重新运行页面时不再传输图片数据
+"""
+
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from image_cache import decode_thumbnail
+from metrics import REGISTRY
+
+THUMBNAIL_PATH = '/thumbs/'
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.png': 'image/png'}
+# 只提供符合命名规则的缩略图文件，不能访问目录中的其他文件
+FILE_NAME_PATTERN = re.compile(r'^[0-9a-f]{40}-\d+\.(jpg|png)$')
+
+THUMBNAILS_CREATED = REGISTRY.counter('thumbnails_created', '生成的缩略图数')
+THUMBNAIL_REQUESTS = REGISTRY.counter('thumbnail_requests', '缩略图请求次数', ['result'])
+THUMBNAIL_BYTES = REGISTRY.counter('thumbnail_bytes_sent', '发送的缩略图字节数')
+
+
+def content_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ThumbnailCache:
+    """按内容哈希和宽度生成、查找缩略图文件。
+    图片的哈希按 (路径, 修改时间, 大小) 记住，图片未变化时不重新读取"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hashes = {}
+
+    def _hash(self, image_path):
+        stat = os.stat(image_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(image_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest = content_hash(image_path)
+        with self._lock:
+            self._hashes[image_path] = (key, digest)
+        return digest
+
+    def thumbnail(self, image_path, width):
+        """缩略图文件名（不存在时生成），图片无法读取时返回 None。
+        有透明通道的图片保存为 PNG，其余为 JPEG"""
+        try:
+            digest = self._hash(image_path)
+        except OSError:
+            return None
+        for extension in CONTENT_TYPES:
+            file_name = f"{digest}-{width}{extension}"
+            if os.path.exists(os.path.join(self.cache_dir, file_name)):
+                return file_name
+        try:
+            image = decode_thumbnail(image_path, width)
+            transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            if transparent:
+                image, extension, options = image.convert('RGBA'), '.png', {'optimize': True}
+            else:
+                image, extension, options = image.convert('RGB'), '.jpg', {'quality': 85}
+            file_name = f"{digest}-{width}{extension}"
+            # 先写临时文件再替换，服务不会读到写了一半的文件
+            tmp_path = os.path.join(self.cache_dir, f"{file_name}.{threading.get_ident()}.tmp")
+            image.save(tmp_path, format='PNG' if extension == '.png' else 'JPEG', **options)
+            os.replace(tmp_path, os.path.join(self.cache_dir, file_name))
+        except Exception:
+            return None
+        THUMBNAILS_CREATED.inc()
+        return file_name
+
+    def path(self, file_name):
+        """请求的文件名对应的缩略图路径，不符合命名规则或不存在时返回 None"""
+        if not FILE_NAME_PATTERN.match(file_name):
+            return None
+        file_path = os.path.join(self.cache_dir, file_name)
+        return file_path if os.path.isfile(file_path) else None
+
+
+class ImageServer:
+    """在后台监听端口提供缩略图；public_url 为浏览器访问服务使用的地址（默认 http://host:port）"""
+
+    def __init__(self, cache, port, host='127.0.0.1', public_url=None):
+        self.cache = cache
+        self.port = port
+        self.host = host
+        self.public_url = public_url
+        self.last_error = None
+        self._server = None
+
+    def _handler(self):
+        cache = self.cache
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                file_path = cache.path(path[len(THUMBNAIL_PATH):]) if path.startswith(THUMBNAIL_PATH) else None
+                if file_path is None:
+                    THUMBNAIL_REQUESTS.inc(result='missing')
+                    self.send_error(404)
+                    return
+                # 文件名就是内容，浏览器验证缓存时直接返回未修改
+                etag = f'"{os.path.basename(file_path)}"'
+                if self.headers.get('If-None-Match') == etag:
+                    THUMBNAIL_REQUESTS.inc(result='not_modified')
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Cache-Control', CACHE_CONTROL)
+                    self.end_headers()
+                    return
+                with open(file_path, 'rb') as f:
+                    body = f.read()
+                THUMBNAIL_REQUESTS.inc(result='ok')
+                THUMBNAIL_BYTES.inc(len(body))
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPES[os.path.splitext(file_path)[1]])
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', CACHE_CONTROL)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="image-http", daemon=True).start()
+        except OSError as e:
+            # 端口被占用时页面直接发送图片
+            self.last_error = f"无法监听端口 {self.port}: {e}"
+            self._server = None
+        return self
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    @property
+    def base_url(self):
+        if self.public_url:
+            return self.public_url.rstrip('/')
+        if self._server is None:
+            return None
+        host, port = self._server.server_address[:2]
+        # 监听所有地址时浏览器通过本机访问
+        return f"http://{'localhost' if host in ('0.0.0.0', '') else host}:{port}"
+
+    def url(self, image_path, width):
+        """图片缩略图的地址；服务未运行或图片无法读取时返回 None"""
+        if not self.running or not image_path:
+            return None
+        file_name = self.cache.thumbnail(image_path, width)
+        return f"{self.base_url}{THUMBNAIL_PATH}{file_name}" if file_name else None
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,243 @@
+"""
+库存台账模块
+采购（新增材料/批次、新增或补货配件/包装）记为入库，确认生产的报价记为消耗，盘点差异记为调整，
+所有变动追加写入 inventory_ledger.csv，不改写旧记录。
+每个物品的入库/消耗/调整/结余在写入台账时增量更新，保存在 inventory_ledger_balances.json 中，
+查询当前库存和低库存预警只读取这个小表，不需要汇总全部台账
+"""
+
+import csv
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+LEDGER_COLUMNS = ['时间', '类别', '名称', '数量', '类型', '备注']
+
+RECEIPT = '入库'
+CONSUMPTION = '消耗'
+ADJUSTMENT = '调整'
+# 以下两种记录不改变数量：改名把库存移到新名称下（备注为原名称），预警线设置该物品的低库存阈值
+RENAME = '改名'
+THRESHOLD = '预警线'
+
+# 各类别的单位和默认低库存预警线
+UNITS = {'print_materials': '克', 'accessories': '个', 'packaging': '个'}
+DEFAULT_THRESHOLDS = {'print_materials': 200.0, 'accessories': 5.0, 'packaging': 5.0}
+
+
+def balances_path(ledger_file):
+    """结余表文件路径（与台账放在一起）"""
+    return os.path.splitext(ledger_file)[0] + '_balances.json'
+
+
+def _empty_balance():
+    return {RECEIPT: 0.0, CONSUMPTION: 0.0, ADJUSTMENT: 0.0, '结余': 0.0}
+
+
+def apply_to_balances(balances, row):
+    """把一条台账记录累加到结余表中"""
+    items = balances.setdefault(row['类别'], {})
+    name, kind = row['名称'], row['类型']
+    if kind == RENAME:
+        old = items.pop(row['备注'], None)
+        if old is not None:
+            current = items.get(name)
+            if current is None:
+                items[name] = old
+            else:
+                for field in (RECEIPT, CONSUMPTION, ADJUSTMENT, '结余'):
+                    current[field] += old[field]
+        return balances
+    entry = items.setdefault(name, _empty_balance())
+    quantity = float(row['数量'])
+    if kind == THRESHOLD:
+        entry[THRESHOLD] = quantity
+    elif kind == CONSUMPTION:
+        entry[CONSUMPTION] += quantity
+        entry['结余'] -= quantity
+    else:
+        entry[kind] += quantity
+        entry['结余'] += quantity
+    return balances
+
+
+def entry_threshold(table, entry):
+    """结余表中一个物品的预警线，没有单独设置时使用类别的默认值"""
+    return entry.get(THRESHOLD, DEFAULT_THRESHOLDS.get(table, 0.0))
+
+
+def ledger_row(table, name, quantity, kind, remark='', when=None):
+    return {
+        '时间': (when or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
+        '类别': table,
+        '名称': str(name),
+        '数量': float(quantity),
+        '类型': kind,
+        '备注': remark or '',
+    }
+
+
+class Inventory:
+    """库存台账和增量维护的结余表"""
+
+    def __init__(self, ledger_file):
+        self.ledger_file = ledger_file
+        self.balances_file = balances_path(ledger_file)
+        self._lock = threading.RLock()
+        self._balances = {}
+        # 结余表对应的台账文件大小，与实际大小不同时（其他进程写入过）重新读取
+        self._ledger_size = None
+
+    def _current_size(self):
+        return os.path.getsize(self.ledger_file) if os.path.exists(self.ledger_file) else 0
+
+    def _write_balances(self):
+        tmp_path = self.balances_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'台账大小': self._ledger_size, '库存': self._balances}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.balances_file)
+
+    def rebuild(self):
+        """根据完整台账重新生成结余表（只在结余表缺失或与台账不一致时使用）"""
+        with self._lock:
+            balances = {}
+            if os.path.exists(self.ledger_file):
+                with open(self.ledger_file, newline='', encoding='utf-8') as f:
+                    for row in csv.DictReader(f):
+                        try:
+                            apply_to_balances(balances, row)
+                        except (KeyError, TypeError, ValueError):
+                            # 写了一半的最后一行（如断电），忽略
+                            continue
+            self._balances = balances
+            self._ledger_size = self._current_size()
+            self._write_balances()
+            return balances
+
+    def _refresh(self):
+        size = self._current_size()
+        if size == self._ledger_size:
+            return
+        if os.path.exists(self.balances_file):
+            try:
+                with open(self.balances_file, encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('台账大小') == size:
+                    self._balances, self._ledger_size = data['库存'], size
+                    return
+            except (OSError, ValueError, KeyError):
+                pass
+        self.rebuild()
+
+    def record(self, rows):
+        """追加台账记录，并增量更新结余表"""
+        if not rows:
+            return
+        with self._lock:
+            self._refresh()
+            new_file = not os.path.exists(self.ledger_file)
+            with open(self.ledger_file, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=LEDGER_COLUMNS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+            for row in rows:
+                apply_to_balances(self._balances, row)
+            self._ledger_size = self._current_size()
+            self._write_balances()
+
+    def receive(self, table, name, quantity, remark='采购'):
+        if quantity:
+            self.record([ledger_row(table, name, quantity, RECEIPT, remark)])
+
+    def consume(self, items, remark=''):
+        """items: [(类别, 名称, 数量)]，同一次生产的消耗一起写入"""
+        self.record([ledger_row(table, name, quantity, CONSUMPTION, remark)
+                     for table, name, quantity in items if quantity])
+
+    def adjust(self, table, name, quantity, remark=''):
+        if quantity:
+            self.record([ledger_row(table, name, quantity, ADJUSTMENT, remark)])
+
+    def count(self, table, name, actual, remark='盘点'):
+        """盘点：记录实际数量与结余的差额"""
+        self.adjust(table, name, actual - self.stock(table, name), remark)
+
+    def rename(self, table, old_name, new_name):
+        if old_name != new_name:
+            self.record([ledger_row(table, new_name, 0, RENAME, old_name)])
+
+    def set_threshold(self, table, name, value):
+        self.record([ledger_row(table, name, value, THRESHOLD)])
+
+    def balance(self, table, name):
+        """某个物品的入库/消耗/调整/结余，没有记录时返回 None"""
+        with self._lock:
+            self._refresh()
+            return self._balances.get(table, {}).get(str(name))
+
+    def balances(self, table):
+        with self._lock:
+            self._refresh()
+            return dict(self._balances.get(table, {}))
+
+    def stock(self, table, name):
+        entry = self.balance(table, name)
+        return entry['结余'] if entry else 0.0
+
+    def consumed(self, table, name):
+        entry = self.balance(table, name)
+        return entry[CONSUMPTION] if entry else 0.0
+
+    def threshold(self, table, name):
+        return entry_threshold(table, self.balance(table, name) or {})
+
+    def is_low(self, table, name):
+        entry = self.balance(table, name)
+        return entry is not None and entry['结余'] < entry_threshold(table, entry)
+
+    def low_stock(self, table, names=None):
+        """低于预警线的物品 [(名称, 结余, 预警线)]，names 限定为当前数据表中的物品"""
+        result = []
+        for name, entry in self.balances(table).items():
+            if names is not None and name not in names:
+                continue
+            threshold = entry_threshold(table, entry)
+            if entry['结余'] < threshold:
+                result.append((name, entry['结余'], threshold))
+        return result
+
+    def ledger(self, table=None, name=None):
+        """读取台账明细（只在查看明细时使用）"""
+        if not os.path.exists(self.ledger_file):
+            return pd.DataFrame(columns=LEDGER_COLUMNS)
+        df = pd.read_csv(self.ledger_file, dtype={'类别': str, '名称': str, '类型': str, '备注': str})
+        df['备注'] = df['备注'].fillna('')
+        if table is not None:
+            df = df[df['类别'] == table]
+        if name is not None:
+            df = df[df['名称'] == str(name)]
+        return df
+
+
+def seed_rows(materials_lots, accessories, packaging):
+    """没有台账时的初始入库记录：每个采购批次的克重、每个配件/包装的总数量，时间为购买时间"""
+    rows = []
+    sources = [('print_materials', materials_lots, '材料', '克重'),
+               ('accessories', accessories, '名称', '总数量'),
+               ('packaging', packaging, '名称', '总数量')]
+    for table, df, name_column, quantity_column in sources:
+        if df is None or df.empty or name_column not in df.columns or quantity_column not in df.columns:
+            continue
+        times = pd.to_datetime(df['购买时间'], errors='coerce') if '购买时间' in df.columns else None
+        for position, (name, quantity) in enumerate(zip(df[name_column], df[quantity_column])):
+            quantity = pd.to_numeric(quantity, errors='coerce')
+            if pd.isna(name) or pd.isna(quantity) or quantity <= 0:
+                continue
+            when = times.iloc[position] if times is not None else None
+            rows.append(ledger_row(table, name, quantity, RECEIPT, '初始库存',
+                                   None if when is None or pd.isna(when) else when))
+    return rows
@@ -0,0 +1,328 @@
+"""
+数据变更日志模块
+每次修改打印材料/配件/包装数据时，在 JSON Lines 日志末尾追加一条记录，只保存变化的字段：
+基准快照加上日志可以恢复到任意时间点，也可以撤销最近的修改（追加反向操作，不改写旧记录）。
+删除或被替换的图片移入按内容寻址的回收站，撤销时再放回原位置。
+日志过长时，把超过保留期的记录合并进基准快照
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# 日志条数超过该值、并且有超过保留期的记录时自动合并，保留期内的记录不合并
+COMPACT_THRESHOLD = 1000
+RETENTION_DAYS = 30
+# 每张表在内存中保留的最近日志条数，页面显示最近的修改时不读取日志文件
+RECENT_ENTRIES = 20
+
+OPERATION_LABELS = {
+    'insert': '添加',
+    'update': '修改',
+    'delete': '删除',
+    'replace': '整表替换',
+}
+
+
+def operation_label(entry):
+    """日志操作的中文说明，撤销记录显示被撤销的操作"""
+    if entry.get('source'):
+        return entry['source']
+    if 'undo_of' in entry:
+        original = {'insert': 'delete', 'delete': 'insert'}.get(entry['op'], entry['op'])
+        return '撤销' + OPERATION_LABELS[original]
+    return OPERATION_LABELS.get(entry['op'], entry['op'])
+
+
+def to_json_value(value):
+    """把DataFrame中的值转换为可以写入JSON的值"""
+    if value is None:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return None if pd.isna(value) else value.isoformat()
+    if isinstance(value, date):
+        # 日期统一为零点的时间，与表中的时间戳比较时不会误判为修改
+        return datetime(value.year, value.month, value.day).isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def row_to_json(row):
+    """一行数据（Series或dict）转换为JSON字典"""
+    items = row.items() if hasattr(row, 'items') else row
+    return {str(column): to_json_value(value) for column, value in items}
+
+
+def frame_to_rows(df):
+    return [row_to_json(row) for _, row in df.iterrows()]
+
+
+def diff_values(before, after):
+    """比较修改前后的一行，返回只包含变化字段的 (before, after)"""
+    changed_before, changed_after = {}, {}
+    for column, value in after.items():
+        if before.get(column) != value:
+            changed_before[column] = before.get(column)
+            changed_after[column] = value
+    return changed_before, changed_after
+
+
+def apply_to_rows(rows, entry):
+    """在行列表上重放一条日志"""
+    op, position = entry['op'], entry.get('position')
+    if op == 'insert':
+        rows.insert(position, dict(entry['after']))
+    elif op == 'delete':
+        del rows[position]
+    elif op == 'update':
+        rows[position] = {**rows[position], **entry['after']}
+    elif op == 'replace':
+        rows[:] = [dict(row) for row in entry['rows']]
+    return rows
+
+
+def inverse_entry(entry):
+    """生成撤销一条日志所需的反向操作，整表替换不能撤销"""
+    op = entry['op']
+    inverse = {'position': entry['position'], 'undo_of': entry['seq']}
+    if op == 'insert':
+        inverse.update(op='delete', before=entry['after'])
+    elif op == 'delete':
+        inverse.update(op='insert', after=entry['before'])
+    elif op == 'update':
+        inverse.update(op='update', before=entry['after'], after=entry['before'])
+    else:
+        return None
+    if entry.get('image'):
+        inverse['image'] = entry['image']
+    return inverse
+
+
+class _TableTail:
+    """一张表日志末尾的摘要：最后的序号、日志条数、最早一条的时间和最近的几条日志"""
+    __slots__ = ('seq', 'count', 'oldest', 'recent')
+
+    def __init__(self, seq, entries):
+        self.seq = seq
+        self.count = len(entries)
+        self.oldest = datetime.fromisoformat(entries[0]['time']) if entries else None
+        self.recent = deque(entries[-RECENT_ENTRIES:], maxlen=RECENT_ENTRIES)
+
+
+class ChangeJournal:
+    """按数据表分别保存的变更日志"""
+
+    def __init__(self, journal_dir, compact_threshold=COMPACT_THRESHOLD, retention_days=RETENTION_DAYS):
+        self.journal_dir = journal_dir
+        self.trash_dir = os.path.join(journal_dir, "trash")
+        self.compact_threshold = compact_threshold
+        self.retention_days = retention_days
+        self._lock = threading.RLock()
+        # 数据表 -> _TableTail，第一次使用时从文件读取，之后随记录和合并更新
+        self._tails = {}
+        os.makedirs(self.trash_dir, exist_ok=True)
+
+    def _journal_path(self, table):
+        return os.path.join(self.journal_dir, f"{table}.jsonl")
+
+    def _base_path(self, table):
+        return os.path.join(self.journal_dir, f"{table}.base.json")
+
+    def _write_json(self, path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read_base(self, table):
+        path = self._base_path(table)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def entries(self, table):
+        """读取一张表的全部日志（按顺序）"""
+        path = self._journal_path(table)
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # 写了一半的最后一行（如断电），忽略
+                        continue
+        return entries
+
+    def _tail(self, table):
+        if table not in self._tails:
+            entries = self.entries(table)
+            base = self._read_base(table)
+            last_seq = entries[-1]['seq'] if entries else (base['seq'] if base else 0)
+            self._tails[table] = _TableTail(last_seq, entries)
+        return self._tails[table]
+
+    def _compact_due(self, tail):
+        """日志过长并且最早的记录已超过保留期：全部在保留期内时合并不了任何记录，不重新读取日志"""
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        return tail.count > self.compact_threshold and tail.oldest is not None and tail.oldest < cutoff
+
+    def summary(self, table):
+        """(日志条数, 最近的日志列表)，使用内存中的摘要，不读取日志文件"""
+        with self._lock:
+            tail = self._tail(table)
+            return tail.count, list(tail.recent)
+
+    def record(self, table, current_df, entry):
+        """追加一条日志；第一次记录时先把修改前的数据保存为基准快照"""
+        with self._lock:
+            base = self._read_base(table)
+            if base is None:
+                base = {'seq': 0, 'time': datetime.now().isoformat(), 'rows': frame_to_rows(current_df)}
+                self._write_json(self._base_path(table), base)
+            tail = self._tail(table)
+            entry = {'seq': tail.seq + 1, 'time': datetime.now().isoformat(), **entry}
+            line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+            with open(self._journal_path(table), 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            tail.seq = entry['seq']
+            tail.count += 1
+            tail.recent.append(entry)
+            if tail.oldest is None:
+                tail.oldest = datetime.fromisoformat(entry['time'])
+            if self._compact_due(tail):
+                self.compact(table)
+            return entry
+
+    def earliest_time(self, table):
+        """可以恢复到的最早时间"""
+        base = self._read_base(table)
+        return datetime.fromisoformat(base['time']) if base else None
+
+    def replay(self, table, until=None):
+        """基准快照加日志重放，返回指定时间点（默认最新）的行列表"""
+        base = self._read_base(table)
+        if base is None:
+            return None
+        if until is not None and until < datetime.fromisoformat(base['time']):
+            raise ValueError(f"早于最早可恢复时间 {base['time'][:19]}")
+        rows = [dict(row) for row in base['rows']]
+        for entry in self.entries(table):
+            if until is not None and datetime.fromisoformat(entry['time']) > until:
+                break
+            apply_to_rows(rows, entry)
+        return rows
+
+    def entries_after(self, table, when):
+        return [entry for entry in self.entries(table) if datetime.fromisoformat(entry['time']) > when]
+
+    def undo_plan(self, table, count=1):
+        """最近 count 次尚未撤销的修改对应的反向操作（从新到旧），遇到整表替换停止"""
+        undone = set()
+        plan = []
+        for entry in reversed(self.entries(table)):
+            if len(plan) >= count:
+                break
+            if 'undo_of' in entry:
+                undone.add(entry['undo_of'])
+                continue
+            if entry['seq'] in undone:
+                continue
+            inverse = inverse_entry(entry)
+            if inverse is None:
+                break
+            plan.append(inverse)
+        return plan
+
+    def stash_image(self, image_path, move=True):
+        """把图片放入回收站（内容相同的图片只保存一份），返回日志中记录的图片信息"""
+        if not image_path or not os.path.exists(image_path):
+            return None
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        blob = digest.hexdigest() + os.path.splitext(image_path)[1].lower()
+        blob_path = os.path.join(self.trash_dir, blob)
+        if not os.path.exists(blob_path):
+            shutil.copyfile(image_path, blob_path)
+        if move:
+            os.remove(image_path)
+        return {'blob': blob, 'path': image_path}
+
+    def restore_image(self, image):
+        """把回收站中的图片放回原位置"""
+        if not image:
+            return False
+        blob_path = os.path.join(self.trash_dir, image['blob'])
+        if not os.path.exists(blob_path):
+            return False
+        os.makedirs(os.path.dirname(image['path']) or '.', exist_ok=True)
+        shutil.copyfile(blob_path, image['path'])
+        return True
+
+    def compact(self, table, before=None):
+        """把 before（默认保留期之前）之前的日志合并进基准快照，并清理不再引用的回收站图片"""
+        with self._lock:
+            base = self._read_base(table)
+            if base is None:
+                return 0
+            if before is None:
+                before = datetime.now() - timedelta(days=self.retention_days)
+            entries = self.entries(table)
+            folded = [e for e in entries if datetime.fromisoformat(e['time']) < before]
+            if not folded:
+                return 0
+            rows = base['rows']
+            for entry in folded:
+                apply_to_rows(rows, entry)
+            self._write_json(self._base_path(table), {
+                'seq': folded[-1]['seq'], 'time': folded[-1]['time'], 'rows': rows,
+            })
+            kept = entries[len(folded):]
+            tmp_path = self._journal_path(table) + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in kept:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+            os.replace(tmp_path, self._journal_path(table))
+            self._tails[table] = _TableTail(kept[-1]['seq'] if kept else folded[-1]['seq'], kept)
+            self.purge_trash()
+            return len(folded)
+
+    def purge_trash(self):
+        """删除所有日志都不再引用的回收站图片"""
+        referenced = set()
+        for file_name in os.listdir(self.journal_dir):
+            if file_name.endswith('.jsonl'):
+                for entry in self.entries(file_name[:-len('.jsonl')]):
+                    if entry.get('image'):
+                        referenced.add(entry['image']['blob'])
+        removed = 0
+        for blob in os.listdir(self.trash_dir):
+            if blob not in referenced:
+                os.remove(os.path.join(self.trash_dir, blob))
+                removed += 1
+        return removed
+
+    def size(self):
+        """日志和回收站占用的字节数"""
+        total = 0
+        for root, _, files in os.walk(self.journal_dir):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
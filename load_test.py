@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+多会话压力测试脚本
+在本地用 Streamlit AppTest 模拟多个同时打开的会话（切换页面、选择卡片、计算价格、编辑数据），
+统计每次重新运行的延迟 p50/p95/p99、吞吐量和进程内存峰值。
+与实际运行的 Streamlit 服务相同，所有会话在同一个进程中各用一个线程运行，
+共用进程内的数据表缓存、锁、后台写入队列等资源和同一个数据目录，内存为这个进程的占用
+
+用法示例：
+    python load_test.py --sessions 20 --iterations 10 --accessories 200 --history 5000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+
+PAGES = ["主页面 - 产品价格计算", "打印材料管理", "产品配件管理", "包装管理"]
+
+
+def generate_data(data_dir, materials=10, accessories=50, packaging=20, history=1000, seed=0):
+    """生成指定规模的示例数据"""
+    from history_store import save_history_records
+
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    now = datetime.now()
+    material_types = ['PLA', 'ABS', 'PETG', 'TPU']
+    colors = ['白色', '黑色', '红色', '透明']
+
+    def purchase_time():
+        return now - timedelta(days=rng.randint(0, 365))
+
+    material_rows = []
+    for i in range(materials):
+        price, shipping, weight = rng.uniform(60, 200), rng.uniform(0, 20), 1000.0
+        material_rows.append({
+            '名称': f"{rng.choice(material_types)}耗材{i}", '品牌': f"品牌{i % 7}", '质感': '光滑',
+            '耗材颜色': rng.choice(colors), '耗材类型': rng.choice(material_types),
+            '购买价': price, '运费': shipping, '总克重': weight, '购买时间': purchase_time(),
+            '每克成本': (price + shipping) / weight, '图片路径': '', '链接': '', '备注': '',
+        })
+
+    def unit_rows(prefix, count):
+        rows = []
+        for i in range(count):
+            price, shipping, quantity = rng.uniform(5, 100), rng.uniform(0, 10), rng.randint(10, 500)
+            rows.append({
+                '名称': f"{prefix}{i}", '规格': f"规格{i % 5}", '购买价': price, '运费': shipping,
+                '总数量': quantity, '购买时间': purchase_time(), '每单位成本': (price + shipping) / quantity,
+                '图片路径': '', '链接': '', '备注': '',
+            })
+        return rows
+
+    pd.DataFrame(material_rows).to_excel(os.path.join(data_dir, "print_materials.xlsx"), index=False)
+    pd.DataFrame(unit_rows("配件", accessories)).to_excel(os.path.join(data_dir, "accessories.xlsx"), index=False)
+    pd.DataFrame(unit_rows("包装", packaging)).to_excel(os.path.join(data_dir, "packaging.xlsx"), index=False)
+
+    records = []
+    for _ in range(history):
+        weight = rng.uniform(5, 500)
+        material = rng.choice(material_rows)
+        material_cost = weight * material['每克成本']
+        records.append({
+            '时间': (now - timedelta(minutes=rng.randint(0, 525600))).strftime('%Y-%m-%d %H:%M:%S'),
+            '克重': weight, '打印材料': material['名称'], '打印材料成本': material_cost,
+            '产品配件': ','.join(f"配件{rng.randrange(max(accessories, 1))}" for _ in range(rng.randint(0, 3))),
+            '配件成本': 0.0, '包装': '', '包装成本': 0.0, '总成本': material_cost,
+        })
+    if records:
+        save_history_records(records, os.path.join(data_dir, "history_costs.xlsx"))
+
+
+def current_rss():
+    """当前进程占用的内存（字节），无法读取时返回 None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss():
+    """当前进程的内存峰值（字节）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    # macOS 的单位为字节，其余系统为KB
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+@contextmanager
+def shared_runtime():
+    """AppTest 每次运行时设置全局的 Runtime，运行结束时清除；多个会话同时运行时，
+    清除后其他会话仍在运行，期间继续使用最近设置的 Runtime，所有会话共用同一个。
+    与实际的服务相同，脚本只编译一次（AppTest 每次运行都重新编译，多个线程同时编译会出错）"""
+    from streamlit.runtime import Runtime
+    try:
+        from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    except ImportError:
+        ScriptCache = None
+
+    original_instance, original_exists = Runtime.__dict__['instance'], Runtime.__dict__['exists']
+    latest = []
+    original_bytecode = ScriptCache.get_bytecode if ScriptCache is not None else None
+    compiled, compile_lock = {}, threading.Lock()
+
+    def get_bytecode(self, script_path):
+        with compile_lock:
+            if script_path not in compiled:
+                compiled[script_path] = original_bytecode(self, script_path)
+            return compiled[script_path]
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+            return cls._instance
+        if latest:
+            return latest[0]
+        return original_instance.__func__(cls)
+
+    def exists(cls):
+        return cls._instance is not None or bool(latest)
+
+    Runtime.instance, Runtime.exists = classmethod(instance), classmethod(exists)
+    if ScriptCache is not None:
+        ScriptCache.get_bytecode = get_bytecode
+    try:
+        yield
+    finally:
+        Runtime.instance, Runtime.exists = original_instance, original_exists
+        if ScriptCache is not None:
+            ScriptCache.get_bytecode = original_bytecode
+
+
+class SessionSimulator:
+    """一个模拟会话，按随机顺序执行常见操作"""
+
+    def __init__(self, session_id, seed, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.session_id = session_id
+        self.rng = random.Random(seed)
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.samples = []
+
+    def _timed(self, action, func):
+        started_at = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            func()
+            if self.app.exception:
+                error = str(self.app.exception[0].message)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.samples.append((action, started_at, time.perf_counter() - start, error))
+
+    def _goto(self, page):
+        # 上一次运行出错时页面上没有导航，重新运行一次
+        if not self.app.sidebar.radio:
+            self.app.run()
+        self.app.sidebar.radio[0].set_value(page)
+        self.app.run()
+
+    def _click(self, predicate):
+        buttons = [b for b in self.app.button if predicate(b)]
+        if buttons:
+            self.rng.choice(buttons).click()
+            self.app.run()
+
+    def open(self):
+        self._timed("打开页面", self.app.run)
+
+    def switch_page(self):
+        self._timed("切换页面", lambda: self._goto(self.rng.choice(PAGES)))
+
+    def toggle_card(self):
+        self._goto(PAGES[0])
+        self._timed("选择卡片", lambda: self._click(
+            lambda b: (b.key or '').startswith(("selected_accessories_", "selected_packaging_"))))
+
+    def quote(self):
+        self._goto(PAGES[0])
+        weights = [n for n in self.app.number_input if n.label == "克重 (克)"]
+        if weights:
+            weights[0].set_value(round(self.rng.uniform(5, 500), 1))
+        self._timed("计算价格", lambda: self._click(lambda b: b.label == "计算价格"))
+
+    def edit_catalog(self):
+        self._goto(self.rng.choice(PAGES[1:]))
+        self._timed("编辑数据", lambda: self._click(lambda b: b.label.startswith("更新_")))
+
+    def run(self, iterations):
+        self.open()
+        actions = [self.switch_page, self.toggle_card, self.quote, self.edit_catalog]
+        weights = [4, 3, 2, 1]
+        for _ in range(iterations):
+            action = self.rng.choices(actions, weights)[0]
+            try:
+                action()
+            except Exception as e:
+                # 操作前的页面切换出错时记为这个操作的错误，继续下一个操作
+                self.samples.append((action.__name__, time.time(), 0.0, f"{type(e).__name__}: {e}"))
+        return self.samples
+
+
+def _run_session(session_id, seed, iterations, timeout):
+    """线程入口：运行一个会话，返回操作记录"""
+    return SessionSimulator(session_id, seed, timeout).run(iterations)
+
+
+def summarize(samples):
+    """按操作类型统计延迟分位数，返回 (统计表, 吞吐量, 总耗时)"""
+    df = pd.DataFrame(samples, columns=['操作', '开始时间', '耗时', '错误'])
+    elapsed = (df['开始时间'] + df['耗时']).max() - df['开始时间'].min() if len(df) else 0.0
+    rows = []
+    for action, group in [('全部', df)] + list(df.groupby('操作')):
+        seconds = group['耗时'].to_numpy()
+        rows.append({
+            '操作': action,
+            '次数': len(group),
+            '错误': int(group['错误'].notna().sum()),
+            'p50(ms)': np.percentile(seconds, 50) * 1000,
+            'p95(ms)': np.percentile(seconds, 95) * 1000,
+            'p99(ms)': np.percentile(seconds, 99) * 1000,
+            '最大(ms)': seconds.max() * 1000,
+        })
+    return pd.DataFrame(rows), len(df) / elapsed if elapsed > 0 else 0.0, elapsed
+
+
+def run_load_test(sessions=10, iterations=10, materials=10, accessories=50, packaging=20,
+                  history=1000, seed=0, timeout=120, keep_data=False):
+    """在临时数据目录中运行压力测试，返回统计结果。
+    会话在当前进程中运行，进程内的资源（如 st.cache_resource）在会话之间共用"""
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    previous_dir = os.getcwd()
+    try:
+        generate_data(os.path.join(work_dir, "data"), materials, accessories, packaging, history, seed)
+        if APP_DIR not in sys.path:
+            sys.path.insert(0, APP_DIR)
+        # app.py 使用相对路径 data/；不在本机端口上输出运行指标
+        os.chdir(work_dir)
+        os.environ.setdefault("ASSET_METRICS_PORT", "0")
+        baseline = current_rss()
+        with shared_runtime(), ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="session") as pool:
+            futures = [pool.submit(_run_session, i, seed + i, iterations, timeout) for i in range(sessions)]
+            results = [future.result() for future in futures]
+        samples = [sample for session_samples in results for sample in session_samples]
+        table, throughput, elapsed = summarize(samples)
+        errors = sorted({sample[-1] for sample in samples if sample[-1]})
+        return {
+            '统计': table,
+            '吞吐量': throughput,
+            '总耗时': elapsed,
+            '会话前内存': baseline,
+            '内存峰值': peak_rss(),
+            '错误信息': errors,
+            '数据目录': work_dir if keep_data else None,
+        }
+    finally:
+        os.chdir(previous_dir)
+        if not keep_data:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="资产管理平台多会话压力测试")
+    parser.add_argument("--sessions", type=int, default=10, help="同时模拟的会话数")
+    parser.add_argument("--iterations", type=int, default=10, help="每个会话执行的操作数")
+    parser.add_argument("--materials", type=int, default=10, help="打印材料数量")
+    parser.add_argument("--accessories", type=int, default=50, help="产品配件数量")
+    parser.add_argument("--packaging", type=int, default=20, help="包装数量")
+    parser.add_argument("--history", type=int, default=1000, help="历史记录条数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--timeout", type=float, default=120, help="单次运行超时（秒）")
+    parser.add_argument("--keep-data", action="store_true", help="保留生成的临时数据目录")
+    args = parser.parse_args()
+
+    print(f"🚀 压力测试: {args.sessions} 个会话 × {args.iterations} 次操作")
+    print(f"📊 数据规模: 材料 {args.materials} / 配件 {args.accessories} / "
+          f"包装 {args.packaging} / 历史 {args.history}")
+    report = run_load_test(args.sessions, args.iterations, args.materials, args.accessories,
+                           args.packaging, args.history, args.seed, args.timeout, args.keep_data)
+    print("\n" + report['统计'].to_string(index=False, float_format=lambda v: f"{v:.1f}"))
+    print(f"\n⏱️  总耗时: {report['总耗时']:.1f} 秒")
+    print(f"📈 吞吐量: {report['吞吐量']:.2f} 次/秒")
+    if report['会话前内存']:
+        print(f"💾 会话开始前内存: {report['会话前内存'] / 1024 / 1024:.1f} MB")
+    print(f"💾 进程内存峰值: {report['内存峰值'] / 1024 / 1024:.1f} MB")
+    if report['错误信息']:
+        print("\n❌ 错误:")
+        for error in report['错误信息']:
+            print(f"   - {error}")
+    if report['数据目录']:
+        print(f"\n📁 数据目录: {report['数据目录']}")
+
+
+if __name__ == "__main__":
+    main()
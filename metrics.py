@@ -0,0 +1,278 @@
+"""
+运行指标模块
+进程内的计数器、数值和耗时直方图，按 Prometheus 文本格式输出，
+可以通过本机端口（/metrics）抓取，也可以定时写入文件（供 node_exporter 的 textfile 收集器读取）。
+各模块直接使用模块级的 REGISTRY 记录指标，不需要在函数之间传递
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 默认的耗时分桶（秒），覆盖从几毫秒的读取到几十秒的批量写入
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} 需要标签 {self.label_names}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.description)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, label_values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, label_values, extra)} "
+                         f"{_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [('_total', key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """可增可减的当前值，也可以设置为输出时才调用的函数（如队列深度）"""
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_function(self, function, **labels):
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def value(self, **labels):
+        key = self._key(labels)
+        function = self._functions.get(key)
+        return float(function()) if function else self._values.get(key, 0.0)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = float(function())
+            except Exception:
+                values.pop(key, None)
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """耗时分布：每个分桶的累计次数、总和和次数"""
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 代码块的耗时（出错时也记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state['count'] if state else 0
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+                samples.append(('_sum', key, (), state['sum']))
+                samples.append(('_count', key, (), state['count']))
+        return samples
+
+
+class Registry:
+    """按名称注册的指标，同名指标只创建一次"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, description, labels, **kwargs):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, description, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name, description, labels=()):
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name, description, labels=()):
+        return self._get(Gauge, name, description, labels)
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, description, labels, buckets=buckets)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+    def write_file(self, file_path):
+        """写入文件（先写临时文件再替换，抓取时不会读到写了一半的文件）"""
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, file_path)
+
+
+REGISTRY = Registry(prefix='asset_platform_')
+
+
+class MetricsExporter:
+    """在后台输出指标：监听本机端口提供 /metrics，和/或定时写入文件"""
+
+    def __init__(self, registry=REGISTRY, port=None, host='127.0.0.1', file_path=None, interval=15.0):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self.file_path = file_path
+        self.interval = interval
+        self.last_error = None
+        self._server = None
+        self._stop = threading.Event()
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        if self.port is not None:
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+                self._server.daemon_threads = True
+                threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            except OSError as e:
+                # 端口被占用（如同一台机器上运行了多个实例）时只写文件
+                self.last_error = f"无法监听端口 {self.port}: {e}"
+                self._server = None
+        if self.file_path:
+            threading.Thread(target=self._write_loop, name="metrics-file", daemon=True).start()
+        return self
+
+    @property
+    def address(self):
+        if self._server is None:
+            return None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def _write_loop(self):
+        while True:
+            try:
+                self.registry.write_file(self.file_path)
+            except OSError as e:
+                self.last_error = f"写入指标文件失败: {e}"
+            if self._stop.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+数据结构迁移脚本
+数据目录中的 schema_version.json 记录当前数据结构版本，
+启动时按顺序执行尚未执行的迁移，之后读取数据时不再需要补列等修复
+"""
+
+import json
+import os
+from contextlib import nullcontext
+
+import pandas as pd
+
+from catalog_store import write_catalog
+from history_store import split_legacy_history
+from inventory import Inventory, seed_rows as inventory_seed_rows
+from price_history import PriceHistory, seed_rows
+from purchase_lots import DEFAULT_COST_METHOD
+from schema import PRINT_MATERIALS_SCHEMA, UNIT_ITEMS_SCHEMA, MATERIAL_LOTS_SCHEMA
+
+SCHEMA_VERSION_FILE = "schema_version.json"
+MATERIAL_LOTS_FILE = "material_lots.xlsx"
+PRICE_HISTORY_FILE = "price_history.csv"
+INVENTORY_FILE = "inventory_ledger.csv"
+HISTORY_FILE = "history_costs.xlsx"
+
+# 数据文件 -> (列定义, 图片子目录)
+CATALOG_FILES = {
+    "print_materials.xlsx": (PRINT_MATERIALS_SCHEMA, "materials"),
+    "accessories.xlsx": (UNIT_ITEMS_SCHEMA, "accessories"),
+    "packaging.xlsx": (UNIT_ITEMS_SCHEMA, "packaging"),
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+# 已注册的迁移: (版本号, 说明, 函数)
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """注册一个迁移，函数接收数据目录作为参数"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def read_schema_version(data_dir):
+    path = os.path.join(data_dir, SCHEMA_VERSION_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as f:
+        return int(json.load(f).get('version', 0))
+
+
+def write_schema_version(data_dir, version):
+    path = os.path.join(data_dir, SCHEMA_VERSION_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': version}, f)
+    os.replace(tmp_path, path)
+
+
+def reset_schema_version(data_dir):
+    """数据文件被重新生成后调用，下次启动时重新执行全部迁移"""
+    path = os.path.join(data_dir, SCHEMA_VERSION_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def run_migrations(data_dir, log=None, lock=None):
+    """执行所有尚未执行的迁移，返回执行过的 (版本号, 说明) 列表。
+    多个线程可能同时迁移同一数据目录时传入同一个锁（如工作区的 migration_lock）"""
+    applied = []
+    with lock or nullcontext():
+        current = read_schema_version(data_dir)
+        for version, description, func in MIGRATIONS:
+            if version <= current:
+                continue
+            if log:
+                log(f"🔄 执行迁移 {version}: {description}")
+            func(data_dir)
+            write_schema_version(data_dir, version)
+            applied.append((version, description))
+    return applied
+
+
+def _catalog_paths(data_dir):
+    for file_name, (schema, image_subdir) in CATALOG_FILES.items():
+        file_path = os.path.join(data_dir, file_name)
+        if os.path.exists(file_path):
+            yield file_path, schema, os.path.join(data_dir, "images", image_subdir)
+
+
+@migration(1, "补全数据表缺失的列并统一列顺序")
+def add_missing_columns(data_dir):
+    for file_path, schema, _ in _catalog_paths(data_dir):
+        df = pd.read_excel(file_path)
+        columns = list(schema)
+        missing = [c for c in columns if c not in df.columns]
+        extra = [c for c in df.columns if c not in columns]
+        if not missing and list(df.columns) == columns + extra:
+            continue
+        for column in missing:
+            df[column] = ''
+        write_catalog(df[columns + extra], file_path)
+
+
+@migration(2, "根据已有图片文件补全图片路径")
+def fill_image_paths(data_dir):
+    """图片路径为空时，按名称查找同名图片（每个目录只列一次文件）"""
+    for file_path, _, image_dir in _catalog_paths(data_dir):
+        if not os.path.isdir(image_dir):
+            continue
+        images = {}
+        for entry in sorted(os.listdir(image_dir)):
+            stem, extension = os.path.splitext(entry)
+            if extension.lower() in IMAGE_EXTENSIONS:
+                images.setdefault(stem, entry)
+        df = pd.read_excel(file_path)
+        paths = df['图片路径'] if '图片路径' in df.columns else pd.Series('', index=df.index)
+        empty = paths.isna() | (paths.astype(str).str.strip() == '')
+        found = df['名称'].astype(str).map(images)
+        updates = empty & found.notna()
+        if updates.any():
+            df['图片路径'] = paths.where(~updates, found)
+            write_catalog(df, file_path)
+
+
+@migration(3, "把每个打印材料现有的购买信息转为第一个采购批次，并补充计价方式")
+def create_material_lots(data_dir):
+    materials_path = os.path.join(data_dir, "print_materials.xlsx")
+    lots_path = os.path.join(data_dir, MATERIAL_LOTS_FILE)
+    if not os.path.exists(materials_path):
+        return
+    materials = pd.read_excel(materials_path)
+    methods = materials['计价方式'] if '计价方式' in materials.columns else pd.Series(index=materials.index, dtype=object)
+    missing = methods.isna() | (methods.astype(str).str.strip() == '')
+    if missing.any():
+        materials['计价方式'] = methods.where(~missing, DEFAULT_COST_METHOD)
+        columns = list(PRINT_MATERIALS_SCHEMA)
+        write_catalog(materials[columns + [c for c in materials.columns if c not in columns]], materials_path)
+    if os.path.exists(lots_path):
+        return
+    lots = pd.DataFrame({
+        '材料': materials['名称'],
+        '购买时间': materials.get('购买时间'),
+        '购买价': materials.get('购买价'),
+        '运费': materials.get('运费'),
+        '克重': materials.get('总克重'),
+        '备注': '',
+    }, columns=list(MATERIAL_LOTS_SCHEMA))
+    lots = lots[lots['材料'].notna() & (pd.to_numeric(lots['克重'], errors='coerce') > 0)]
+    write_catalog(lots, lots_path)
+
+
+@migration(4, "用当前单价和购买时间生成价格历史的初始记录")
+def seed_price_history(data_dir):
+    history = PriceHistory(os.path.join(data_dir, PRICE_HISTORY_FILE))
+    if os.path.exists(history.file_path):
+        return
+    rows = []
+    for file_path, _, _ in _catalog_paths(data_dir):
+        table = os.path.splitext(os.path.basename(file_path))[0]
+        rows.extend(seed_rows(table, pd.read_excel(file_path)))
+    history.append(rows)
+
+
+@migration(5, "把现有采购批次和配件/包装数量记为初始库存")
+def seed_inventory(data_dir):
+    inventory = Inventory(os.path.join(data_dir, INVENTORY_FILE))
+    if os.path.exists(inventory.ledger_file):
+        return
+
+    def read(file_name):
+        path = os.path.join(data_dir, file_name)
+        return pd.read_excel(path) if os.path.exists(path) else None
+
+    inventory.record(inventory_seed_rows(read(MATERIAL_LOTS_FILE), read("accessories.xlsx"), read("packaging.xlsx")))
+
+
+@migration(6, "把历史记录按月拆分为分区")
+def partition_history(data_dir):
+    split_legacy_history(os.path.join(data_dir, HISTORY_FILE))
+
+
+if __name__ == "__main__":
+    data_dir = "data"
+    applied = run_migrations(data_dir, log=print)
+    if applied:
+        print(f"✅ 数据结构已升级到版本 {read_schema_version(data_dir)}")
+    else:
+        print(f"✅ 数据结构已是最新版本 {read_schema_version(data_dir)}")
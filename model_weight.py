@@ -0,0 +1,255 @@
+"""
+模型克重估算模块
+在不切片的情况下，根据STL/3MF模型体积估算打印克重，用于快速报价；
+G-code文件直接读取切片软件写入的耗材用量
+"""
+
+import math
+import os
+import re
+import zipfile
+
+import numpy as np
+
+# 二进制STL: 80字节文件头 + 4字节三角形数量 + 每个三角形50字节
+STL_HEADER_SIZE = 84
+STL_TRIANGLE_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attr', '<u2'),
+])
+
+# 分块计算体积，避免一次性把数百万三角形转换为float64
+VOLUME_CHUNK_SIZE = 1_000_000
+
+# 常见耗材密度 (g/cm³)，按耗材类型查找
+MATERIAL_DENSITY = {
+    'PLA': 1.24,
+    'PLA+': 1.24,
+    'ABS': 1.04,
+    'ASA': 1.07,
+    'PETG': 1.27,
+    'TPU': 1.21,
+    'PC': 1.20,
+    'PA': 1.14,
+    'NYLON': 1.14,
+}
+DEFAULT_DENSITY = 1.24
+
+# 默认打印参数：外壳(墙+顶底)占模型体积的比例、填充率
+DEFAULT_SHELL_RATIO = 0.25
+DEFAULT_INFILL = 0.15
+
+_ASCII_VERTEX_RE = re.compile(rb'vertex\s+(\S+)\s+(\S+)\s+(\S+)')
+
+# 支持的模型文件扩展名
+MODEL_EXTENSIONS = ('.stl', '.3mf', '.gcode', '.gco')
+
+# 耗材直径 (mm)，用于把G-code中的耗材长度换算为克重
+DEFAULT_FILAMENT_DIAMETER = 1.75
+
+# 3MF单位换算为mm
+_3MF_UNIT_SCALE = {
+    'micron': 0.001,
+    'millimeter': 1.0,
+    'centimeter': 10.0,
+    'inch': 25.4,
+    'foot': 304.8,
+    'meter': 1000.0,
+}
+_3MF_UNIT_RE = re.compile(rb'<model[^>]*\sunit="([a-z]+)"')
+_3MF_MESH_RE = re.compile(rb'<mesh>(.*?)</mesh>', re.S)
+_3MF_VERTEX_RE = re.compile(rb'<vertex\s+x="([^"]+)"\s+y="([^"]+)"\s+z="([^"]+)"')
+_3MF_TRIANGLE_RE = re.compile(rb'<triangle\s+v1="(\d+)"\s+v2="(\d+)"\s+v3="(\d+)"')
+_3MF_USED_G_RE = re.compile(rb'used_g="([\d.]+)"')
+
+# 切片软件在G-code中写入的耗材用量注释（只读取文件头尾）
+_GCODE_SCAN_BYTES = 256 * 1024
+_GCODE_GRAMS_RE = re.compile(
+    rb'^;\s*(?:total filament used \[g\]|total filament weight \[g\]|filament used \[g\])\s*[=:]\s*([\d.,\s]+)$',
+    re.M | re.I)
+_GCODE_MM_RE = re.compile(rb'^;\s*filament used \[mm\]\s*=\s*([\d.,\s]+)$', re.M | re.I)
+_GCODE_METERS_RE = re.compile(rb'^;\s*Filament used:\s*([\d.,\sm]+)$', re.M | re.I)
+
+
+def _is_binary_stl(buffer):
+    """根据文件长度判断是否为二进制STL（部分二进制文件头也以solid开头）"""
+    if len(buffer) < STL_HEADER_SIZE:
+        return False
+    count = int(np.frombuffer(buffer, dtype='<u4', count=1, offset=80)[0])
+    return len(buffer) == STL_HEADER_SIZE + count * STL_TRIANGLE_DTYPE.itemsize
+
+
+def read_stl_triangles(source):
+    """读取STL三角形顶点，返回形状为 (N, 3, 3) 的数组
+
+    source 可以是文件路径（二进制STL使用内存映射，不读入内存），
+    也可以是 bytes / memoryview（例如 Streamlit 上传的文件）。
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            head = f.read(STL_HEADER_SIZE)
+        size = os.path.getsize(source)
+        if len(head) == STL_HEADER_SIZE:
+            count = int(np.frombuffer(head, dtype='<u4', count=1, offset=80)[0])
+            if size == STL_HEADER_SIZE + count * STL_TRIANGLE_DTYPE.itemsize:
+                if count == 0:
+                    return np.empty((0, 3, 3), dtype='<f4')
+                triangles = np.memmap(source, dtype=STL_TRIANGLE_DTYPE, mode='r',
+                                      offset=STL_HEADER_SIZE, shape=(count,))
+                return triangles['vertices']
+        with open(source, 'rb') as f:
+            return _parse_ascii_stl(f.read())
+
+    buffer = memoryview(source).cast('B')
+    if _is_binary_stl(buffer):
+        count = (len(buffer) - STL_HEADER_SIZE) // STL_TRIANGLE_DTYPE.itemsize
+        triangles = np.frombuffer(buffer, dtype=STL_TRIANGLE_DTYPE,
+                                  count=count, offset=STL_HEADER_SIZE)
+        return triangles['vertices']
+    return _parse_ascii_stl(bytes(buffer))
+
+
+def _parse_ascii_stl(data):
+    """解析ASCII STL的顶点坐标"""
+    matches = _ASCII_VERTEX_RE.findall(data)
+    if len(matches) % 3 != 0:
+        raise ValueError("STL文件格式错误：顶点数量不是3的倍数")
+    if not matches:
+        return np.empty((0, 3, 3), dtype=np.float64)
+    return np.array(matches).astype(np.float64).reshape(-1, 3, 3)
+
+
+def mesh_volume(triangles):
+    """计算封闭网格体积（模型单位的立方，STL通常为mm³）
+
+    使用带符号四面体体积之和：V = Σ v0·(v1×v2) / 6
+    """
+    total = 0.0
+    for start in range(0, len(triangles), VOLUME_CHUNK_SIZE):
+        chunk = np.asarray(triangles[start:start + VOLUME_CHUNK_SIZE], dtype=np.float64)
+        v0, v1, v2 = chunk[:, 0], chunk[:, 1], chunk[:, 2]
+        total += np.einsum('ij,ij->', v0, np.cross(v1, v2))
+    return float(abs(total)) / 6.0
+
+
+def material_density(material_row):
+    """获取打印材料密度 (g/cm³)：优先使用材料表的密度列，否则按耗材类型查表"""
+    density = material_row.get('密度') if material_row is not None else None
+    try:
+        density = float(density)
+        if density > 0:
+            return density
+    except (TypeError, ValueError):
+        pass
+    material_type = ''
+    if material_row is not None:
+        material_type = str(material_row.get('耗材类型', '') or '').strip().upper()
+    return MATERIAL_DENSITY.get(material_type, DEFAULT_DENSITY)
+
+
+def volume_to_weight(volume_mm3, density, infill=DEFAULT_INFILL, shell_ratio=DEFAULT_SHELL_RATIO):
+    """按密度和填充假设将体积换算为克重
+
+    外壳部分按实心计算，其余内部体积按填充率计算。
+    """
+    fill_factor = shell_ratio + (1.0 - shell_ratio) * infill
+    return volume_mm3 / 1000.0 * density * fill_factor
+
+
+def estimate_stl_weight(source, density=DEFAULT_DENSITY, infill=DEFAULT_INFILL,
+                        shell_ratio=DEFAULT_SHELL_RATIO):
+    """估算STL模型克重，返回包含三角形数量、体积(cm³)和克重的字典"""
+    triangles = read_stl_triangles(source)
+    volume = mesh_volume(triangles)
+    return {
+        '三角形数量': int(len(triangles)),
+        '体积': volume / 1000.0,
+        '克重': volume_to_weight(volume, density, infill, shell_ratio),
+    }
+
+
+def read_3mf_volume(source):
+    """计算3MF文件中所有网格的体积之和 (mm³)"""
+    volume = 0.0
+    with zipfile.ZipFile(source) as archive:
+        for name in archive.namelist():
+            if not name.lower().endswith('.model'):
+                continue
+            data = archive.read(name)
+            unit = _3MF_UNIT_RE.search(data)
+            scale = _3MF_UNIT_SCALE.get(unit.group(1).decode() if unit else 'millimeter', 1.0)
+            for mesh in _3MF_MESH_RE.findall(data):
+                vertices = np.array(_3MF_VERTEX_RE.findall(mesh)).astype(np.float64).reshape(-1, 3)
+                faces = np.array(_3MF_TRIANGLE_RE.findall(mesh)).astype(np.int64).reshape(-1, 3)
+                if len(faces):
+                    volume += mesh_volume(vertices[faces]) * scale ** 3
+    return volume
+
+
+def read_3mf_sliced_weight(source):
+    """读取已切片3MF（如Bambu Studio）中记录的耗材克重，没有则返回None"""
+    with zipfile.ZipFile(source) as archive:
+        for name in archive.namelist():
+            if name.lower().endswith('slice_info.config'):
+                grams = [float(v) for v in _3MF_USED_G_RE.findall(archive.read(name))]
+                if grams:
+                    return sum(grams)
+    return None
+
+
+def _sum_numbers(text):
+    """把 '1.2, 3.4' 这样的多耗材用量求和"""
+    return sum(float(v) for v in re.findall(rb'[\d.]+', text) if v.strip(b'.'))
+
+
+def read_gcode_weight(path, density=DEFAULT_DENSITY, diameter=DEFAULT_FILAMENT_DIAMETER):
+    """从G-code注释中读取耗材克重，只扫描文件开头和结尾，没有则返回None"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(_GCODE_SCAN_BYTES)
+        if size > 2 * _GCODE_SCAN_BYTES:
+            f.seek(-_GCODE_SCAN_BYTES, os.SEEK_END)
+            tail = f.read()
+        else:
+            tail = f.read()
+    text = head + b'\n' + tail
+
+    match = _GCODE_GRAMS_RE.search(text)
+    if match:
+        return _sum_numbers(match.group(1))
+    # 只有耗材长度时按截面积和密度换算
+    area = math.pi * (diameter / 2.0) ** 2
+    match = _GCODE_MM_RE.search(text)
+    if match:
+        return _sum_numbers(match.group(1)) * area / 1000.0 * density
+    match = _GCODE_METERS_RE.search(text)
+    if match:
+        return _sum_numbers(match.group(1)) * 1000.0 * area / 1000.0 * density
+    return None
+
+
+def estimate_model_weight(path, density=DEFAULT_DENSITY, infill=DEFAULT_INFILL,
+                          shell_ratio=DEFAULT_SHELL_RATIO):
+    """按文件类型获取模型克重
+
+    G-code和已切片的3MF使用切片软件给出的克重，其余按模型体积估算。
+    返回包含克重、克重来源和体积(cm³，无法得到时为None)的字典。
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.gcode', '.gco'):
+        grams = read_gcode_weight(path, density)
+        if grams is None:
+            raise ValueError("G-code中未找到耗材用量信息")
+        return {'克重': grams, '克重来源': 'G-code', '体积': None}
+    if extension == '.3mf':
+        grams = read_3mf_sliced_weight(path)
+        if grams is not None:
+            return {'克重': grams, '克重来源': '3MF切片信息', '体积': None}
+        volume = read_3mf_volume(path)
+        return {'克重': volume_to_weight(volume, density, infill, shell_ratio),
+                '克重来源': '3MF体积估算', '体积': volume / 1000.0}
+    if extension == '.stl':
+        result = estimate_stl_weight(path, density, infill, shell_ratio)
+        return {'克重': result['克重'], '克重来源': 'STL体积估算', '体积': result['体积']}
+    raise ValueError(f"不支持的文件类型: {extension}")
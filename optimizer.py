@@ -0,0 +1,118 @@
+"""
+最便宜配置搜索模块
+按客户的约束（耗材类型/颜色/质感、必须包含的包装类别）在打印材料和包装中查找成本最低的前k个配置。
+数据版本变化时只预处理一次：材料按 (耗材类型, 耗材颜色, 质感) 分组、包装按类别分组，各组按单价排序，
+并记录每种耗材类型的最低单价。查询时只合并满足约束的组，从每一项都最便宜的组合开始，
+按总成本从低到高逐个展开（最佳优先搜索），找到k个即停止，不需要枚举全部组合
+"""
+
+import heapq
+from itertools import islice
+
+import pandas as pd
+
+MATERIAL_KEYS = ['耗材类型', '耗材颜色', '质感']
+
+
+def _text(value):
+    return '' if value is None or pd.isna(value) else str(value).strip()
+
+
+def packaging_category(row):
+    """包装的类别：填写了规格时使用规格（如 纸箱/气泡袋），否则使用名称"""
+    return _text(row.get('规格')) or _text(row.get('名称'))
+
+
+def _valid_rows(df, cost_column):
+    if df is None or df.empty or '名称' not in df.columns or cost_column not in df.columns:
+        return []
+    costs = pd.to_numeric(df[cost_column], errors='coerce')
+    selected = df[df['名称'].notna() & costs.notna() & (costs >= 0)]
+    return [(float(cost), row) for cost, row in zip(costs[selected.index], selected.to_dict('records'))]
+
+
+class ConfigurationIndex:
+    """预处理后的材料和包装分组，用于快速查找最便宜的配置"""
+
+    def __init__(self, materials_df, packaging_df):
+        # (耗材类型, 耗材颜色, 质感) -> [(每克成本, 名称)]，按单价排序
+        self.material_groups = {}
+        for cost, row in _valid_rows(materials_df, '每克成本'):
+            key = tuple(_text(row.get(column)) for column in MATERIAL_KEYS)
+            self.material_groups.setdefault(key, []).append((cost, str(row['名称'])))
+        for items in self.material_groups.values():
+            items.sort()
+        # 耗材类型 -> (最低每克成本, 名称)
+        self.type_minimums = {}
+        for (material_type, _, _), items in self.material_groups.items():
+            if material_type not in self.type_minimums or items[0] < self.type_minimums[material_type]:
+                self.type_minimums[material_type] = items[0]
+        # 包装类别 -> [(每单位成本, 名称)]，按单价排序
+        self.packaging_groups = {}
+        for cost, row in _valid_rows(packaging_df, '每单位成本'):
+            self.packaging_groups.setdefault(packaging_category(row), []).append((cost, str(row['名称'])))
+        for items in self.packaging_groups.values():
+            items.sort()
+
+    def options(self):
+        """各约束可选的取值"""
+        options = {column: sorted({key[i] for key in self.material_groups} - {''})
+                   for i, column in enumerate(MATERIAL_KEYS)}
+        options['包装类别'] = sorted(self.packaging_groups)
+        return options
+
+    def cheapest_by_type(self, weight):
+        """每种耗材类型最便宜的材料和按克重计算的材料成本"""
+        rows = [{'耗材类型': material_type or '未填写', '材料': name, '每克成本': cost, '材料成本': weight * cost}
+                for material_type, (cost, name) in self.type_minimums.items()]
+        return pd.DataFrame(rows, columns=['耗材类型', '材料', '每克成本', '材料成本']).sort_values('材料成本')
+
+    def _materials(self, types, colors, textures, limit):
+        groups = [items for (material_type, color, texture), items in self.material_groups.items()
+                  if (not types or material_type in types) and (not colors or color in colors)
+                  and (not textures or texture in textures)]
+        # 各组已排序，只合并出最便宜的 limit 个
+        return list(islice(heapq.merge(*groups), limit))
+
+    def search(self, weight, types=(), colors=(), textures=(), packaging_categories=(), top_k=5,
+               fixed_cost=0.0, max_cost=None):
+        """成本最低的前 top_k 个配置，每个配置为一种材料加上每个必须的包装类别中的一件包装。
+        fixed_cost（如已选配件）计入总成本；max_cost 为总成本上限。
+        每一项只需要考虑最便宜的 top_k 个候选：用到第 k+1 个候选的组合，
+        至少有 k 个只在这一项上更便宜的组合排在它前面"""
+        if top_k <= 0:
+            return []
+        dimensions = [[(weight * cost, name, cost)
+                       for cost, name in self._materials(set(types), set(colors), set(textures), top_k)]]
+        for category in packaging_categories:
+            dimensions.append([(cost, name, cost) for cost, name in self.packaging_groups.get(category, [])[:top_k]])
+        if any(not options for options in dimensions):
+            return []
+
+        start = (0,) * len(dimensions)
+        heap = [(sum(options[0][0] for options in dimensions), start)]
+        seen = {start}
+        results = []
+        while heap and len(results) < top_k:
+            cost, positions = heapq.heappop(heap)
+            if max_cost is not None and cost + fixed_cost > max_cost:
+                break
+            chosen = [options[position] for options, position in zip(dimensions, positions)]
+            material_cost, material, unit_cost = chosen[0]
+            results.append({
+                '材料': material,
+                '每克成本': unit_cost,
+                '材料成本': material_cost,
+                '包装': [name for _, name, _ in chosen[1:]],
+                '包装成本': cost - material_cost,
+                '总成本': cost + fixed_cost,
+            })
+            # 每次把一项换成它的下一个更贵的候选
+            for dimension, position in enumerate(positions):
+                if position + 1 < len(dimensions[dimension]):
+                    following = positions[:dimension] + (position + 1,) + positions[dimension + 1:]
+                    if following not in seen:
+                        seen.add(following)
+                        following_cost = sum(options[p][0] for options, p in zip(dimensions, following))
+                        heapq.heappush(heap, (following_cost, following))
+        return results
@@ -0,0 +1,210 @@
+"""
+价格历史模块
+打印材料/配件/包装的单价每次变化时，在 price_history.csv 末尾追加一行（时间, 类别, 名称, 单价），
+形成按时间排列的价格序列。
+重算历史报价时，用 pd.merge_asof 把全部历史记录一次性与价格序列按时间对齐：
+可以按报价当时的价格、今天的价格或任意日期的价格重新计算成本，不需要逐行查找
+"""
+
+import csv
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 数据表 -> 单价列
+PRICE_COLUMNS = {
+    'print_materials': '每克成本',
+    'accessories': '每单位成本',
+    'packaging': '每单位成本',
+}
+
+# 历史记录中配件/包装的类别 -> 数据表
+ITEM_TABLES = {
+    '产品配件': 'accessories',
+    '包装': 'packaging',
+}
+
+PRICE_HISTORY_COLUMNS = ['时间', '类别', '名称', '单价']
+
+
+def current_prices(table, df):
+    """数据表中每个名称的当前单价（名称重复时以最后一行为准）"""
+    column = PRICE_COLUMNS.get(table)
+    if df is None or df.empty or column not in df.columns or '名称' not in df.columns:
+        return pd.Series(dtype=float)
+    prices = pd.Series(pd.to_numeric(df[column], errors='coerce').to_numpy(),
+                       index=df['名称'].astype(str).to_numpy())
+    prices = prices[~prices.index.duplicated(keep='last')]
+    return prices.dropna()
+
+
+def changed_prices(table, before_df, after_df):
+    """比较修改前后的数据表，返回新增或单价变化的 (名称, 单价)"""
+    before = current_prices(table, before_df)
+    after = current_prices(table, after_df)
+    old = before.reindex(after.index)
+    changed = old.isna() | ~np.isclose(old.to_numpy(dtype=float), after.to_numpy(dtype=float))
+    return after[changed]
+
+
+class PriceHistory:
+    """追加写入的价格序列文件"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._cache = None
+        self._cache_key = None
+
+    def append(self, rows):
+        """追加 (时间, 类别, 名称, 单价) 行"""
+        if not rows:
+            return
+        with self._lock:
+            new_file = not os.path.exists(self.file_path)
+            with open(self.file_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(PRICE_HISTORY_COLUMNS)
+                writer.writerows(rows)
+
+    def record_changes(self, table, before_df, after_df, when=None):
+        """数据表保存时调用，记录单价有变化的名称"""
+        if table not in PRICE_COLUMNS:
+            return 0
+        changed = changed_prices(table, before_df, after_df)
+        when = (when or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+        self.append([(when, table, name, float(price)) for name, price in changed.items()])
+        return len(changed)
+
+    def load(self):
+        """读取价格序列（按时间排序），文件没有变化时使用缓存"""
+        if not os.path.exists(self.file_path):
+            return pd.DataFrame({'时间': pd.Series(dtype='datetime64[ns]'), '类别': pd.Series(dtype=object),
+                                 '名称': pd.Series(dtype=object), '单价': pd.Series(dtype=float)})
+        stat = os.stat(self.file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._cache_key != key:
+                prices = pd.read_csv(self.file_path, dtype={'类别': str, '名称': str, '单价': float})
+                prices['时间'] = pd.to_datetime(prices['时间'], errors='coerce')
+                prices = prices.dropna(subset=['时间', '单价'])
+                self._cache = prices.sort_values('时间', kind='mergesort').reset_index(drop=True)
+                self._cache_key = key
+            return self._cache
+
+    def series(self, table, name):
+        """某个名称的价格序列"""
+        prices = self.load()
+        selected = prices[(prices['类别'] == table) & (prices['名称'] == name)]
+        return selected.set_index('时间')['单价']
+
+
+def seed_rows(table, df, default_time=None):
+    """没有价格历史时的初始记录：每个名称以购买时间（没有时为当前时间）记录当前单价"""
+    prices = current_prices(table, df)
+    if prices.empty:
+        return []
+    default_time = default_time or datetime.now()
+    times = {}
+    if '购买时间' in df.columns:
+        purchase = pd.to_datetime(df['购买时间'], errors='coerce')
+        times = dict(zip(df['名称'].astype(str), purchase))
+    rows = []
+    for name, price in prices.items():
+        when = times.get(name)
+        when = default_time if when is None or pd.isna(when) else when
+        rows.append((when.strftime('%Y-%m-%d %H:%M:%S'), table, name, float(price)))
+    return rows
+
+
+def lookup_prices(names, times, prices, as_of=None):
+    """批量查询价格
+
+    names/times: 每个查询的名称和时间；prices: 某一类别的价格序列（时间, 名称, 单价）。
+    as_of 为空时按每个查询自己的时间取当时的价格（merge_asof），否则都取 as_of 时的价格；
+    早于第一条价格记录的查询使用最早的价格，没有时间的查询使用最新的价格。
+    """
+    names = pd.Series(np.asarray(names, dtype=object)).astype(str)
+    result = np.full(len(names), np.nan)
+    if prices.empty or len(names) == 0:
+        return result
+    # 名称统一编码为整数，merge_asof 按整数分组更快
+    categories = pd.Index(pd.unique(prices['名称'].astype(str)))
+    codes = categories.get_indexer(names)
+    price_codes = categories.get_indexer(prices['名称'].astype(str))
+    table = pd.DataFrame({'时间': prices['时间'].to_numpy().astype('datetime64[ns]'), '编码': price_codes,
+                          '单价': prices['单价'].to_numpy(dtype=float)})
+    latest = table.drop_duplicates('编码', keep='last').set_index('编码')['单价']
+    earliest = table.drop_duplicates('编码', keep='first').set_index('编码')['单价']
+
+    known = codes >= 0
+    if as_of is not None:
+        as_of = pd.Timestamp(as_of)
+        upto = table[table['时间'] <= as_of].drop_duplicates('编码', keep='last').set_index('编码')['单价']
+        lookup = earliest.copy()
+        lookup.update(upto)
+        result[known] = lookup.reindex(codes[known]).to_numpy()
+        return result
+
+    times = pd.to_datetime(pd.Series(np.asarray(times)), errors='coerce').to_numpy().astype('datetime64[ns]')
+    timed = known & ~pd.isna(times)
+    if timed.any():
+        positions = np.flatnonzero(timed)
+        left = pd.DataFrame({'时间': times[positions], '编码': codes[positions], '位置': positions})
+        left = left.sort_values('时间', kind='mergesort')
+        merged = pd.merge_asof(left, table, on='时间', by='编码', direction='backward')
+        values = merged['单价'].to_numpy(dtype=float, copy=True)
+        missing = np.isnan(values)
+        values[missing] = earliest.reindex(merged['编码'].to_numpy()[missing]).to_numpy()
+        result[merged['位置'].to_numpy()] = values
+    untimed = known & pd.isna(times)
+    result[untimed] = latest.reindex(codes[untimed]).to_numpy()
+    return result
+
+
+def recost_history(history, prices, as_of=None):
+    """按价格序列重新计算全部历史报价的成本
+
+    history: TypedHistory；as_of 为空时按报价当时的价格，否则按指定时间的价格。
+    打印材料成本 = 克重 × 每克单价，配件/包装成本 = 各项单价之和；找不到价格的项按0计算并计数。
+    """
+    records = history.records
+    count = len(records)
+    times = records['时间'].to_numpy() if '时间' in records.columns else np.full(count, np.datetime64('NaT'))
+    result = pd.DataFrame(index=records.index)
+    result['时间'] = records['时间'] if '时间' in records.columns else pd.NaT
+    result['打印材料'] = records['打印材料'] if '打印材料' in records.columns else None
+    result['原总成本'] = pd.to_numeric(records.get('总成本'), errors='coerce').astype(float) if '总成本' in records.columns else np.nan
+
+    missing = 0
+    material_prices = prices[prices['类别'] == 'print_materials']
+    if '打印材料' in records.columns:
+        unit = lookup_prices(records['打印材料'].astype(object).fillna('').to_numpy(), times, material_prices, as_of)
+        weights = pd.to_numeric(records.get('克重'), errors='coerce').fillna(0).to_numpy(dtype=float)
+        has_material = records['打印材料'].notna().to_numpy()
+        missing += int((np.isnan(unit) & has_material).sum())
+        result['打印材料成本'] = np.nan_to_num(unit) * weights
+    else:
+        result['打印材料成本'] = 0.0
+
+    items = history.items
+    for column, table in ITEM_TABLES.items():
+        cost_column = '配件成本' if column == '产品配件' else '包装成本'
+        selected = items[items['类别'] == column]
+        if selected.empty:
+            result[cost_column] = 0.0
+            continue
+        record_ids = selected['记录'].to_numpy()
+        unit = lookup_prices(selected['名称'].astype(str).to_numpy(), times[record_ids],
+                             prices[prices['类别'] == table], as_of)
+        missing += int(np.isnan(unit).sum())
+        result[cost_column] = np.bincount(record_ids, weights=np.nan_to_num(unit), minlength=count)[:count]
+
+    result['总成本'] = result['打印材料成本'] + result['配件成本'] + result['包装成本']
+    result['差额'] = result['总成本'] - result['原总成本']
+    result.attrs['缺少价格'] = missing
+    return result
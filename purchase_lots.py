@@ -0,0 +1,129 @@
+"""
+打印材料采购批次模块
+同一种材料可以多次以不同价格购买，每次购买是一个批次，每克成本按先进先出或加权平均计算。
+批次按材料、购买时间排序后预先计算每个材料的累计克重和累计成本，
+查询成本和剩余库存时只在该材料的累计数组上插值，不需要每次遍历所有批次
+"""
+
+import numpy as np
+import pandas as pd
+
+WEIGHTED_AVERAGE = '加权平均'
+FIFO = '先进先出'
+COST_METHODS = [WEIGHTED_AVERAGE, FIFO]
+DEFAULT_COST_METHOD = WEIGHTED_AVERAGE
+
+
+def cost_method(value):
+    """材料行中的计价方式，空值或无法识别时使用默认方式"""
+    return value if value in COST_METHODS else DEFAULT_COST_METHOD
+
+
+class LotCostTable:
+    """按材料预先计算的累计克重/累计成本表"""
+
+    def __init__(self, lots_df):
+        # 材料 -> (累计克重, 累计成本)，两个数组都以0开头
+        self._cumulative = {}
+        required = ['材料', '克重']
+        if lots_df is None or lots_df.empty or any(c not in lots_df.columns for c in required):
+            return
+        df = lots_df[lots_df['材料'].notna() & (pd.to_numeric(lots_df['克重'], errors='coerce') > 0)]
+        if df.empty:
+            return
+        sort_columns = ['材料', '购买时间'] if '购买时间' in df.columns else ['材料']
+        df = df.assign(材料=df['材料'].astype(str)).sort_values(sort_columns, kind='mergesort')
+
+        materials = df['材料'].to_numpy()
+        grams = pd.to_numeric(df['克重'], errors='coerce').to_numpy(dtype=float)
+        cost = np.zeros(len(df))
+        for column in ('购买价', '运费'):
+            if column in df.columns:
+                cost += pd.to_numeric(df[column], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+        # 整体累计一次，再按材料分段减去段首之前的累计值
+        cum_grams = np.concatenate([[0.0], np.cumsum(grams)])
+        cum_cost = np.concatenate([[0.0], np.cumsum(cost)])
+        boundaries = np.flatnonzero(materials[1:] != materials[:-1]) + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [len(df)]])
+        for start, end in zip(starts, ends):
+            self._cumulative[materials[start]] = (
+                cum_grams[start:end + 1] - cum_grams[start],
+                cum_cost[start:end + 1] - cum_cost[start],
+            )
+
+    def __contains__(self, material):
+        return material in self._cumulative
+
+    @property
+    def materials(self):
+        return list(self._cumulative)
+
+    def lot_count(self, material):
+        return len(self._cumulative[material][0]) - 1 if material in self else 0
+
+    def total_grams(self, material):
+        return float(self._cumulative[material][0][-1]) if material in self else 0.0
+
+    def total_cost(self, material):
+        return float(self._cumulative[material][1][-1]) if material in self else 0.0
+
+    def remaining(self, material, consumed=0.0):
+        """剩余库存（克）= 所有批次克重 - 已消耗克重"""
+        return max(self.total_grams(material) - consumed, 0.0)
+
+    def average_cost(self, material):
+        total = self.total_grams(material)
+        return self.total_cost(material) / total if total > 0 else None
+
+    def unit_cost(self, material, method=DEFAULT_COST_METHOD, consumed=0.0):
+        """下一克的成本：加权平均为所有批次的平均价，先进先出为当前正在使用的批次的价格"""
+        if material not in self:
+            return None
+        if cost_method(method) == WEIGHTED_AVERAGE:
+            return self.average_cost(material)
+        cum_grams, cum_cost = self._cumulative[material]
+        lot = min(np.searchsorted(cum_grams, consumed, side='right'), len(cum_grams) - 1)
+        return float((cum_cost[lot] - cum_cost[lot - 1]) / (cum_grams[lot] - cum_grams[lot - 1]))
+
+    def cost(self, material, grams, method=DEFAULT_COST_METHOD, consumed=0.0):
+        """使用 grams 克材料的成本；先进先出时从已消耗的位置开始，跨越多个批次按各自价格计算，
+        超出所有批次的部分按最后一个批次的价格计算"""
+        if material not in self:
+            return None
+        if cost_method(method) == WEIGHTED_AVERAGE:
+            return grams * self.average_cost(material)
+        cum_grams, cum_cost = self._cumulative[material]
+        total = cum_grams[-1]
+        start, end = min(consumed, total), min(consumed + grams, total)
+        cost = float(np.interp(end, cum_grams, cum_cost) - np.interp(start, cum_grams, cum_cost))
+        excess = consumed + grams - max(consumed, total)
+        if excess > 0:
+            cost += excess * self.unit_cost(material, FIFO, total)
+        return cost
+
+
+def latest_lot(lots_df, material):
+    """某个材料最近一次购买的批次（行标签, 行），没有批次时返回 (None, None)"""
+    if lots_df is None or lots_df.empty:
+        return None, None
+    lots = lots_df[lots_df['材料'] == material]
+    if lots.empty:
+        return None, None
+    index = lots['购买时间'].idxmax() if lots['购买时间'].notna().any() else lots.index[-1]
+    return index, lots.loc[index]
+
+
+def material_fields(lots_df, table, material, method=DEFAULT_COST_METHOD, consumed=0.0):
+    """根据批次计算材料行中的字段：购买价/运费/总克重/购买时间取最近一次购买，每克成本按计价方式计算"""
+    _, lot = latest_lot(lots_df, material)
+    if lot is None:
+        return None
+    return {
+        '购买价': lot['购买价'],
+        '运费': lot['运费'],
+        '总克重': lot['克重'],
+        '购买时间': lot['购买时间'],
+        '每克成本': table.unit_cost(material, method, consumed),
+    }
@@ -0,0 +1,400 @@
+"""
+客户报价单模块
+把一次价格计算的明细或选中的历史记录生成给客户的报价单（xlsx 和 PDF），包含产品缩略图。
+模板（版式、字体对象、固定文字、单元格格式）只编译一次：批量生成时每个工作进程初始化时编译一次，
+之后每份报价单只生成变化的部分；同一图片的缩略图在每个进程中也只生成一次。
+PDF 不依赖额外的库：文字使用 PDF 阅读器自带的中文字体 STSong-Light（不需要嵌入字体文件），
+缩略图以 JPEG 嵌入。全部报价单最后打包成一个压缩包下载
+"""
+
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import xlsxwriter
+
+from history_store import _split_names
+from image_cache import decode_thumbnail
+from price_history import ITEM_TABLES, lookup_prices
+
+QUOTE_FORMATS = {
+    'PDF': '.pdf',
+    'Excel': '.xlsx',
+}
+
+# A4 纸（单位：点）
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 50
+ROW_HEIGHT = 46
+THUMBNAIL_POINTS = 40
+# 明细表各列：(标题, 左边位置, 宽度, 右对齐)
+PDF_COLUMNS = [
+    ('图片', 50, 50, False),
+    ('类别', 105, 60, False),
+    ('名称', 165, 160, False),
+    ('数量', 325, 70, True),
+    ('单价', 400, 70, True),
+    ('金额', 475, 70, True),
+]
+
+DEFAULT_TEMPLATE = {
+    '标题': '报价单',
+    '公司': '',
+    '页脚': '本报价单由资产管理平台生成，价格有效期7天',
+    '缩略图像素': 160,
+}
+
+
+def format_quantity(item):
+    quantity = item['数量']
+    text = f"{quantity:g}" if isinstance(quantity, (int, float)) else str(quantity)
+    return f"{text} {item.get('单位', '')}".strip()
+
+
+def quote_total(quote):
+    """给客户的报价：填写了售价时为售价，否则为成本合计"""
+    return quote['售价'] if quote.get('售价') else quote['成本合计']
+
+
+def quote_file_name(quote, extension):
+    safe_customer = ''.join(c for c in (quote.get('客户') or '') if c.isalnum() or c in '-_')
+    return f"{quote['编号']}{'_' + safe_customer if safe_customer else ''}{extension}"
+
+
+def _pdf_text(text):
+    """PDF 字符串：UTF-16BE 十六进制（UniGB-UCS2-H 编码只支持基本多文种平面的字符）"""
+    text = ''.join(c for c in str(text) if ord(c) <= 0xFFFF)
+    return '<' + text.encode('utf-16-be').hex().upper() + '>'
+
+
+def _text_width(text, size):
+    """估算文字宽度：ASCII 半角，其余全角"""
+    return sum(0.5 if ord(c) < 128 else 1.0 for c in str(text)) * size
+
+
+class QuoteTemplate:
+    """编译后的报价单模板，同一进程中生成多份报价单时重复使用"""
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_TEMPLATE, **(options or {})}
+        self._thumbnails = {}
+        # PDF 中固定不变的对象：字体（对象号3、4、5）
+        self.font_objects = [
+            b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+            b"/DescendantFonts [4 0 R] >>",
+            b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+            b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+            b"/FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>",
+            b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] "
+            b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>",
+        ]
+        # 每页都相同的内容：标题、公司、表头、页脚
+        header = [self._text(MARGIN, PAGE_HEIGHT - 70, self.options['标题'], 22)]
+        if self.options['公司']:
+            header.append(self._text(MARGIN, PAGE_HEIGHT - 92, self.options['公司'], 11))
+        table_top = PAGE_HEIGHT - 190
+        for title, left, width, right in PDF_COLUMNS:
+            header.append(self._cell(left, width, table_top, title, 10, right))
+        header.append(f"0.6 w {MARGIN} {table_top - 8} m {PAGE_WIDTH - MARGIN} {table_top - 8} l S")
+        header.append(self._text(MARGIN, 30, self.options['页脚'], 8))
+        self.page_header = '\n'.join(header)
+        self.table_top = table_top - 8
+        self.rows_per_page = int((self.table_top - 140) // ROW_HEIGHT)
+        # xlsx 单元格格式（每个工作簿需要重新创建格式对象，格式定义只准备一次）
+        self.xlsx_formats = {
+            'title': {'bold': True, 'font_size': 18},
+            'label': {'bold': True},
+            'header': {'bold': True, 'bottom': 1, 'bg_color': '#F2F2F2'},
+            'money': {'num_format': '¥#,##0.00', 'valign': 'vcenter'},
+            'text': {'valign': 'vcenter'},
+            'total': {'bold': True, 'num_format': '¥#,##0.00', 'top': 1},
+            'footer': {'italic': True, 'font_color': '#808080'},
+        }
+
+    @staticmethod
+    def _text(x, y, text, size):
+        return f"BT /F1 {size} Tf {x:.1f} {y:.1f} Td {_pdf_text(text)} Tj ET"
+
+    def _cell(self, left, width, y, text, size, right=False):
+        x = left + width - _text_width(text, size) if right else left
+        return self._text(x, y, text, size)
+
+    def thumbnail(self, image_path):
+        """缩略图 (JPEG数据, 宽, 高)，同一图片只生成一次，图片不存在或无法读取时返回 None"""
+        if not image_path:
+            return None
+        if image_path not in self._thumbnails:
+            try:
+                # 先缩小再转换为 RGB，JPEG 不需要解码完整分辨率
+                image = decode_thumbnail(image_path, self.options['缩略图像素']).convert('RGB')
+                buffer = io.BytesIO()
+                image.save(buffer, format='JPEG', quality=85)
+                self._thumbnails[image_path] = (buffer.getvalue(), image.width, image.height)
+            except (OSError, ValueError):
+                self._thumbnails[image_path] = None
+        return self._thumbnails[image_path]
+
+    def render_pdf(self, quote, out_path):
+        items = quote['项目']
+        pages = [items[i:i + self.rows_per_page] for i in range(0, len(items), self.rows_per_page)] or [[]]
+        images = {}
+        page_streams = []
+        for page_number, page_items in enumerate(pages, start=1):
+            parts = [self.page_header,
+                     self._text(MARGIN, PAGE_HEIGHT - 125, f"报价编号: {quote['编号']}", 10),
+                     self._text(MARGIN, PAGE_HEIGHT - 142, f"日期: {quote['时间']}", 10),
+                     self._text(MARGIN, PAGE_HEIGHT - 159, f"客户: {quote.get('客户') or ''}", 10),
+                     self._cell(PAGE_WIDTH - MARGIN - 60, 60, 30, f"{page_number}/{len(pages)}", 8, True)]
+            y = self.table_top
+            for item in page_items:
+                y -= ROW_HEIGHT
+                text_y = y + ROW_HEIGHT / 2 - 4
+                thumbnail = self.thumbnail(item.get('图片'))
+                if thumbnail is not None:
+                    name = images.setdefault(item['图片'], f"Im{len(images) + 1}")
+                    data, width, height = thumbnail
+                    scale = THUMBNAIL_POINTS / max(width, height)
+                    parts.append(f"q {width * scale:.1f} 0 0 {height * scale:.1f} {PDF_COLUMNS[0][1]} "
+                                 f"{y + 3:.1f} cm /{name} Do Q")
+                values = [None, item['类别'], item['名称'], format_quantity(item),
+                          f"¥{item['单价']:.4f}" if item.get('单价') is not None else '',
+                          f"¥{item['金额']:.2f}"]
+                for (_, left, width, right), value in zip(PDF_COLUMNS, values):
+                    if value is not None:
+                        parts.append(self._cell(left, width, text_y, value, 9, right))
+            if page_number == len(pages):
+                y -= 30
+                parts.append(f"0.6 w {MARGIN} {y + 18} m {PAGE_WIDTH - MARGIN} {y + 18} l S")
+                parts.append(self._cell(325, 220, y, f"成本合计: ¥{quote['成本合计']:.2f}", 10, True))
+                parts.append(self._cell(325, 220, y - 22, f"报价: ¥{quote_total(quote):.2f}", 14, True))
+                if quote.get('备注'):
+                    parts.append(self._text(MARGIN, y - 50, f"备注: {quote['备注']}", 9))
+            page_streams.append('\n'.join(parts).encode('ascii'))
+
+        # 对象号：1 目录，2 页面树，3-5 字体，之后依次为图片、各页及其内容
+        objects = {}
+        next_id = 6
+        image_ids = {}
+        for path, name in images.items():
+            data, width, height = self.thumbnail(path)
+            image_ids[name] = next_id
+            objects[next_id] = (f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode "
+                                f"/Length {len(data)} >>").encode('ascii'), data
+            next_id += 1
+        resources = "<< /Font << /F1 3 0 R >> /XObject << " + \
+            ' '.join(f"/{name} {object_id} 0 R" for name, object_id in image_ids.items()) + " >> >>"
+        page_ids = []
+        for stream in page_streams:
+            page_id, content_id = next_id, next_id + 1
+            next_id += 2
+            page_ids.append(page_id)
+            objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                                f"/Resources {resources} /Contents {content_id} 0 R >>").encode('ascii'), None
+            objects[content_id] = f"<< /Length {len(stream)} >>".encode('ascii'), stream
+        objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>", None
+        objects[2] = (f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] "
+                      f"/Count {len(page_ids)} >>").encode('ascii'), None
+        for offset, font_object in enumerate(self.font_objects):
+            objects[3 + offset] = font_object, None
+
+        output = io.BytesIO()
+        output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            head, stream = objects[object_id]
+            offsets[object_id] = output.tell()
+            output.write(f"{object_id} 0 obj\n".encode('ascii') + head)
+            if stream is not None:
+                output.write(b"\nstream\n" + stream + b"\nendstream")
+            output.write(b"\nendobj\n")
+        xref = output.tell()
+        output.write(f"xref\n0 {next_id}\n0000000000 65535 f \n".encode('ascii'))
+        for object_id in range(1, next_id):
+            output.write(f"{offsets[object_id]:010d} 00000 n \n".encode('ascii'))
+        output.write(f"trailer\n<< /Size {next_id} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('ascii'))
+        with open(out_path, 'wb') as f:
+            f.write(output.getvalue())
+        return out_path
+
+    def render_xlsx(self, quote, out_path):
+        workbook = xlsxwriter.Workbook(out_path, {'strings_to_formulas': False, 'strings_to_urls': False})
+        try:
+            formats = {key: workbook.add_format(spec) for key, spec in self.xlsx_formats.items()}
+            sheet = workbook.add_worksheet('报价单')
+            sheet.set_column(0, 0, 12)
+            sheet.set_column(1, 1, 10)
+            sheet.set_column(2, 2, 28)
+            sheet.set_column(3, 5, 14)
+            sheet.write(0, 0, self.options['标题'], formats['title'])
+            if self.options['公司']:
+                sheet.write(1, 0, self.options['公司'])
+            for row, (label, value) in enumerate([('报价编号', quote['编号']), ('日期', quote['时间']),
+                                                  ('客户', quote.get('客户') or '')], start=3):
+                sheet.write(row, 0, label, formats['label'])
+                sheet.write(row, 1, value)
+            header_row = 7
+            for col, (title, _, _, _) in enumerate(PDF_COLUMNS):
+                sheet.write(header_row, col, title, formats['header'])
+            row = header_row
+            for item in quote['项目']:
+                row += 1
+                sheet.set_row(row, 48)
+                thumbnail = self.thumbnail(item.get('图片'))
+                if thumbnail is not None:
+                    data, width, height = thumbnail
+                    scale = 60 / max(width, height)
+                    sheet.insert_image(row, 0, item['图片'], {
+                        'image_data': io.BytesIO(data), 'x_scale': scale, 'y_scale': scale,
+                        'x_offset': 4, 'y_offset': 2, 'object_position': 1,
+                    })
+                sheet.write(row, 1, item['类别'], formats['text'])
+                sheet.write(row, 2, item['名称'], formats['text'])
+                sheet.write(row, 3, format_quantity(item), formats['text'])
+                if item.get('单价') is not None:
+                    sheet.write_number(row, 4, item['单价'], formats['money'])
+                sheet.write_number(row, 5, item['金额'], formats['money'])
+            row += 2
+            sheet.write(row, 4, '成本合计', formats['label'])
+            sheet.write_number(row, 5, quote['成本合计'], formats['total'])
+            sheet.write(row + 1, 4, '报价', formats['label'])
+            sheet.write_number(row + 1, 5, quote_total(quote), formats['total'])
+            if quote.get('备注'):
+                sheet.write(row + 3, 0, f"备注: {quote['备注']}")
+            sheet.write(row + 5, 0, self.options['页脚'], formats['footer'])
+        finally:
+            workbook.close()
+        return out_path
+
+    def render(self, quote, out_dir, extensions):
+        """生成一份报价单的各种格式，返回文件路径列表"""
+        paths = []
+        for extension in extensions:
+            out_path = os.path.join(out_dir, quote_file_name(quote, extension))
+            if extension == '.pdf':
+                paths.append(self.render_pdf(quote, out_path))
+            elif extension == '.xlsx':
+                paths.append(self.render_xlsx(quote, out_path))
+        return paths
+
+
+# 工作进程中编译好的模板
+_worker_template = None
+
+
+def _init_worker(options):
+    global _worker_template
+    _worker_template = QuoteTemplate(options)
+
+
+def _render_in_worker(quote, out_dir, extensions):
+    try:
+        return quote['编号'], _worker_template.render(quote, out_dir, extensions), ''
+    except Exception as e:
+        return quote['编号'], [], str(e) or type(e).__name__
+
+
+def bundle_files(paths, zip_path):
+    """把生成的文件打包成一个压缩包"""
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            archive.write(path, os.path.basename(path))
+    return zip_path
+
+
+def generate_quote_documents(quotes, out_dir, formats=('PDF', 'Excel'), template_options=None,
+                             max_workers=None, progress=None, pool_threshold=8):
+    """生成报价单并打包，返回 (压缩包路径, 失败列表[(编号, 错误)])。
+    数量较少时在当前进程中生成，较多时使用进程池，每个工作进程只编译一次模板"""
+    os.makedirs(out_dir, exist_ok=True)
+    extensions = [QUOTE_FORMATS[f] for f in formats]
+    paths, failures = [], []
+    if len(quotes) < pool_threshold:
+        template = QuoteTemplate(template_options)
+        for done, quote in enumerate(quotes, start=1):
+            try:
+                paths.extend(template.render(quote, out_dir, extensions))
+            except Exception as e:
+                failures.append((quote['编号'], str(e) or type(e).__name__))
+            if progress:
+                progress(done, len(quotes))
+    else:
+        # spawn 启动的工作进程不继承 Streamlit 服务进程中的线程和锁
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(template_options,)) as pool:
+            futures = [pool.submit(_render_in_worker, quote, out_dir, extensions) for quote in quotes]
+            for done, future in enumerate(as_completed(futures), start=1):
+                number, quote_paths, error = future.result()
+                paths.extend(quote_paths)
+                if error:
+                    failures.append((number, error))
+                if progress:
+                    progress(done, len(quotes))
+    zip_path = os.path.join(out_dir, f"报价单_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+    return bundle_files(sorted(paths), zip_path), failures
+
+
+def build_quote(number, when, material, weight, material_cost, items, customer='', sale_price=None,
+                remark='', material_image=None):
+    """报价单数据。items: [(类别, 名称, 单价, 图片路径)]，配件/包装每项数量为1"""
+    lines = [{
+        '类别': '打印材料', '名称': material, '数量': round(float(weight), 2), '单位': '克',
+        '单价': material_cost / weight if weight else None, '金额': float(material_cost), '图片': material_image,
+    }]
+    for category, name, unit_price, image in items:
+        lines.append({'类别': category, '名称': name, '数量': 1, '单位': '个',
+                      '单价': float(unit_price), '金额': float(unit_price), '图片': image})
+    total = sum(line['金额'] for line in lines)
+    return {
+        '编号': number,
+        '时间': str(when)[:19],
+        '客户': customer,
+        '项目': lines,
+        '成本合计': total,
+        '售价': float(sale_price) if sale_price else None,
+        '备注': remark,
+    }
+
+
+def quote_number(when, sequence):
+    return f"Q{when.strftime('%Y%m%d%H%M%S')}-{sequence:04d}"
+
+
+def quotes_from_history(records, prices, catalog_prices, image_paths, customer='', remark=''):
+    """把历史记录转为报价单数据。
+    records: 历史记录DataFrame；prices: 价格历史（时间, 类别, 名称, 单价）；
+    catalog_prices: (类别, 名称) -> 当前单价，价格历史中没有的项目使用；image_paths: (类别, 名称) -> 图片路径。
+    打印材料金额使用记录中的成本，配件/包装按报价当时的单价列出（所有项目一次查询）"""
+    records = records.to_dict('records')
+    # 展开全部配件/包装项目：(记录序号, 类别, 名称)
+    lines = [(position, category, name) for position, record in enumerate(records)
+             for category in ITEM_TABLES for name in _split_names(record.get(category))]
+    unit_prices = np.full(len(lines), np.nan)
+    for category, table in ITEM_TABLES.items():
+        selected = [i for i, line in enumerate(lines) if line[1] == category]
+        if selected:
+            unit_prices[selected] = lookup_prices(
+                [lines[i][2] for i in selected], [records[lines[i][0]].get('时间') for i in selected],
+                prices[prices['类别'] == table])
+    items = [[] for _ in records]
+    for (position, category, name), unit_price in zip(lines, unit_prices):
+        if np.isnan(unit_price):
+            unit_price = catalog_prices.get((category, name), 0.0)
+        items[position].append((category, name, unit_price, image_paths.get((category, name))))
+
+    quotes = []
+    now = datetime.now()
+    for sequence, record in enumerate(records, start=1):
+        material = record.get('打印材料') or ''
+        sale_price = record.get('售价')
+        quotes.append(build_quote(
+            quote_number(now, sequence), record.get('时间', ''), material, record.get('克重') or 0,
+            record.get('打印材料成本') or 0, items[sequence - 1], customer,
+            sale_price if sale_price == sale_price else None, remark,
+            image_paths.get(('打印材料', material))))
+    return quotes
@@ -0,0 +1,217 @@
+"""
+数据表结构定义模块
+为打印材料/配件/包装表和历史记录定义明确的列类型：
+名称等重复值多的列使用分类编码，历史记录的克重使用float32（金额列保持float64，避免舍入误差累积到汇总中），时间列解析为时间戳，
+历史记录中逗号拼接的配件/包装拆分为单独的关联表（只保存名称编码）
+"""
+
+import numpy as np
+import pandas as pd
+
+# 列类型说明
+# category: 分类编码    text: 普通文本    float32/float64: 浮点数
+# int: 整数（有空值时保留为浮点数）    datetime: 时间戳
+PRINT_MATERIALS_SCHEMA = {
+    '名称': 'category',
+    '品牌': 'category',
+    '质感': 'category',
+    '耗材颜色': 'category',
+    '耗材类型': 'category',
+    '购买价': 'float64',
+    '运费': 'float64',
+    '总克重': 'float64',
+    '购买时间': 'datetime',
+    '每克成本': 'float64',
+    '计价方式': 'category',
+    '图片路径': 'text',
+    '链接': 'text',
+    '备注': 'text',
+}
+
+# 打印材料的采购批次：同一种材料每次购买一行
+MATERIAL_LOTS_SCHEMA = {
+    '材料': 'category',
+    '购买时间': 'datetime',
+    '购买价': 'float64',
+    '运费': 'float64',
+    '克重': 'float64',
+    '备注': 'text',
+}
+
+UNIT_ITEMS_SCHEMA = {
+    '名称': 'category',
+    '规格': 'category',
+    '购买价': 'float64',
+    '运费': 'float64',
+    '总数量': 'int',
+    '购买时间': 'datetime',
+    '每单位成本': 'float64',
+    '图片路径': 'text',
+    '链接': 'text',
+    '备注': 'text',
+}
+
+HISTORY_SCHEMA = {
+    '时间': 'datetime',
+    '克重': 'float32',
+    '打印材料': 'category',
+    '打印材料成本': 'float64',
+    '产品配件': 'items',
+    '配件成本': 'float64',
+    '包装': 'items',
+    '包装成本': 'float64',
+    '总成本': 'float64',
+    '售价': 'float64',
+    '利润': 'float64',
+}
+
+# 历史记录中需要拆分为关联表的列
+HISTORY_ITEM_COLUMNS = ['产品配件', '包装']
+
+
+def memory_usage(df):
+    """DataFrame实际占用的内存字节数（包括字符串对象）"""
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def format_bytes(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _convert_column(series, kind):
+    if kind == 'category':
+        return series.where(series.notna(), None).astype('category')
+    if kind in ('float32', 'float64'):
+        return pd.to_numeric(series, errors='coerce').astype(kind)
+    if kind == 'int':
+        values = pd.to_numeric(series, errors='coerce')
+        return values.astype('int64') if values.notna().all() else values
+    if kind == 'datetime':
+        return pd.to_datetime(series, errors='coerce')
+    return series.astype(object)
+
+
+def apply_schema(df, schema):
+    """按结构定义转换列类型，结构中没有的列保持不变"""
+    df = df.copy()
+    for column, kind in schema.items():
+        if column in df.columns and kind != 'items':
+            df[column] = _convert_column(df[column], kind)
+    return df
+
+
+def prepare_for_save(df):
+    """保存前把分类列还原为普通列"""
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+def set_row_values(df, index, values):
+    """按列名更新一行，分类列会自动加入新的取值"""
+    for column, value in values.items():
+        if column not in df.columns:
+            df[column] = None
+        series = df[column]
+        if value is not None and not pd.isna(value):
+            if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+                df[column] = series.cat.add_categories([value])
+            elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+                value = pd.Timestamp(value)
+        df.at[index, column] = value
+
+
+def _split_joined_names(series):
+    """把逗号拼接的名称列拆分为 (记录编号, 名称) 两个数组
+
+    拼接字符串的组合很少，先只拆分不重复的组合，再按编码展开到每条记录。
+    """
+    joined = series.fillna('').astype(str).astype('category')
+    codes = joined.cat.codes.to_numpy()
+    split = [[name for name in value.split(',') if name] for value in joined.cat.categories]
+    lengths = np.array([len(names) for names in split], dtype=np.int64)
+    flat_names = np.array([name for names in split for name in names], dtype=object)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+    # 每条记录的名称个数，以及每个名称在flat_names中的位置
+    counts = lengths[codes]
+    record_ids = np.repeat(np.arange(len(codes), dtype=np.int32), counts)
+    group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(offsets[codes], counts) + np.arange(counts.sum()) - group_starts
+    return record_ids, flat_names[positions]
+
+
+class TypedHistory:
+    """类型化的历史记录
+
+    records: 每条报价一行，配件/包装不再以拼接字符串保存
+    items:   记录编号 - 类别 - 名称（分类编码）的关联表
+    """
+
+    def __init__(self, records, items):
+        self.records = records
+        self.items = items
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_frame(cls, df):
+        """从原始历史记录表（配件/包装为逗号拼接字符串）转换"""
+        records = apply_schema(df, HISTORY_SCHEMA).reset_index(drop=True)
+        parts = []
+        for column in HISTORY_ITEM_COLUMNS:
+            if column not in records.columns:
+                continue
+            record_ids, names = _split_joined_names(records.pop(column))
+            parts.append(pd.DataFrame({'记录': record_ids, '类别': column, '名称': names}))
+        if parts:
+            items = pd.concat(parts, ignore_index=True)
+        else:
+            items = pd.DataFrame({'记录': np.array([], dtype=np.int32), '类别': [], '名称': []})
+        items['类别'] = pd.Categorical(items['类别'], categories=HISTORY_ITEM_COLUMNS)
+        items['名称'] = items['名称'].astype('category')
+        return cls(records, items)
+
+    def item_names(self, column):
+        """某一列（产品配件/包装）按记录编号拼接的名称，索引为记录编号"""
+        selected = self.items[self.items['类别'] == column]
+        if selected.empty:
+            return pd.Series([], dtype=object)
+        records = selected['记录'].to_numpy()
+        names = selected['名称'].astype(str).to_numpy(dtype=object)
+        order = np.argsort(records, kind='stable')
+        records, names = records[order], names[order]
+        # 每组第一个名称前不加逗号，再按组一次性拼接
+        starts = np.flatnonzero(np.r_[True, records[1:] != records[:-1]])
+        separators = np.full(len(names), ',', dtype=object)
+        separators[starts] = ''
+        joined = np.add.reduceat(separators + names, starts)
+        return pd.Series(joined, index=records[starts], dtype=object)
+
+    def to_frame(self):
+        """还原为配件/包装为逗号拼接字符串的表，用于显示和保存"""
+        df = prepare_for_save(self.records)
+        columns = list(df.columns)
+        for column in HISTORY_ITEM_COLUMNS:
+            df[column] = self.item_names(column).reindex(df.index).fillna('')
+        # 按结构定义的列顺序排列
+        ordered = [c for c in HISTORY_SCHEMA if c in df.columns]
+        ordered += [c for c in columns if c not in ordered]
+        return df[ordered]
+
+    def memory_usage(self):
+        return memory_usage(self.records) + memory_usage(self.items)
+
+
+def memory_report(name, raw_df, typed):
+    """类型化前后的内存占用"""
+    typed_size = typed.memory_usage() if isinstance(typed, TypedHistory) else memory_usage(typed)
+    return {'数据': name, '行数': len(raw_df), '原始': memory_usage(raw_df), '类型化': typed_size}
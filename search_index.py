@@ -0,0 +1,236 @@
+"""
+全文搜索模块
+对打印材料、配件和包装的 名称/品牌/耗材类型/耗材颜色/规格/备注 建立 n-gram 倒排索引：
+文本统一为半角小写后按单字和相邻两字切分（中文、字母、数字混合的名称如 螺丝M3x10 不需要分词），
+每个 n-gram 对应一个按编号递增的数组。查询时取查询词各 n-gram 数组的交集得到候选，
+再逐个确认包含整个查询词并计算相关度（匹配的字段、完全/开头/包含）。
+数据表保存时只比较这张表有变化的名称，删除和修改的条目先标记为无效，无效条目较多时重建索引
+"""
+
+import heapq
+import threading
+import unicodedata
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from metrics import REGISTRY
+
+# 建立索引的数据表和字段（字段权重越大，匹配时排名越靠前）
+SEARCH_TABLES = ('print_materials', 'accessories', 'packaging')
+FIELD_WEIGHTS = {'名称': 8.0, '品牌': 3.0, '耗材类型': 3.0, '耗材颜色': 2.0, '规格': 2.0, '备注': 1.0}
+SEARCH_FIELDS = list(FIELD_WEIGHTS)
+# 完全匹配、开头匹配、包含
+MATCH_BONUS = (3.0, 2.0, 1.0)
+
+# 无效条目超过该数量和比例时重建索引
+COMPACT_MIN_DEAD = 1000
+COMPACT_RATIO = 0.5
+
+SEARCH_SECONDS = REGISTRY.histogram('search_seconds', '全文搜索耗时',
+                                    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+SEARCH_INDEX_UPDATES = REGISTRY.counter('search_index_updates', '全文索引增量更新的条目数', ['op'])
+
+
+def normalize(text):
+    """半角、小写，空值为空字符串"""
+    if text is None or (not isinstance(text, str) and pd.isna(text)):
+        return ''
+    return unicodedata.normalize('NFKC', str(text)).lower().strip()
+
+
+def ngrams(text):
+    """单字和相邻两字，不包含空白"""
+    grams = {ch for ch in text if not ch.isspace()}
+    grams.update(text[i:i + 2] for i in range(len(text) - 1)
+                 if not text[i].isspace() and not text[i + 1].isspace())
+    return grams
+
+
+def query_grams(term):
+    """查询词用到的 n-gram：一个字时为单字，否则为全部相邻两字"""
+    if len(term) == 1:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+
+def table_rows(df):
+    """数据表中每个名称的原始字段值（空值为 None），名称 -> 元组；同名的多行依次接在后面"""
+    if df is None or df.empty or '名称' not in df.columns:
+        return {}
+    columns = []
+    for field in SEARCH_FIELDS:
+        if field in df.columns:
+            column = df[field].astype(object)
+            columns.append(column.where(column.notna(), None).to_numpy())
+        else:
+            columns.append([None] * len(df))
+    rows = {}
+    for values in zip(*columns):
+        if values[0] is None:
+            continue
+        name = str(values[0])
+        rows[name] = rows[name] + values if name in rows else values
+    return rows
+
+
+def document_fields(values):
+    """原始字段值 -> 各字段的搜索文本（同名多行的不同内容用空格连接）"""
+    count = len(SEARCH_FIELDS)
+    fields = [normalize(value) for value in values[:count]]
+    for start in range(count, len(values), count):
+        for i, value in enumerate(values[start:start + count]):
+            text = normalize(value)
+            if text and text != fields[i]:
+                fields[i] = f"{fields[i]} {text}" if fields[i] else text
+    return tuple(fields)
+
+
+class SearchIndex:
+    """进程内共享的全文索引，保存/重新读取数据表时调用 update 增量更新"""
+
+    def __init__(self, tables=SEARCH_TABLES, cache_size=64):
+        self.tables = tuple(tables)
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._rows = {table: {} for table in self.tables}
+        self._cache = {}
+        self._reset()
+
+    def _reset(self):
+        self._postings = {}      # n-gram -> array('I') 条目编号（递增）
+        self._entries = []       # 条目编号 -> (表名, 名称, 字段文本)，已删除的为 None
+        self._current = {}       # (表名, 名称) -> 条目编号
+        self._dead = 0
+
+    @property
+    def size(self):
+        return len(self._current)
+
+    def _add(self, table, name, fields):
+        entry_id = len(self._entries)
+        self._entries.append((table, name, fields))
+        self._current[(table, name)] = entry_id
+        grams = set()
+        for text in fields:
+            grams |= ngrams(text)
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('I')
+            postings.append(entry_id)
+
+    def _remove(self, table, name):
+        entry_id = self._current.pop((table, name), None)
+        if entry_id is not None:
+            self._entries[entry_id] = None
+            self._dead += 1
+
+    def update(self, table, df):
+        """把一张表的当前数据同步到索引，只处理新增、修改和删除的名称；返回变化的名称数"""
+        if table not in self._rows:
+            return 0
+        rows = table_rows(df)
+        with self._lock:
+            previous = self._rows[table]
+            removed = [name for name in previous if name not in rows]
+            changed = [name for name, values in rows.items() if previous.get(name) != values]
+            if not removed and not changed:
+                return 0
+            for name in removed:
+                self._remove(table, name)
+            for name in changed:
+                self._remove(table, name)
+                self._add(table, name, document_fields(rows[name]))
+            self._rows[table] = rows
+            self._cache.clear()
+            if removed:
+                SEARCH_INDEX_UPDATES.inc(len(removed), op='delete')
+            if changed:
+                SEARCH_INDEX_UPDATES.inc(len(changed), op='upsert')
+            if self._dead > COMPACT_MIN_DEAD and self._dead > COMPACT_RATIO * len(self._entries):
+                self._rebuild()
+            return len(removed) + len(changed)
+
+    def _rebuild(self):
+        """去掉无效条目重新编号"""
+        entries = [entry for entry in self._entries if entry is not None]
+        self._reset()
+        for table, name, fields in entries:
+            self._add(table, name, fields)
+
+    def _candidates(self, terms):
+        grams = set()
+        for term in terms:
+            grams |= query_grams(term)
+        postings = []
+        for gram in grams:
+            found = self._postings.get(gram)
+            if found is None:
+                return np.empty(0, dtype=np.uint32)
+            postings.append(found)
+        postings.sort(key=len)
+        # 复制一份，之后追加条目时数组不会被占用
+        candidates = np.array(postings[0], dtype=np.uint32)
+        for found in postings[1:]:
+            candidates = np.intersect1d(candidates, np.frombuffer(found, dtype=np.uint32), assume_unique=True)
+            if not len(candidates):
+                break
+        return candidates
+
+    def search(self, query, tables=None, limit=50):
+        """按相关度排序的结果 [(表名, 名称, 得分)]；查询按空白分成多个词，每个词都要匹配（可以在不同字段）"""
+        terms = [normalize(term) for term in str(query).split()]
+        terms = [term for term in terms if term]
+        if not terms:
+            return []
+        tables = frozenset(tables or self.tables)
+        # 同一查询（如页面重新运行时）在索引变化前直接使用上次的结果
+        key = (tuple(terms), tables, limit)
+        with SEARCH_SECONDS.time(), self._lock:
+            if key in self._cache:
+                return self._cache[key]
+            results = []
+            for entry_id in self._candidates(terms).tolist():
+                entry = self._entries[entry_id]
+                if entry is None or entry[0] not in tables:
+                    continue
+                score = _score(entry[2], terms)
+                if score:
+                    # 得分相同时名称短的在前
+                    results.append((score, -len(entry[1]), entry[1], entry[0]))
+            best = heapq.nlargest(limit, results) if limit else sorted(results, reverse=True)
+            found = [(table, name, score) for score, _, name, table in best]
+            if len(self._cache) >= self.cache_size:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = found
+        return found
+
+    def names(self, table, query, limit=None):
+        """某张表中匹配的名称（按相关度排序）"""
+        return [name for _, name, _ in self.search(query, [table], limit)]
+
+
+def _score(fields, terms):
+    """每个查询词取最好的匹配字段：字段权重 × 完全/开头/包含；有查询词不匹配时为0"""
+    total = 0.0
+    for term in terms:
+        best = 0.0
+        for weight, text in zip(FIELD_WEIGHTS.values(), fields):
+            position = text.find(term)
+            if position < 0:
+                continue
+            bonus = MATCH_BONUS[0] if text == term else MATCH_BONUS[1] if position == 0 else MATCH_BONUS[2]
+            best = max(best, weight * bonus)
+        if not best:
+            return 0.0
+        total += best
+    return total
+
+
+def filter_frame(df, names):
+    """按搜索结果的顺序取数据表中的行"""
+    order = {name: i for i, name in enumerate(names)}
+    ranks = df['名称'].astype(object).map(order)
+    return df[ranks.notna()].iloc[np.argsort(ranks.dropna().to_numpy(), kind='stable')]
@@ -6,6 +6,7 @@
 
 import os
 import sys
+import traceback
 import pandas as pd
 from datetime import datetime
 
@@ -33,20 +34,25 @@ def test_sample_data_creation():
     """测试示例数据创建"""
     print("🔍 测试示例数据创建...")
     try:
+        import tempfile
         # 导入示例数据创建函数
         from create_sample_data import create_sample_data
-        create_sample_data()
-        
-        # 验证文件是否存在
-        files = ["print_materials.xlsx", "accessories.xlsx", "packaging.xlsx"]
-        for file in files:
-            file_path = os.path.join("data", file)
-            if os.path.exists(file_path):
-                df = pd.read_excel(file_path)
-                print(f"✅ {file} 创建成功，包含 {len(df)} 条记录")
-            else:
-                print(f"❌ {file} 创建失败")
-                return False
+
+        # 在临时目录中创建，不改动仓库中的 data/
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = os.path.join(tmp_dir, "data")
+            create_sample_data(data_dir)
+
+            # 验证文件是否存在
+            files = ["print_materials.xlsx", "accessories.xlsx", "packaging.xlsx"]
+            for file in files:
+                file_path = os.path.join(data_dir, file)
+                if os.path.exists(file_path):
+                    df = pd.read_excel(file_path)
+                    print(f"✅ {file} 创建成功，包含 {len(df)} 条记录")
+                else:
+                    print(f"❌ {file} 创建失败")
+                    return False
         return True
     except Exception as e:
         print(f"❌ 示例数据创建失败: {e}")
@@ -77,6 +83,1371 @@ def test_calculations():
         print(f"❌ 计算功能测试失败: {e}")
         return False
 
+def _cube_triangles(size=10.0):
+    """生成边长为size的立方体三角形（外法线方向）"""
+    import numpy as np
+    v = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                  [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]], dtype=float) * size
+    faces = [(0, 2, 1), (0, 3, 2), (4, 5, 6), (4, 6, 7), (0, 1, 5), (0, 5, 4),
+             (1, 2, 6), (1, 6, 5), (2, 3, 7), (2, 7, 6), (3, 0, 4), (3, 4, 7)]
+    return np.array([[v[a], v[b], v[c]] for a, b, c in faces])
+
+def test_stl_weight_estimation():
+    """测试STL体积与克重估算"""
+    print("🔍 测试STL克重估算...")
+    import struct
+    import tempfile
+    import numpy as np
+    from model_weight import estimate_stl_weight, read_stl_triangles, mesh_volume, volume_to_weight
+
+    triangles = _cube_triangles(10.0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 二进制STL
+        binary_path = os.path.join(tmp_dir, "cube_binary.stl")
+        with open(binary_path, "wb") as f:
+            f.write(b"\0" * 80 + struct.pack("<I", len(triangles)))
+            for tri in triangles:
+                f.write(struct.pack("<12fH", 0, 0, 0, *tri.ravel(), 0))
+        # ASCII STL
+        ascii_path = os.path.join(tmp_dir, "cube_ascii.stl")
+        with open(ascii_path, "w") as f:
+            f.write("solid cube\n")
+            for tri in triangles:
+                f.write("facet normal 0 0 0\nouter loop\n")
+                for x, y, z in tri:
+                    f.write(f"vertex {x} {y} {z}\n")
+                f.write("endloop\nendfacet\n")
+            f.write("endsolid cube\n")
+
+        for path in (binary_path, ascii_path):
+            assert abs(mesh_volume(read_stl_triangles(path)) - 1000.0) < 1e-6
+        with open(binary_path, "rb") as f:
+            assert abs(mesh_volume(read_stl_triangles(f.read())) - 1000.0) < 1e-6
+
+        # 1cm³ 实心PLA约1.24克
+        result = estimate_stl_weight(binary_path, density=1.24, infill=1.0, shell_ratio=0.0)
+        assert result['三角形数量'] == 12
+        assert abs(result['克重'] - 1.24) < 1e-6
+    assert abs(volume_to_weight(1000.0, 1.0, infill=0.0, shell_ratio=0.5) - 0.5) < 1e-9
+    print("✅ STL克重估算正确")
+
+def _write_binary_stl(path, triangles):
+    """写入二进制STL文件"""
+    import struct
+    with open(path, "wb") as f:
+        f.write(b"\0" * 80 + struct.pack("<I", len(triangles)))
+        for tri in triangles:
+            f.write(struct.pack("<12fH", 0, 0, 0, *tri.ravel(), 0))
+
+def _slow_weigh_file(source_dir, relative_path, *params):
+    """批量报价测试中代替克重计算的慢速任务"""
+    import time
+    time.sleep(2)
+    return {'文件': relative_path, '克重': 1.0, '克重来源': '测试', '体积': None, '错误': ''}
+
+def _crashing_weigh_file(source_dir, relative_path, *params):
+    """批量报价测试中使工作进程异常退出的任务"""
+    os._exit(1)
+
+def test_batch_quote():
+    """测试批量报价任务"""
+    print("🔍 测试批量报价...")
+    import tempfile
+    import time
+    import batch_quote
+    from batch_quote import BatchQuoteJob, RESULTS_FILE, STATUS_CANCELLED, STATUS_DONE, STATUS_FAILED
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        models_dir = os.path.join(tmp_dir, "models")
+        os.makedirs(os.path.join(models_dir, "sub"))
+        _write_binary_stl(os.path.join(models_dir, "a.stl"), _cube_triangles(10.0))
+        _write_binary_stl(os.path.join(models_dir, "sub", "b.stl"), _cube_triangles(20.0))
+        with open(os.path.join(models_dir, "c.gcode"), "w") as f:
+            f.write("G28\n; filament used [g] = 12.5\n")
+        with open(os.path.join(models_dir, "broken.gcode"), "w") as f:
+            f.write("G28\n")
+
+        job = BatchQuoteJob.create(os.path.join(tmp_dir, "jobs"), "测试订单", models_dir,
+                                   "PLA", ["螺丝"], ["纸箱"], 1.0, 1.0, 0.0)
+        assert job.total == 4
+        job.run(max_workers=2)
+        assert job.status == STATUS_DONE and job.done == 4
+
+        # 删除一条结果后继续任务，只重新处理缺失的文件
+        results_path = os.path.join(job.job_dir, RESULTS_FILE)
+        with open(results_path, encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(results_path, "w", encoding="utf-8") as f:
+            f.writelines(lines[:-1])
+        resumed = BatchQuoteJob(job.job_dir)
+        assert resumed.done == 3
+        resumed.run(max_workers=1)
+        assert resumed.done == 4
+
+        materials = pd.DataFrame([{'名称': 'PLA', '每克成本': 0.1}])
+        accessories = pd.DataFrame([{'名称': '螺丝', '每单位成本': 0.5}])
+        packaging = pd.DataFrame([{'名称': '纸箱', '每单位成本': 2.0}])
+        quote_path = resumed.build_quote(materials, accessories, packaging)
+        detail = pd.read_excel(quote_path, sheet_name='报价明细').set_index('文件')
+        assert abs(detail.loc['a.stl', '克重'] - 1.0) < 1e-6
+        assert abs(detail.loc[os.path.join('sub', 'b.stl'), '克重'] - 8.0) < 1e-6
+        assert abs(detail.loc['c.gcode', '单件成本'] - 1.75) < 1e-6
+        summary = pd.read_excel(quote_path, sheet_name='汇总').set_index('项目')['数值']
+        assert int(summary['失败文件数']) == 1
+        assert abs(float(summary['总成本']) - (2.15 + 1.5 + 2.0)) < 1e-6
+
+        # 同一秒内创建的任务使用不同的目录
+        other = BatchQuoteJob.create(os.path.join(tmp_dir, "jobs"), "测试订单", models_dir,
+                                     "PLA", [], [], 1.0, 1.0, 0.0)
+        assert other.job_dir != job.job_dir
+
+        original = batch_quote._weigh_file
+        try:
+            # 取消时不等待正在处理的文件，尚未开始的文件不再处理
+            batch_quote._weigh_file = _slow_weigh_file
+            other.start(max_workers=1)
+            time.sleep(0.5)
+            start = time.perf_counter()
+            other.cancel()
+            other._thread.join(timeout=10)
+            assert time.perf_counter() - start < 1.5
+            assert other.status == STATUS_CANCELLED and other.done == 0
+            # 记录为已取消时，正在处理文件的工作进程已经结束
+            import multiprocessing
+            assert multiprocessing.active_children() == []
+
+            # 工作进程异常退出时任务记录为失败，而不是显示为中断
+            batch_quote._weigh_file = _crashing_weigh_file
+            failed = BatchQuoteJob(other.job_dir)
+            assert not failed.run(max_workers=1)
+            assert failed.status == STATUS_FAILED and failed.config['错误']
+            assert BatchQuoteJob(other.job_dir).status == STATUS_FAILED
+        finally:
+            batch_quote._weigh_file = original
+    print("✅ 批量报价正确")
+
+def test_history_rollups():
+    """测试历史记录汇总表的增量更新"""
+    print("🔍 测试历史汇总...")
+    import tempfile
+    from history_store import (save_history_record, load_rollups, rebuild_rollups,
+                               rollup_frames, average_margin, clear_history_records, rollups_path)
+
+    records = [
+        {'时间': '2024-01-01 10:00:00', '克重': 10.0, '打印材料': 'PLA', '打印材料成本': 1.0,
+         '产品配件': '螺丝,轴承', '配件成本': 1.5, '包装': '纸箱', '包装成本': 2.0, '总成本': 4.5,
+         '售价': 9.0, '利润': 4.5},
+        {'时间': '2024-01-01 11:00:00', '克重': 20.0, '打印材料': 'ABS', '打印材料成本': 3.0,
+         '产品配件': '螺丝', '配件成本': 0.5, '包装': '', '包装成本': 0.0, '总成本': 3.5,
+         '售价': None, '利润': None},
+        {'时间': '2024-01-02 09:00:00', '克重': 5.0, '打印材料': 'PLA', '打印材料成本': 0.5,
+         '产品配件': '', '配件成本': 0.0, '包装': '纸箱', '包装成本': 2.0, '总成本': 2.5,
+         '售价': 5.0, '利润': 2.5},
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        history_file = os.path.join(tmp_dir, "history_costs.xlsx")
+        for record in records:
+            save_history_record(record, history_file)
+        rollups = load_rollups(history_file)
+        assert rollups['记录数'] == 3
+        assert rollups['按日']['2024-01-01']['报价数'] == 2
+        assert abs(rollups['按材料']['PLA']['克重'] - 15.0) < 1e-9
+        assert rollups['配件']['螺丝'] == 2 and rollups['包装']['纸箱'] == 2
+        assert abs(average_margin(rollups) - 7.0 / 14.0) < 1e-9
+
+        # 增量结果与全量重建一致
+        os.remove(rollups_path(history_file))
+        assert rebuild_rollups(history_file) == rollups
+        frames = rollup_frames(rollups)
+        assert list(frames['按材料'].index) == ['PLA', 'ABS']
+        assert abs(frames['按日']['总成本'].sum() - 10.5) < 1e-9
+
+        clear_history_records(history_file)
+        assert load_rollups(history_file)['记录数'] == 0
+    print("✅ 历史汇总正确")
+
+def test_typed_schema():
+    """测试类型化数据结构"""
+    print("🔍 测试类型化数据结构...")
+    from schema import TypedHistory, UNIT_ITEMS_SCHEMA, apply_schema, set_row_values, memory_usage
+
+    raw = pd.DataFrame({
+        '时间': ['2024-01-01 10:00:00', '2024-01-02 11:30:00'] * 500,
+        '克重': [10.5, 20.0] * 500,
+        '打印材料': ['PLA白色耗材', 'ABS黑色耗材'] * 500,
+        '打印材料成本': [1.04, 2.7] * 500,
+        '产品配件': ['螺丝M3x10,轴承608', ''] * 500,
+        '配件成本': [2.5, 0.0] * 500,
+        '包装': ['纸箱小号', '气泡袋,胶带'] * 500,
+        '包装成本': [3.0, 1.5] * 500,
+        '总成本': [6.54, 4.2] * 500,
+    })
+    history = TypedHistory.from_frame(raw)
+    assert str(history.records['打印材料'].dtype) == 'category'
+    assert str(history.records['克重'].dtype) == 'float32'
+    # 金额列保持float64，读写后数值不变
+    assert str(history.records['总成本'].dtype) == 'float64'
+    assert history.to_frame()['总成本'].tolist()[:2] == [6.54, 4.2]
+    assert '产品配件' not in history.records.columns
+    assert len(history.items) == 2500
+    assert history.memory_usage() < memory_usage(raw) / 2
+
+    restored = history.to_frame()
+    assert restored['产品配件'].tolist() == raw['产品配件'].tolist()
+    assert restored['包装'].tolist() == raw['包装'].tolist()
+    assert (restored['时间'] == pd.to_datetime(raw['时间'])).all()
+
+    catalog = apply_schema(pd.DataFrame([{'名称': '纸箱', '规格': '小号', '总数量': 10,
+                                          '购买时间': '2024-01-01'}]), UNIT_ITEMS_SCHEMA)
+    set_row_values(catalog, 0, {'名称': '纸箱大号', '购买时间': datetime(2024, 2, 1).date()})
+    assert catalog.loc[0, '名称'] == '纸箱大号'
+    assert catalog.loc[0, '购买时间'] == pd.Timestamp('2024-02-01')
+    print("✅ 类型化数据结构正确")
+
+def test_catalog_store():
+    """测试进程共享的数据目录"""
+    print("🔍 测试共享数据目录...")
+    import tempfile
+    from catalog_store import CatalogStore
+    from schema import UNIT_ITEMS_SCHEMA
+    from history_store import save_history_record
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        packaging_file = os.path.join(tmp_dir, "packaging.xlsx")
+        history_file = os.path.join(tmp_dir, "history_costs.xlsx")
+        pd.DataFrame([{'名称': '纸箱', '每单位成本': 1.0}]).to_excel(packaging_file, index=False)
+        store = CatalogStore({'packaging': (packaging_file, UNIT_ITEMS_SCHEMA)}, history_file)
+
+        old_snapshot = store.snapshot
+        assert old_snapshot.version == 1
+        # 多个会话拿到的是同一份数据
+        assert store.get('packaging') is store.snapshot.get('packaging')
+
+        df = store.get('packaging').copy()
+        df.loc[len(df)] = ['气泡袋', 0.5]
+        assert store.save('packaging', df) == 2
+        assert len(old_snapshot.get('packaging')) == 1
+        assert len(store.get('packaging')) == 2
+        assert len(pd.read_excel(packaging_file)) == 2
+        assert sorted(os.listdir(tmp_dir)) == ['packaging.xlsx']
+
+        pd.DataFrame([{'名称': '胶带', '每单位成本': 0.2}]).to_excel(packaging_file, index=False)
+        assert store.reload('packaging') == 3
+        assert store.get('packaging')['名称'].tolist() == ['胶带']
+
+        save_history_record({'时间': '2024-01-01 10:00:00', '总成本': 1.0}, history_file)
+        assert len(store.history()) == 1
+        assert store.history() is store.history()
+        save_history_record({'时间': '2024-01-02 10:00:00', '总成本': 2.0}, history_file)
+        store.invalidate_history()
+        assert len(store.history()) == 2
+
+        # 使用后台写入队列时，快照立即更新，文件在后台写入
+        from write_queue import WriteBehindQueue
+        queue = WriteBehindQueue(coalesce_delay=0.05)
+        queued_store = CatalogStore({'packaging': (packaging_file, UNIT_ITEMS_SCHEMA)}, history_file, queue)
+        df = queued_store.get('packaging').copy()
+        df.loc[len(df)] = ['纸箱', 1.0]
+        queued_store.save('packaging', df)
+        queued_store.append_history({'时间': '2024-01-03 10:00:00', '总成本': 3.0})
+        assert len(queued_store.get('packaging')) == 2
+        assert queue.flush(timeout=10)
+        assert len(pd.read_excel(packaging_file)) == 2
+        assert len(queued_store.history()) == 3
+        queued_store.clear_history()
+        assert len(queued_store.history()) == 0
+        queue.close()
+    print("✅ 共享数据目录正确")
+
+def test_migrations():
+    """测试数据结构迁移"""
+    print("🔍 测试数据结构迁移...")
+    import tempfile
+    from migrations import run_migrations, read_schema_version, latest_version
+    from schema import UNIT_ITEMS_SCHEMA
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, "images", "packaging"))
+        with open(os.path.join(tmp_dir, "images", "packaging", "纸箱.png"), "wb") as f:
+            f.write(b"png")
+        # 旧版数据：缺少规格/链接/备注列，列顺序不同
+        pd.DataFrame([
+            {'名称': '纸箱', '每单位成本': 1.0, '购买价': 10.0, '运费': 0.0, '总数量': 10,
+             '购买时间': '2024-01-01', '图片路径': ''},
+            {'名称': '胶带', '每单位成本': 0.5, '购买价': 5.0, '运费': 0.0, '总数量': 10,
+             '购买时间': '2024-01-01', '图片路径': '胶带自定义.jpg'},
+        ]).to_excel(os.path.join(tmp_dir, "packaging.xlsx"), index=False)
+
+        applied = run_migrations(tmp_dir)
+        assert [version for version, _ in applied] == list(range(1, latest_version() + 1))
+        assert read_schema_version(tmp_dir) == latest_version()
+        df = pd.read_excel(os.path.join(tmp_dir, "packaging.xlsx"))
+        assert list(df.columns) == list(UNIT_ITEMS_SCHEMA)
+        assert df['图片路径'].tolist() == ['纸箱.png', '胶带自定义.jpg']
+        # 已是最新版本时不再执行
+        assert run_migrations(tmp_dir) == []
+
+    # 仓库中的示例数据已是最新版本：新克隆的仓库启动时不执行迁移，文件不变；
+    # 即使重新执行全部迁移，已迁移的数据也不变
+    import hashlib
+    import shutil
+    from migrations import reset_schema_version
+
+    def file_hashes(data_dir):
+        hashes = {}
+        for root, _, files in os.walk(data_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    hashes[os.path.relpath(path, data_dir)] = hashlib.sha256(f.read()).hexdigest()
+        return hashes
+
+    repo_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = os.path.join(tmp_dir, "data")
+        shutil.copytree(repo_data, data_dir, ignore=shutil.ignore_patterns(
+            'journal', 'exports', 'quotes', 'batch_jobs', 'history_*', '*_balances.json'))
+        assert read_schema_version(data_dir) == latest_version()
+        before = file_hashes(data_dir)
+        assert run_migrations(data_dir) == []
+        assert file_hashes(data_dir) == before
+        for _ in range(2):
+            reset_schema_version(data_dir)
+            assert len(run_migrations(data_dir)) == latest_version()
+            assert file_hashes(data_dir) == before
+    print("✅ 数据结构迁移正确")
+
+def test_write_behind_queue():
+    """测试后台写入队列"""
+    print("🔍 测试后台写入队列...")
+    import time
+    from write_queue import WriteBehindQueue
+
+    written = []
+    failures = {'count': 0}
+
+    def write_table(payload):
+        written.append(('table', payload))
+
+    def write_log(records):
+        written.append(('log', records))
+
+    def flaky_write(payload):
+        failures['count'] += 1
+        if failures['count'] == 1:
+            raise IOError("磁盘忙")
+        written.append(('flaky', payload))
+
+    queue = WriteBehindQueue(coalesce_delay=0.05)
+    for i in range(10):
+        queue.submit('table', write_table, i)
+    for i in range(5):
+        queue.submit_append('log', write_log, i)
+    assert queue.flush(timeout=10)
+    # 连续修改合并为一次写入，追加记录合并为一次追加，按提交顺序写入
+    assert written == [('table', 9), ('log', [0, 1, 2, 3, 4])]
+    assert queue.coalesced_count == 13
+
+    queue.submit('flaky', flaky_write, 'x')
+    assert queue.flush(timeout=10)
+    assert written[-1] == ('flaky', 'x') and queue.error_count == 1
+
+    # 一直写入失败的数据不会丢弃：flush 报告未写入，其他键照常写入，恢复后写入最新的数据
+    broken = {'down': True}
+
+    def broken_write(payload):
+        if broken['down']:
+            raise IOError("磁盘已满")
+        written.append(('broken', payload))
+
+    queue.submit('broken', broken_write, 'v1')
+    queue.submit('table', write_table, 'other')
+    deadline = time.monotonic() + 10
+    while written[-1] != ('table', 'other') and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert written[-1] == ('table', 'other')
+    assert not queue.flush(timeout=10)
+    assert 'broken' in queue.failures() and queue.unwritten() == ['broken']
+    queue.submit('broken', broken_write, 'v2')
+    broken['down'] = False
+    deadline = time.monotonic() + 10
+    while queue.depth and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert queue.flush(timeout=10) and written[-1] == ('broken', 'v2') and not queue.failures()
+
+    # 关闭时写完剩余数据，关闭后的提交直接同步写入
+    queue.submit('table', write_table, 'last')
+    queue.close()
+    assert written[-1] == ('table', 'last') and queue.depth == 0
+    queue.submit('table', write_table, 'after-close')
+    assert written[-1] == ('table', 'after-close')
+    assert queue.stats()['写入次数'] == 6
+    print("✅ 后台写入队列正确")
+
+def test_streaming_export():
+    """测试流式导出"""
+    print("🔍 测试流式导出...")
+    import tempfile
+    from exports import export_file, export_frame
+    from history_store import save_history_records
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        history_file = os.path.join(tmp_dir, "history_costs.xlsx")
+        save_history_records([
+            {'时间': '2024-01-01 10:00:00', '打印材料': 'PLA', '产品配件': '螺丝', '总成本': 1.0},
+            {'时间': '2024-01-15 10:00:00', '打印材料': 'ABS', '产品配件': '', '总成本': 2.0},
+            {'时间': '2024-02-01 10:00:00', '打印材料': 'PLA', '产品配件': '=1+1', '总成本': 3.0},
+        ], history_file)
+
+        csv_path = os.path.join(tmp_dir, "history.csv")
+        count = export_file(history_file, csv_path, date_column='时间',
+                            start=datetime(2024, 1, 1).date(), end=datetime(2024, 1, 31).date())
+        assert count == 2
+        assert pd.read_csv(csv_path, encoding='utf-8-sig')['总成本'].tolist() == [1.0, 2.0]
+
+        xlsx_path = os.path.join(tmp_dir, "history.xlsx")
+        count = export_file(history_file, xlsx_path, value_filters={'打印材料': ['PLA']})
+        exported = pd.read_excel(xlsx_path)
+        assert count == 2 and exported['总成本'].tolist() == [1.0, 3.0]
+        assert exported['产品配件'].tolist() == ['螺丝', '=1+1']
+        assert pd.api.types.is_datetime64_any_dtype(exported['时间'])
+
+        catalog = pd.DataFrame({'名称': ['纸箱', '胶带'], '每单位成本': [1.0, None]})
+        catalog_path = os.path.join(tmp_dir, "packaging.xlsx")
+        assert export_frame(catalog, catalog_path) == 2
+        assert pd.read_excel(catalog_path)['名称'].tolist() == ['纸箱', '胶带']
+        assert export_file(os.path.join(tmp_dir, "missing.xlsx"), csv_path) == 0
+    print("✅ 流式导出正确")
+
+def test_change_journal():
+    """测试变更日志、撤销、时间点恢复和合并"""
+    print("🔍 测试变更日志...")
+    import tempfile
+    import time
+    from catalog_store import CatalogStore
+    from journal import ChangeJournal
+    from schema import UNIT_ITEMS_SCHEMA
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        packaging_file = os.path.join(tmp_dir, "packaging.xlsx")
+        image_path = os.path.join(tmp_dir, "纸箱.jpg")
+        with open(image_path, 'wb') as f:
+            f.write(b'image')
+        pd.DataFrame([{'名称': '纸箱', '总数量': 10, '每单位成本': 1.0, '图片路径': '纸箱.jpg'}]).to_excel(packaging_file, index=False)
+        journal = ChangeJournal(os.path.join(tmp_dir, "journal"))
+        store = CatalogStore({'packaging': (packaging_file, UNIT_ITEMS_SCHEMA)}, journal=journal)
+
+        store.insert_row('packaging', {'名称': '胶带', '总数量': 5, '每单位成本': 0.2,
+                                       '购买时间': datetime(2024, 1, 1).date()})
+        time.sleep(0.01)
+        checkpoint = datetime.now()
+        time.sleep(0.01)
+        store.update_row('packaging', 0, {'名称': '纸箱', '每单位成本': 1.5})
+        store.delete_row('packaging', 0, image=journal.stash_image(image_path))
+        assert not os.path.exists(image_path)
+        assert store.get('packaging')['名称'].tolist() == ['胶带']
+
+        # 修改只记录变化的字段
+        update = journal.entries('packaging')[1]
+        assert update['before'] == {'每单位成本': 1.0} and update['after'] == {'每单位成本': 1.5}
+
+        # 撤销删除：数据和图片都恢复
+        assert store.undo('packaging', 1) == 1
+        assert store.get('packaging')['名称'].tolist() == ['纸箱', '胶带']
+        assert os.path.exists(image_path)
+        assert store.undo('packaging', 1) == 1
+        assert store.get('packaging')['每单位成本'].tolist() == [1.0, 0.2]
+
+        # 恢复到时间点
+        store.restore('packaging', checkpoint)
+        assert store.get('packaging')['每单位成本'].tolist() == [1.0, 0.2]
+        try:
+            store.restore('packaging', datetime(2000, 1, 1))
+            assert False, "早于基准快照时应报错"
+        except ValueError:
+            pass
+
+        # 合并后当前数据不变，日志变短
+        current = journal.replay('packaging')
+        # 添加、修改、删除、两次撤销、一次恢复
+        assert journal.compact('packaging', before=datetime.now()) == 6
+        assert journal.entries('packaging') == []
+        assert journal.replay('packaging') == current
+        assert os.listdir(journal.trash_dir) == []
+        store.insert_row('packaging', {'名称': '气泡袋', '总数量': 1, '每单位成本': 0.5})
+        assert journal.entries('packaging')[-1]['seq'] == 7
+
+        # 恢复到时间点时，之后修改中被替换的图片也放回原位置
+        with open(image_path, 'wb') as f:
+            f.write(b'old')
+        checkpoint = datetime.now()
+        time.sleep(0.01)
+        replaced = journal.stash_image(image_path, move=False)
+        with open(image_path, 'wb') as f:
+            f.write(b'new')
+        store.update_row('packaging', store.get('packaging').index[0], {'每单位成本': 0.3}, image=replaced)
+        store.restore('packaging', checkpoint)
+        with open(image_path, 'rb') as f:
+            assert f.read() == b'old'
+
+        # 日志超过条数但都在保留期内时不合并，也不重新读取日志
+        small = ChangeJournal(os.path.join(tmp_dir, "small"), compact_threshold=2)
+        reads = []
+        original_entries = small.entries
+        small.entries = lambda table: reads.append(table) or original_entries(table)
+        frame = pd.DataFrame([{'名称': '纸箱'}])
+        for i in range(5):
+            small.record('packaging', frame, {'op': 'update', 'position': 0, 'before': {}, 'after': {'备注': str(i)}})
+        assert len(reads) == 1 and len(original_entries('packaging')) == 5
+        # 页面显示的条数和最近记录来自内存中的摘要，也不读取日志
+        count, recent = small.summary('packaging')
+        assert count == 5 and recent == original_entries('packaging') and len(reads) == 1
+        assert small.compact('packaging', before=datetime.now()) == 5
+        assert small.summary('packaging') == (0, [])
+    print("✅ 变更日志正确")
+
+def test_incremental_backup():
+    """测试增量备份、去重、保留策略和恢复"""
+    print("🔍 测试增量备份...")
+    import tempfile
+    from backup import create_backup, list_backups, verify_backup, restore_backup, prune_backups, select_retained
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = os.path.join(tmp_dir, "data")
+        backup_dir = os.path.join(tmp_dir, "backups")
+        os.makedirs(os.path.join(data_dir, "images"))
+        for name in ["a.jpg", "b.jpg"]:
+            with open(os.path.join(data_dir, "images", name), 'wb') as f:
+                f.write(b'same image')
+        with open(os.path.join(data_dir, "packaging.xlsx"), 'wb') as f:
+            f.write(b'v1')
+        # 可以重新生成的目录不备份
+        for skipped in ["exports/out.csv", "batch_jobs/job/results.jsonl", "quotes/20240101/Q001.pdf"]:
+            os.makedirs(os.path.join(data_dir, os.path.dirname(skipped)), exist_ok=True)
+            with open(os.path.join(data_dir, skipped), 'wb') as f:
+                f.write(b'skip')
+
+        first = create_backup(data_dir, backup_dir)
+        assert first['文件数'] == 3 and first['新增大小'] == len(b'same image') + len(b'v1')
+
+        # 没有变化的文件不重新读取
+        second = create_backup(data_dir, backup_dir)
+        assert second['读取文件数'] == 0 and second['新增大小'] == 0
+
+        with open(os.path.join(data_dir, "packaging.xlsx"), 'wb') as f:
+            f.write(b'version 2')
+        third = create_backup(data_dir, backup_dir)
+        assert third['读取文件数'] == 1 and third['新增大小'] == len(b'version 2')
+        assert [m['id'] for m in list_backups(backup_dir)] == [first['id'], second['id'], third['id']]
+
+        assert verify_backup(backup_dir, first['id']) == []
+        target = os.path.join(tmp_dir, "restored")
+        assert restore_backup(backup_dir, first['id'], target) == 3
+        with open(os.path.join(target, "packaging.xlsx"), 'rb') as f:
+            assert f.read() == b'v1'
+        assert sorted(os.listdir(target)) == ["images", "packaging.xlsx"]
+        try:
+            restore_backup(backup_dir, first['id'], target)
+            assert False, "目标目录不为空时应报错"
+        except ValueError:
+            pass
+
+        # 保留策略：同一天只保留最后一次
+        assert select_retained(list_backups(backup_dir), keep_daily=1) == {third['id']}
+        import backup
+        recent_seconds, backup.RECENT_BLOB_SECONDS = backup.RECENT_BLOB_SECONDS, 0
+        try:
+            removed, freed = prune_backups(backup_dir, keep_last=1, keep_daily=0, keep_weekly=0, keep_monthly=0)
+        finally:
+            backup.RECENT_BLOB_SECONDS = recent_seconds
+        assert sorted(removed) == sorted([first['id'], second['id']]) and freed == len(b'v1')
+        assert verify_backup(backup_dir, third['id']) == []
+    print("✅ 增量备份正确")
+
+def test_purchase_lots():
+    """测试采购批次的先进先出/加权平均成本"""
+    print("🔍 测试采购批次成本...")
+    from purchase_lots import LotCostTable, material_fields, FIFO, WEIGHTED_AVERAGE
+
+    lots = pd.DataFrame({
+        '材料': ['PLA', 'PLA', 'ABS', 'PLA'],
+        '购买时间': pd.to_datetime(['2024-03-01', '2024-01-01', '2024-01-01', '2024-02-01']),
+        '购买价': [300.0, 90.0, 120.0, 190.0],
+        '运费': [0.0, 10.0, 0.0, 10.0],
+        '克重': [1000.0, 1000.0, 1000.0, 1000.0],
+    })
+    table = LotCostTable(lots)
+    assert table.lot_count('PLA') == 3 and table.total_grams('PLA') == 3000
+    assert abs(table.unit_cost('PLA', WEIGHTED_AVERAGE) - 0.2) < 1e-9
+    # 先进先出按购买时间：0.1、0.2、0.3 元/克
+    assert abs(table.unit_cost('PLA', FIFO) - 0.1) < 1e-9
+    assert abs(table.unit_cost('PLA', FIFO, consumed=1500) - 0.2) < 1e-9
+    assert abs(table.cost('PLA', 1500, FIFO) - 200.0) < 1e-9
+    assert abs(table.cost('PLA', 1000, FIFO, consumed=1500) - 250.0) < 1e-9
+    # 超出所有批次的部分按最后一个批次的价格
+    assert abs(table.cost('PLA', 3500, FIFO) - 750.0) < 1e-9
+    assert abs(table.cost('PLA', 500, WEIGHTED_AVERAGE) - 100.0) < 1e-9
+    assert table.remaining('PLA', consumed=1200) == 1800
+    assert table.cost('PETG', 100) is None and 'PETG' not in table
+    assert abs(table.unit_cost('ABS', FIFO) - 0.12) < 1e-9
+
+    fields = material_fields(lots, table, 'PLA', FIFO)
+    assert fields['购买价'] == 300.0 and fields['购买时间'] == pd.Timestamp('2024-03-01')
+    assert abs(fields['每克成本'] - 0.1) < 1e-9
+    assert LotCostTable(pd.DataFrame()).materials == []
+    print("✅ 采购批次成本正确")
+
+def test_load_test_helpers():
+    """测试压力测试脚本的数据生成和统计"""
+    print("🔍 测试压力测试辅助函数...")
+    import tempfile
+    from load_test import generate_data, summarize
+    from catalog_store import read_catalog
+    from history_store import load_history_records
+    from schema import UNIT_ITEMS_SCHEMA
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generate_data(tmp_dir, materials=3, accessories=7, packaging=2, history=25, seed=1)
+        accessories, _ = read_catalog(os.path.join(tmp_dir, "accessories.xlsx"), UNIT_ITEMS_SCHEMA)
+        assert len(accessories) == 7
+        assert len(load_history_records(os.path.join(tmp_dir, "history_costs.xlsx")).records) == 25
+
+    samples = [('切换页面', 100.0, 0.1, None), ('切换页面', 100.5, 0.3, None),
+               ('计算价格', 101.0, 1.0, '错误')]
+    table, throughput, elapsed = summarize(samples)
+    overall = table.iloc[0]
+    assert overall['操作'] == '全部' and overall['次数'] == 3 and overall['错误'] == 1
+    assert abs(elapsed - 2.0) < 1e-9 and abs(throughput - 1.5) < 1e-9
+    assert abs(table.set_index('操作').loc['切换页面', 'p50(ms)'] - 200.0) < 1e-6
+    print("✅ 压力测试辅助函数正确")
+
+def test_price_history():
+    """测试价格历史记录和按时间重算历史成本"""
+    print("🔍 测试价格历史重算...")
+    import tempfile
+    from datetime import datetime
+    import numpy as np
+    from price_history import PriceHistory, lookup_prices, recost_history
+    from history_store import save_history_records, load_history_records
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prices = PriceHistory(os.path.join(tmp_dir, "price_history.csv"))
+        before = pd.DataFrame({'名称': ['PLA', 'ABS'], '每克成本': [0.1, 0.2]})
+        assert prices.record_changes('print_materials', None, before, datetime(2024, 1, 1)) == 2
+        after = pd.DataFrame({'名称': ['PLA', 'ABS'], '每克成本': [0.15, 0.2]})
+        # 只记录单价变化的名称
+        assert prices.record_changes('print_materials', before, after, datetime(2024, 6, 1)) == 1
+        prices.record_changes('accessories', None, pd.DataFrame({'名称': ['螺丝'], '每单位成本': [1.0]}),
+                              datetime(2024, 1, 1))
+        prices.record_changes('accessories', None, pd.DataFrame({'名称': ['螺丝'], '每单位成本': [2.0]}),
+                              datetime(2024, 6, 1))
+        assert list(prices.series('print_materials', 'PLA')) == [0.1, 0.15]
+
+        table = prices.load()
+        material_prices = table[table['类别'] == 'print_materials']
+        unit = lookup_prices(['PLA', 'PLA', 'PLA', 'PETG'],
+                             pd.to_datetime(['2023-01-01', '2024-03-01', '2024-07-01', '2024-07-01']),
+                             material_prices)
+        assert list(unit[:3]) == [0.1, 0.1, 0.15] and np.isnan(unit[3])
+
+        history_file = os.path.join(tmp_dir, "history_costs.xlsx")
+        save_history_records([
+            {'时间': '2024-03-01 10:00:00', '克重': 100.0, '打印材料': 'PLA', '打印材料成本': 10.0,
+             '产品配件': '螺丝,螺丝', '配件成本': 2.0, '包装': '', '包装成本': 0.0, '总成本': 12.0},
+            {'时间': '2024-07-01 10:00:00', '克重': 100.0, '打印材料': 'ABS', '打印材料成本': 20.0,
+             '产品配件': '螺丝', '配件成本': 2.0, '包装': '', '包装成本': 0.0, '总成本': 22.0},
+        ], history_file)
+        history = load_history_records(history_file)
+
+        then = recost_history(history, table)
+        assert np.allclose(then['总成本'], [12.0, 22.0]) and np.allclose(then['差额'], 0.0)
+        now = recost_history(history, table, as_of=datetime(2025, 1, 1))
+        assert np.allclose(now['打印材料成本'], [15.0, 20.0]) and np.allclose(now['配件成本'], [4.0, 2.0])
+        assert np.allclose(now['差额'], [7.0, 0.0]) and now.attrs['缺少价格'] == 0
+    print("✅ 价格历史重算正确")
+
+def test_inventory_ledger():
+    """测试库存台账和增量维护的结余表"""
+    print("🔍 测试库存台账...")
+    import tempfile
+    from inventory import Inventory, seed_rows
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ledger_file = os.path.join(tmp_dir, "inventory_ledger.csv")
+        inventory = Inventory(ledger_file)
+        lots = pd.DataFrame({'材料': ['PLA', 'PLA'], '购买时间': ['2024-01-01', '2024-02-01'],
+                             '克重': [1000.0, 500.0]})
+        accessories = pd.DataFrame({'名称': ['轴承608'], '总数量': [10], '购买时间': ['2024-01-01']})
+        inventory.record(seed_rows(lots, accessories, None))
+        assert inventory.stock('print_materials', 'PLA') == 1500
+        inventory.consume([('print_materials', 'PLA', 120.0), ('accessories', '轴承608', 1),
+                           ('accessories', '轴承608', 1)])
+        assert inventory.stock('print_materials', 'PLA') == 1380
+        assert inventory.consumed('print_materials', 'PLA') == 120
+        assert inventory.stock('accessories', '轴承608') == 8
+        # 默认预警线为5个
+        assert not inventory.is_low('accessories', '轴承608')
+        inventory.set_threshold('accessories', '轴承608', 9)
+        assert inventory.low_stock('accessories') == [('轴承608', 8.0, 9.0)]
+        inventory.count('accessories', '轴承608', 20)
+        assert inventory.stock('accessories', '轴承608') == 20 and not inventory.is_low('accessories', '轴承608')
+        inventory.rename('print_materials', 'PLA', 'PLA白色')
+        assert inventory.balance('print_materials', 'PLA') is None
+        assert inventory.stock('print_materials', 'PLA白色') == 1380
+
+        # 结余表丢失或被其他进程写入后与台账不一致时，从台账重建
+        expected = inventory.balances('accessories')
+        os.remove(inventory.balances_file)
+        assert Inventory(ledger_file).balances('accessories') == expected
+        other = Inventory(ledger_file)
+        other.receive('accessories', '轴承608', 5)
+        assert inventory.stock('accessories', '轴承608') == 25
+        assert len(inventory.ledger('accessories')) == 6
+    print("✅ 库存台账正确")
+
+def test_file_watcher_reload():
+    """测试数据文件被外部修改时只重新读取这张表，自己写入的文件不重新读取"""
+    print("🔍 测试数据文件监视...")
+    import tempfile
+    import threading
+    import time
+    from catalog_store import CatalogStore, write_catalog
+    from file_watcher import FileWatcher
+    from schema import UNIT_ITEMS_SCHEMA
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        accessories_file = os.path.join(tmp_dir, "accessories.xlsx")
+        packaging_file = os.path.join(tmp_dir, "packaging.xlsx")
+        for path in (accessories_file, packaging_file):
+            write_catalog(pd.DataFrame({'名称': ['螺丝'], '每单位成本': [0.1]}), path)
+        store = CatalogStore({'accessories': (accessories_file, UNIT_ITEMS_SCHEMA),
+                              'packaging': (packaging_file, UNIT_ITEMS_SCHEMA)})
+        version = store.version
+        # 自己保存的文件不重新读取
+        store.save('accessories', pd.DataFrame({'名称': ['螺丝', '轴承'], '每单位成本': [0.1, 1.0]}))
+        assert store.file_changed("accessories.xlsx") == [] and store.version == version + 1
+
+        for use_inotify in (True, False):
+            changed = []
+            event = threading.Event()
+
+            def on_change(file_name):
+                changed.extend(store.file_changed(file_name))
+                event.set()
+
+            watcher = FileWatcher(tmp_dir, ["accessories.xlsx", "packaging.xlsx"], on_change,
+                                  poll_interval=0.1, debounce=0.1, use_inotify=use_inotify).start()
+            try:
+                time.sleep(0.2)
+                packaging = pd.DataFrame({'名称': ['纸箱', f'气泡袋{use_inotify}'], '每单位成本': [2.0, 0.5]})
+                accessories = store.get('accessories')
+                write_catalog(packaging, packaging_file)
+                assert event.wait(5), watcher.mode
+            finally:
+                watcher.stop()
+            assert changed == ['packaging'], changed
+            assert list(store.get('packaging')['名称']) == list(packaging['名称'])
+            # 没有变化的表保持同一个对象
+            assert store.get('accessories') is accessories
+    print("✅ 数据文件监视正确")
+
+def test_metrics_registry():
+    """测试运行指标的记录和Prometheus文本格式输出"""
+    print("🔍 测试运行指标...")
+    import tempfile
+    import urllib.request
+    from metrics import Registry, MetricsExporter
+
+    registry = Registry(prefix='test_')
+    quotes = registry.counter('quotes', '报价次数', ['confirmed'])
+    quotes.inc(confirmed='true')
+    quotes.inc(2, confirmed='false')
+    assert registry.counter('quotes', '报价次数', ['confirmed']) is quotes
+    assert quotes.value(confirmed='false') == 2
+    depth = [3]
+    registry.gauge('queue_depth', '队列深度').set_function(lambda: depth[0])
+    latency = registry.histogram('write_seconds', '写入耗时', ['file'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value, file='a"b.xlsx')
+    with latency.time(file='c.xlsx'):
+        pass
+
+    text = registry.render()
+    assert '# TYPE test_quotes counter' in text
+    assert 'test_quotes_total{confirmed="false"} 2' in text
+    assert 'test_queue_depth 3' in text
+    assert 'test_write_seconds_bucket{file="a\\"b.xlsx",le="0.1"} 1' in text
+    assert 'test_write_seconds_bucket{file="a\\"b.xlsx",le="1"} 2' in text
+    assert 'test_write_seconds_bucket{file="a\\"b.xlsx",le="+Inf"} 3' in text
+    assert 'test_write_seconds_count{file="c.xlsx"} 1' in text
+    try:
+        quotes.inc()
+        assert False, "缺少标签时应报错"
+    except ValueError:
+        pass
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "metrics.prom")
+        exporter = MetricsExporter(registry, port=0, file_path=file_path, interval=60).start()
+        try:
+            depth[0] = 7
+            body = urllib.request.urlopen(exporter.address, timeout=5).read().decode('utf-8')
+            assert 'test_queue_depth 7' in body
+            with open(file_path, encoding='utf-8') as f:
+                assert 'test_quotes_total' in f.read()
+        finally:
+            exporter.stop()
+    print("✅ 运行指标正确")
+
+def test_quote_documents():
+    """测试客户报价单（PDF/xlsx）生成、按价格历史取单价和打包"""
+    print("🔍 测试客户报价单...")
+    import re
+    import tempfile
+    import zipfile
+    from openpyxl import load_workbook
+    from PIL import Image
+    from quote_documents import build_quote, generate_quote_documents, quotes_from_history
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = os.path.join(tmp_dir, "bearing.png")
+        Image.new('RGB', (300, 200), (200, 50, 50)).save(image_path)
+        quote = build_quote('Q1', '2024-03-01 10:00:00', 'PLA白色', 100, 8.0,
+                            [('产品配件', '轴承608', 1.5, image_path), ('包装', '气泡袋', 0.5, None)],
+                            customer='张三', sale_price=30, remark='加急')
+        assert abs(quote['成本合计'] - 10.0) < 1e-9
+        assert abs(quote['项目'][0]['单价'] - 0.08) < 1e-9
+
+        zip_path, failures = generate_quote_documents([quote], os.path.join(tmp_dir, "one"))
+        assert failures == []
+        with zipfile.ZipFile(zip_path) as archive:
+            assert sorted(archive.namelist()) == ['Q1_张三.pdf', 'Q1_张三.xlsx']
+        out_dir = os.path.dirname(zip_path)
+        with open(os.path.join(out_dir, 'Q1_张三.pdf'), 'rb') as f:
+            pdf = f.read()
+        assert pdf.startswith(b'%PDF-1.4') and pdf.rstrip().endswith(b'%%EOF')
+        # 交叉引用表中每个偏移处都是对应的对象
+        xref = int(pdf[pdf.rindex(b'startxref') + 9:].split()[0])
+        offsets = re.findall(rb'(\d{10}) 00000 n', pdf[xref:])
+        for number, offset in enumerate(offsets, start=1):
+            assert pdf[int(offset):].startswith(f"{number} 0 obj".encode('ascii'))
+        assert b'/DCTDecode' in pdf
+        sheet = load_workbook(os.path.join(out_dir, 'Q1_张三.xlsx')).active
+        values = [cell for row in sheet.iter_rows(values_only=True) for cell in row if cell is not None]
+        assert '轴承608' in values and 30 in values and '报价' in values
+        assert len(sheet._images) == 1
+
+        # 历史记录：配件按报价当时的单价，价格历史中没有的使用当前单价
+        records = pd.DataFrame([
+            {'时间': '2024-01-10 09:00:00', '克重': 50.0, '打印材料': 'PLA白色', '打印材料成本': 4.0,
+             '产品配件': '轴承608', '包装': '气泡袋', '售价': None},
+            {'时间': '2024-03-10 09:00:00', '克重': 80.0, '打印材料': 'PLA白色', '打印材料成本': 6.4,
+             '产品配件': '轴承608', '包装': '', '售价': 20.0},
+        ])
+        prices = pd.DataFrame({
+            '时间': pd.to_datetime(['2024-01-01', '2024-03-01']),
+            '类别': ['accessories', 'accessories'],
+            '名称': ['轴承608', '轴承608'],
+            '单价': [1.0, 2.0],
+        })
+        quotes = quotes_from_history(records, prices, {('包装', '气泡袋'): 0.3},
+                                     {('产品配件', '轴承608'): image_path}, customer='李四')
+        assert [q['项目'][1]['单价'] for q in quotes] == [1.0, 2.0]
+        assert quotes[0]['项目'][2]['单价'] == 0.3
+        assert abs(quotes[0]['成本合计'] - 5.3) < 1e-9 and quotes[1]['售价'] == 20.0
+        assert quotes[0]['售价'] is None
+
+        # 进程池生成（每个工作进程编译一次模板）
+        done = []
+        batch = quotes_from_history(pd.concat([records] * 3), prices, {}, {})
+        zip_path, failures = generate_quote_documents(
+            batch, os.path.join(tmp_dir, "batch"), ['PDF'], max_workers=2,
+            progress=lambda n, total: done.append(n), pool_threshold=1)
+        assert failures == [] and done[-1] == 6
+        with zipfile.ZipFile(zip_path) as archive:
+            assert len(archive.namelist()) == 6
+    print("✅ 客户报价单生成正确")
+
+def test_history_partitions():
+    """测试历史记录按月分区、按日期范围只读取重叠分区、压缩和按分区丢弃"""
+    print("🔍 测试历史分区...")
+    import tempfile
+    from datetime import datetime
+    from history_store import (save_history_records, load_history_records, list_partitions, load_rollups,
+                               rebuild_rollups, rollups_path, compact_partitions, drop_partitions,
+                               split_legacy_history, PartitionMaintainer, HISTORY_PARTITIONS_READ)
+
+    def record(when, cost, material='PLA', accessories=''):
+        return {'时间': when, '克重': 10.0, '打印材料': material, '打印材料成本': cost,
+                '产品配件': accessories, '配件成本': 0.0, '包装': '', '包装成本': 0.0, '总成本': cost}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        history_file = os.path.join(tmp_dir, "history_costs.xlsx")
+        save_history_records([record('2024-01-20 10:00:00', 2.0, accessories='螺丝'),
+                              record('2024-01-05 10:00:00', 1.0, material='007'),
+                              record('2024-02-10 10:00:00', 3.0),
+                              record('2024-03-01 10:00:00', 4.0, accessories='螺丝')], history_file)
+        assert list(list_partitions(history_file)) == ['2024-01', '2024-02', '2024-03']
+
+        # 只打开与日期范围重叠的分区
+        reads = HISTORY_PARTITIONS_READ.value()
+        february = load_history_records(history_file, '2024-02-01', datetime(2024, 2, 29).date())
+        assert HISTORY_PARTITIONS_READ.value() - reads == 1
+        assert february.records['总成本'].tolist() == [3.0]
+        assert len(load_history_records(history_file)) == 4
+        assert '007' in load_history_records(history_file, end='2024-01-31').records['打印材料'].tolist()
+
+        # 已结束的月份排序后压缩，当月继续追加写入
+        assert compact_partitions(history_file, datetime(2024, 3, 15)) == ['2024-01', '2024-02']
+        partitions = list_partitions(history_file)
+        assert [os.path.basename(p) for p in partitions['2024-01']] == ['2024-01.csv.gz']
+        assert [os.path.basename(p) for p in partitions['2024-03']] == ['2024-03.csv']
+        january = load_history_records(history_file, '2024-01-01', '2024-01-31')
+        assert january.records['总成本'].tolist() == [1.0, 2.0]
+        assert compact_partitions(history_file, datetime(2024, 3, 15)) == []
+
+        # 补写到已压缩月份的记录先单独保存，下次压缩时合并
+        save_history_records([record('2024-01-10 10:00:00', 5.0)], history_file)
+        assert len(list_partitions(history_file)['2024-01']) == 2
+        assert len(load_history_records(history_file, '2024-01-01', '2024-01-31')) == 3
+        assert compact_partitions(history_file, datetime(2024, 3, 15)) == ['2024-01']
+        january = load_history_records(history_file, '2024-01-01', '2024-01-31')
+        assert january.records['总成本'].tolist() == [1.0, 5.0, 2.0]
+
+        # 按分区丢弃：归档文件，汇总表只减去被丢弃的记录，结果与全量重建一致
+        archive_dir = os.path.join(tmp_dir, "archive")
+        assert drop_partitions(history_file, '2024-02-01', archive_dir) == ['2024-01']
+        assert os.listdir(archive_dir) == ['2024-01.csv.gz']
+        rollups = load_rollups(history_file)
+        assert rollups['记录数'] == 2 and '007' not in rollups['按材料']
+        assert rollups['配件'] == {'螺丝': 1}
+        os.remove(rollups_path(history_file))
+        assert rebuild_rollups(history_file) == rollups
+
+        # 保留最近1个月（当月）
+        maintainer = PartitionMaintainer(history_file, retention_months=1, archive_dir=archive_dir)
+        result = maintainer.run_now(datetime(2024, 3, 20))
+        assert result == {'压缩': [], '丢弃': ['2024-02']} and maintainer.last_error is None
+        assert list(list_partitions(history_file)) == ['2024-03']
+
+        # 旧版的单个Excel文件拆分为分区
+        legacy_file = os.path.join(tmp_dir, "legacy", "history_costs.xlsx")
+        os.makedirs(os.path.dirname(legacy_file))
+        pd.DataFrame([record('2023-12-31 23:00:00', 1.0), record(datetime.now(), 2.0)]).to_excel(
+            legacy_file, index=False)
+        assert split_legacy_history(legacy_file) == 2
+        assert os.path.exists(legacy_file + '.migrated') and not os.path.exists(legacy_file)
+        partitions = list_partitions(legacy_file)
+        assert partitions['2023-12'][0].endswith('.csv.gz')
+        assert len(load_history_records(legacy_file)) == 2
+    print("✅ 历史分区正确")
+
+def test_configuration_optimizer():
+    """测试按约束查找最便宜的材料和包装配置"""
+    print("🔍 测试最便宜配置搜索...")
+    import itertools
+    import random
+    from optimizer import ConfigurationIndex
+
+    rng = random.Random(3)
+    materials = pd.DataFrame([{
+        '名称': f"材料{i}", '耗材类型': rng.choice(['PLA', 'PETG', 'ABS']), '耗材颜色': rng.choice(['白色', '黑色']),
+        '质感': rng.choice(['光滑', '磨砂']), '每克成本': round(rng.uniform(0.05, 0.3), 4),
+    } for i in range(60)] + [{'名称': '无单价', '耗材类型': 'PLA', '每克成本': None}])
+    packaging = pd.DataFrame([{
+        '名称': f"包装{i}", '规格': rng.choice(['纸箱', '气泡袋', '胶带']), '每单位成本': round(rng.uniform(0.1, 3), 2),
+    } for i in range(40)] + [{'名称': '封箱贴', '规格': None, '每单位成本': 0.05}])
+    index = ConfigurationIndex(materials, packaging)
+    assert index.options()['包装类别'] == ['封箱贴', '气泡袋', '纸箱', '胶带']
+
+    results = index.search(120, types=['PLA', 'PETG'], colors=['白色'], packaging_categories=['纸箱', '胶带'],
+                            top_k=8, fixed_cost=1.0)
+    # 与穷举全部组合的结果一致
+    candidates = materials[materials['耗材类型'].isin(['PLA', 'PETG']) & (materials['耗材颜色'] == '白色')]
+    boxes = packaging[packaging['规格'] == '纸箱']['每单位成本']
+    tapes = packaging[packaging['规格'] == '胶带']['每单位成本']
+    expected = sorted(120 * m + b + t + 1.0 for m, b, t in itertools.product(candidates['每克成本'], boxes, tapes))
+    assert len(results) == 8
+    assert all(abs(r['总成本'] - e) < 1e-9 for r, e in zip(results, expected[:8]))
+    best = results[0]
+    assert best['材料'] in set(candidates['名称']) and len(best['包装']) == 2
+    assert abs(best['材料成本'] + best['包装成本'] + 1.0 - best['总成本']) < 1e-9
+
+    # 总成本上限、缺少的类别、没有符合条件的材料
+    capped = index.search(120, packaging_categories=['纸箱'], top_k=50, max_cost=results[0]['总成本'])
+    assert all(r['总成本'] <= results[0]['总成本'] for r in capped)
+    assert index.search(100, packaging_categories=['木箱']) == []
+    assert index.search(100, types=['TPU']) == []
+    assert index.search(100, packaging_categories=['封箱贴'], top_k=1)[0]['包装'] == ['封箱贴']
+
+    cheapest = index.cheapest_by_type(100)
+    pla = materials[materials['耗材类型'] == 'PLA']['每克成本'].min()
+    assert abs(cheapest.set_index('耗材类型').loc['PLA', '材料成本'] - 100 * pla) < 1e-9
+    assert ConfigurationIndex(pd.DataFrame(), None).search(10) == []
+    print("✅ 最便宜配置搜索正确")
+
+def test_what_if_analysis():
+    """测试假设分析：产品线构造、网格和蒙特卡洛的向量化计算"""
+    print("🔍 测试假设分析...")
+    import numpy as np
+    import what_if
+
+    records = pd.DataFrame({
+        '时间': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04']),
+        '打印材料': ['PLA', 'PETG', 'PLA', '已删除'],
+        '克重': [100.0, 200.0, 50.0, 80.0],
+        '打印材料成本': [10.0, 30.0, 5.0, 8.0],
+        '配件成本': [1.0, 0.0, 2.0, 0.0],
+        '包装成本': [1.0, 2.0, 0.0, 1.0],
+        '售价': [30.0, 60.0, None, 20.0],
+    })
+    materials = pd.DataFrame({'名称': ['PLA', 'PETG'], '购买价': [90.0, 150.0], '运费': [10.0, 0.0]})
+    products = what_if.product_line(records, materials)
+    # 没有售价的报价不计入；每克成本按材料表拆分出运费
+    assert len(products) == 3
+    assert np.allclose(products['耗材单价'], [0.09, 0.15, 0.1])
+    assert np.allclose(products['运费单价'], [0.01, 0.0, 0.0])
+    assert abs(what_if.baseline_margin(products) - (110 - 12 - 32 - 9) / 110) < 1e-12
+
+    def naive(price, weight, shipping, items):
+        margins = []
+        for row in products.to_dict('records'):
+            cost = row['克重'] * weight * (row['耗材单价'] * price + row['运费单价'] * shipping) \
+                + row['配件包装成本'] * items
+            margins.append((row['售价'] - cost) / row['售价'])
+        return margins
+
+    factors = what_if.factor_grid(what_if.factor_values(-20, 20, 5), [0.9, 1.1], [1.0, 2.0], [1.0])
+    assert factors.shape == (20, 4)
+    chunk_elements = what_if.CHUNK_ELEMENTS
+    try:
+        # 分块计算与一次计算结果相同
+        what_if.CHUNK_ELEMENTS = 7
+        chunked = what_if.evaluate_grid(products, factors, target_margin=0.5)
+    finally:
+        what_if.CHUNK_ELEMENTS = chunk_elements
+    result = what_if.evaluate_grid(products, factors, target_margin=0.5)
+    assert np.allclose(chunked['利润率'], result['利润率'])
+    assert (chunked['低于目标产品数'] == result['低于目标产品数']).all()
+    revenue = products['售价'].sum()
+    for i, (price, weight, shipping, items) in enumerate(factors):
+        margins = np.array(naive(price, weight, shipping, items))
+        total = (products['售价'] * margins).sum() / revenue
+        assert abs(result['利润率'][i] - total) < 1e-12
+        assert result['低于目标产品数'][i] == (margins < 0.5).sum()
+    all_margins = np.array([naive(*row) for row in factors])
+    assert np.allclose(result['产品']['最低利润率'], all_margins.min(axis=0))
+    assert np.allclose(result['产品']['平均利润率'], all_margins.mean(axis=0))
+    table = what_if.grid_table(result)
+    assert table.shape == (5, 2)
+
+    # 没有波动时每个情景都等于当前利润率；相同种子结果相同
+    flat = what_if.simulate(products, 1000, price_spread=0.0, seed=1)
+    assert np.allclose(flat['利润率'], what_if.baseline_margin(products))
+    first = what_if.simulate(products, 5000, 0.2, '三角', True, (0.9, 1.1), 0.1, 0.1, 0.5, seed=7)
+    second = what_if.simulate(products, 5000, 0.2, '三角', True, (0.9, 1.1), 0.1, 0.1, 0.5, seed=7)
+    assert len(first['利润率']) == 5000 and np.array_equal(first['利润率'], second['利润率'])
+    summary, histogram = what_if.distribution_summary(first['利润率'])
+    assert summary['P5'] <= summary['P50'] <= summary['P95'] and histogram.sum() == 5000
+    assert abs(summary['P50'] - what_if.baseline_margin(products)) < 0.05
+    print("✅ 假设分析正确")
+
+def test_image_server():
+    """测试缩略图按内容哈希命名、长期缓存和图片服务"""
+    print("🔍 测试图片服务...")
+    import tempfile
+    import urllib.error
+    import urllib.request
+    from PIL import Image
+    from image_server import ThumbnailCache, ImageServer, CACHE_CONTROL
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        photo = os.path.join(tmp_dir, "photo.jpg")
+        logo = os.path.join(tmp_dir, "logo.png")
+        Image.new('RGB', (640, 480), (200, 30, 30)).save(photo)
+        Image.new('RGBA', (64, 64), (0, 0, 0, 0)).save(logo)
+        cache = ThumbnailCache(os.path.join(tmp_dir, "thumbnails"))
+        first = cache.thumbnail(photo, 200)
+        assert first.endswith('-200.jpg') and cache.thumbnail(photo, 200) == first
+        with Image.open(cache.path(first)) as thumb:
+            assert max(thumb.size) == 200
+        assert cache.thumbnail(logo, 200).endswith('.png')
+        assert cache.thumbnail(os.path.join(tmp_dir, "missing.jpg"), 200) is None
+        # 内容变化时地址也变化
+        Image.new('RGB', (640, 480), (30, 30, 200)).save(photo)
+        os.utime(photo, ns=(1, 1))
+        assert cache.thumbnail(photo, 200) != first
+        assert cache.path('../photo.jpg') is None
+
+        server = ImageServer(cache, port=0).start()
+        try:
+            url = server.url(photo, 200)
+            response = urllib.request.urlopen(url, timeout=5)
+            assert response.headers['Cache-Control'] == CACHE_CONTROL
+            assert response.headers['Content-Type'] == 'image/jpeg' and len(response.read()) > 0
+            request = urllib.request.Request(url, headers={'If-None-Match': response.headers['ETag']})
+            try:
+                urllib.request.urlopen(request, timeout=5)
+                assert False, "缓存验证应返回304"
+            except urllib.error.HTTPError as e:
+                assert e.code == 304
+            try:
+                urllib.request.urlopen(server.base_url + "/thumbs/..%2Fphoto.jpg", timeout=5)
+                assert False, "不应提供缩略图以外的文件"
+            except urllib.error.HTTPError as e:
+                assert e.code == 404
+        finally:
+            server.stop()
+        assert server.url(photo, 200) is None
+    print("✅ 图片服务正确")
+
+def test_image_reconciler():
+    """测试图片一致性检查：孤立、缺少、损坏的图片，增量检查和修复"""
+    print("🔍 测试图片一致性检查...")
+    import tempfile
+    from PIL import Image
+    from image_reconciler import ImageReconciler, repair, ORPHAN, MISSING, CORRUPT
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_dir = os.path.join(tmp_dir, "accessories")
+        os.makedirs(image_dir)
+        for name in ("螺丝", "旧名称", "轴承"):
+            Image.new('RGB', (8, 8)).save(os.path.join(image_dir, f"{name}.jpg"))
+        with open(os.path.join(image_dir, "损坏.png"), "wb") as f:
+            f.write(b"not an image")
+        with open(os.path.join(image_dir, "说明.txt"), "w") as f:
+            f.write("不是图片")
+        df = pd.DataFrame({'名称': ['螺丝', '新名称', '垫片', '损坏', '轴承'],
+                           '图片路径': ['螺丝', '新名称.jpg', '垫片.png', '损坏.png', None]})
+        sources = [('accessories', df, image_dir)]
+        reconciler = ImageReconciler(os.path.join(tmp_dir, "state.json"), max_workers=4)
+
+        report = reconciler.run(sources, incremental=True)
+        problems = report['问题']
+        found = {(row['文件'], row['问题']) for row in problems.to_dict('records')}
+        assert found == {('新名称.jpg', MISSING), ('垫片.png', MISSING), ('损坏.png', CORRUPT),
+                         ('旧名称.jpg', ORPHAN), ('轴承.jpg', ORPHAN)}, found
+        assert report['文件数'] == 4 and report['检查数'] == 4
+
+        # 增量检查只重新解码有变化的文件，损坏的结果沿用上次
+        assert reconciler.run(sources)['检查数'] == 0
+        Image.new('RGB', (16, 16)).save(os.path.join(image_dir, "旧名称.jpg"))
+        again = reconciler.run(sources)
+        assert again['检查数'] == 1 and len(again['问题']) == len(problems)
+        assert reconciler.run(sources, incremental=False)['检查数'] == 4
+
+        # 修复：同名的孤立图片重新关联，其余孤立图片移走，缺少和损坏的行清空图片路径
+        df.loc[4, '图片路径'] = '丢失'
+        report = reconciler.run(sources)
+        updates, moved = repair(report['问题'], sources, os.path.join(tmp_dir, "orphaned"))
+        changes = {index: (value, trash) for _, index, value, trash in updates}
+        assert all(isinstance(index, int) for index in changes)
+        assert changes[4] == ('轴承.jpg', None)
+        assert changes[1] == ('', None) and changes[2] == ('', None)
+        assert changes[3] == ('', os.path.join(image_dir, '损坏.png'))
+        assert moved == 1 and os.listdir(os.path.join(tmp_dir, "orphaned", "accessories")) == ['旧名称.jpg']
+        assert sorted(os.listdir(image_dir)) == sorted(['损坏.png', '说明.txt', '螺丝.jpg', '轴承.jpg'])
+    print("✅ 图片一致性检查正确")
+
+def test_search_index():
+    """测试全文索引：中英文混合的 n-gram 匹配、排序、增量更新和重建"""
+    print("🔍 测试全文搜索...")
+    import tempfile
+    import search_index
+    from search_index import SearchIndex, filter_frame
+    from catalog_store import CatalogStore
+    from schema import UNIT_ITEMS_SCHEMA
+
+    materials = pd.DataFrame({
+        '名称': ['PETG透明耗材', 'PLA白色耗材', 'PLA', 'ABS黑色耗材'],
+        '品牌': ['拓竹', 'ＳＵＮＬＵ', '拓竹', None],
+        '耗材类型': ['PETG', 'PLA', 'PLA', 'ABS'],
+        '耗材颜色': ['透明', '白色', '白色', '黑色'],
+        '备注': [None, '适合M3螺丝孔', '', ''],
+    })
+    accessories = pd.DataFrame({'名称': ['螺丝M3x10', '螺母M3', '轴承608'],
+                                '规格': ['M3', 'M3', '608ZZ'], '备注': ['', '', '']})
+    index = SearchIndex()
+    assert index.update('print_materials', materials) == 4
+    assert index.update('accessories', accessories) == 3
+    assert index.update('material_lots', materials) == 0
+
+    # 名称完全匹配排在前面，中英文混合的名称不需要分词，全角和大小写统一
+    assert index.names('print_materials', 'pla') == ['PLA', 'PLA白色耗材']
+    assert index.names('print_materials', 'sunlu') == ['PLA白色耗材']
+    assert index.names('accessories', 'm3x1') == ['螺丝M3x10']
+    assert index.names('accessories', '螺') == ['螺母M3', '螺丝M3x10']
+    # 多个关键字都要匹配，可以在不同字段
+    assert index.names('print_materials', '拓竹 透明') == ['PETG透明耗材']
+    assert index.names('print_materials', '透明 白色') == []
+    # 两个字都出现但不相连时不算匹配
+    assert index.names('print_materials', '色耗白') == []
+    results = index.search('m3')
+    assert [name for _, name, _ in results[:2]] == ['螺母M3', '螺丝M3x10']
+    assert ('print_materials', 'PLA白色耗材') in [(table, name) for table, name, _ in results]
+
+    # 增量更新：只处理变化的名称
+    changed = materials.drop(index=3).copy()
+    changed.loc[0, '名称'] = 'PETG透明耗材-新'
+    changed.loc[1, '备注'] = '哑光'
+    assert index.update('print_materials', changed) == 4
+    assert index.update('print_materials', changed) == 0
+    assert index.names('print_materials', 'abs') == []
+    assert index.names('print_materials', 'PETG') == ['PETG透明耗材-新']
+    assert index.names('accessories', 'm3') == ['螺母M3', '螺丝M3x10']
+    assert 'PLA白色耗材' in index.names('print_materials', '哑光')
+    assert index.names('print_materials', '螺丝孔') == []
+
+    # 无效条目较多时重建索引，结果不变
+    min_dead = search_index.COMPACT_MIN_DEAD
+    try:
+        search_index.COMPACT_MIN_DEAD = 0
+        index.update('print_materials', changed.iloc[:1])
+    finally:
+        search_index.COMPACT_MIN_DEAD = min_dead
+    assert index._dead == 0 and index.size == 4
+    assert index.names('print_materials', 'petg') == ['PETG透明耗材-新']
+    assert index.names('accessories', '608') == ['轴承608']
+    assert filter_frame(accessories, ['轴承608', '螺丝M3x10'])['名称'].tolist() == ['轴承608', '螺丝M3x10']
+
+    # 数据目录保存和重新读取时同步索引
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        packaging_file = os.path.join(tmp_dir, "packaging.xlsx")
+        pd.DataFrame([{'名称': '纸箱小号', '规格': '纸箱'}]).to_excel(packaging_file, index=False)
+        store = CatalogStore({'packaging': (packaging_file, UNIT_ITEMS_SCHEMA)}, search_index=SearchIndex())
+        assert store.search_index.names('packaging', '纸箱') == ['纸箱小号']
+        store.insert_row('packaging', {'名称': '气泡袋', '规格': '袋', '备注': '防震'})
+        assert store.search_index.names('packaging', '防震') == ['气泡袋']
+        store.delete_row('packaging', store.get('packaging').index[0])
+        assert store.search_index.names('packaging', '纸箱') == []
+    print("✅ 全文搜索正确")
+
+def test_workspaces():
+    """测试工作区：目录结构、新建和名称校验，以及各工作区数据互不影响"""
+    print("🔍 测试工作区...")
+    import tempfile
+    import threading
+    from catalog_store import CatalogStore
+    from migrations import run_migrations
+    from workspace import DEFAULT_WORKSPACE, open_workspace, list_workspaces, create_workspace
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = os.path.join(tmp_dir, "data")
+        workspaces_dir = os.path.join(tmp_dir, "workspaces")
+        backup_dir = os.path.join(tmp_dir, "backups")
+        assert list_workspaces(workspaces_dir) == [DEFAULT_WORKSPACE]
+
+        default = open_workspace(DEFAULT_WORKSPACE, data_dir, workspaces_dir, backup_dir).ensure_dirs()
+        assert default.packaging_file == os.path.join(data_dir, "packaging.xlsx")
+        assert default.backup_dir == backup_dir
+        assert os.path.isdir(os.path.join(data_dir, "images", "accessories"))
+
+        assert create_workspace(" 二号店 ", workspaces_dir) == "二号店"
+        create_workspace("shop-3", workspaces_dir)
+        assert list_workspaces(workspaces_dir) == [DEFAULT_WORKSPACE, "shop-3", "二号店"]
+        for name in ("二号店", DEFAULT_WORKSPACE, "../data", "a/b", ""):
+            try:
+                create_workspace(name, workspaces_dir)
+                assert False, f"{name} 不应创建成功"
+            except ValueError:
+                pass
+        try:
+            open_workspace("../data", data_dir, workspaces_dir, backup_dir)
+            assert False, "无效名称不应打开"
+        except ValueError:
+            pass
+
+        shop = open_workspace("二号店", data_dir, workspaces_dir, backup_dir).ensure_dirs()
+        assert shop.history_file == os.path.join(workspaces_dir, "二号店", "history_costs.xlsx")
+        assert shop.image_dir('packaging') == os.path.join(workspaces_dir, "二号店", "images", "packaging")
+        assert shop.backup_dir == os.path.join(backup_dir, "workspaces", "二号店")
+
+        # 每个工作区单独迁移和读取，修改一个工作区不影响另一个
+        stores = {}
+        for workspace in (default, shop):
+            run_migrations(workspace.data_dir, lock=workspace.migration_lock)
+            stores[workspace.name] = CatalogStore(workspace.catalog_tables, workspace.history_file,
+                                                  history_lock=workspace.history_lock)
+        stores["二号店"].insert_row('packaging', {'名称': '纸箱', '每单位成本': 1.0})
+        assert stores["二号店"].get('packaging')['名称'].tolist() == ['纸箱']
+        assert stores[DEFAULT_WORKSPACE].get('packaging').empty
+        assert os.path.exists(shop.packaging_file) and not os.path.exists(default.packaging_file)
+
+        # 每个工作区有自己的锁：一个工作区正在维护历史分区时，另一个工作区照常写入历史记录
+        assert default.history_lock is not shop.history_lock and default.backup_lock is not shop.backup_lock
+        with default.history_lock:
+            writer = threading.Thread(target=stores["二号店"].append_history,
+                                      args=({'时间': '2024-01-01 10:00:00', '总成本': 1.0},))
+            writer.start()
+            writer.join(timeout=10)
+            assert not writer.is_alive()
+        assert len(stores["二号店"].history()) == 1
+    print("✅ 工作区正确")
+
+def test_decoded_image_cache():
+    """测试解码图片缓存：按目标大小解码、命中不重新解码、文件变化后重新解码、按大小淘汰"""
+    print("🔍 测试解码图片缓存...")
+    import tempfile
+    from PIL import Image
+    from image_cache import DecodedImageCache, decode_thumbnail, image_bytes
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        photos = []
+        for i in range(3):
+            photo = os.path.join(tmp_dir, f"photo{i}.jpg")
+            Image.new('RGB', (1600, 1200), (40 * i, 30, 30)).save(photo)
+            photos.append(photo)
+        # JPEG 按比例解码后缩小，不超过目标大小
+        image = decode_thumbnail(photos[0], 200)
+        assert max(image.size) == 200 and image_bytes(image) == 200 * 150 * 3
+
+        cache = DecodedImageCache(max_bytes=2 * 200 * 150 * 3)
+        first = cache.get(photos[0], 200)
+        assert cache.get(photos[0], 200) is first and (cache.hits, cache.misses) == (1, 1)
+        # 不同宽度分别缓存
+        assert max(cache.get(photos[0], 100).size) == 100 and cache.misses == 2
+
+        # 文件变化后重新解码
+        Image.new('RGB', (800, 600), (0, 0, 200)).save(photos[0])
+        os.utime(photos[0], ns=(1, 1))
+        assert cache.get(photos[0], 200) is not first and cache.misses == 3
+
+        # 超过总大小时淘汰最久未使用的图片
+        cache.get(photos[1], 200)
+        cache.get(photos[2], 200)
+        assert cache.bytes <= cache.max_bytes and cache.size == 2
+        misses = cache.misses
+        cache.get(photos[2], 200)
+        assert cache.misses == misses
+        cache.get(photos[0], 200)
+        assert cache.misses == misses + 1
+
+        broken = os.path.join(tmp_dir, "broken.jpg")
+        with open(broken, 'wb') as f:
+            f.write(b"not an image")
+        assert cache.get(broken, 200) is None
+        assert cache.get(os.path.join(tmp_dir, "missing.jpg"), 200) is None
+    print("✅ 解码图片缓存正确")
+
+def test_main_page_without_data():
+    """测试没有任何数据文件时（新工作区、空数据目录）能打开主页"""
+    print("🔍 测试空数据目录的主页...")
+    import tempfile
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            at = AppTest.from_file(app_path, default_timeout=120).run()
+        finally:
+            os.chdir(cwd)
+        assert not at.exception, [e.message for e in at.exception]
+        warnings = [w.value for w in at.warning]
+        assert "请先在产品配件管理页面添加配件" in warnings and "请先在包装管理页面添加包装" in warnings
+    print("✅ 空数据目录的主页正常显示")
+
 def main():
     """运行所有测试"""
     print("🧪 开始测试资产管理平台...")
@@ -86,7 +1457,33 @@ def main():
         ("数据目录创建", test_data_directory),
         ("依赖包检查", test_dependencies),
         ("示例数据创建", test_sample_data_creation),
-        ("计算功能", test_calculations)
+        ("计算功能", test_calculations),
+        ("STL克重估算", test_stl_weight_estimation),
+        ("批量报价", test_batch_quote),
+        ("历史汇总", test_history_rollups),
+        ("类型化数据结构", test_typed_schema),
+        ("共享数据目录", test_catalog_store),
+        ("数据结构迁移", test_migrations),
+        ("后台写入队列", test_write_behind_queue),
+        ("流式导出", test_streaming_export),
+        ("变更日志", test_change_journal),
+        ("增量备份", test_incremental_backup),
+        ("采购批次成本", test_purchase_lots),
+        ("压力测试辅助函数", test_load_test_helpers),
+        ("价格历史重算", test_price_history),
+        ("库存台账", test_inventory_ledger),
+        ("数据文件监视", test_file_watcher_reload),
+        ("运行指标", test_metrics_registry),
+        ("客户报价单", test_quote_documents),
+        ("历史分区", test_history_partitions),
+        ("最便宜配置", test_configuration_optimizer),
+        ("假设分析", test_what_if_analysis),
+        ("图片服务", test_image_server),
+        ("图片一致性检查", test_image_reconciler),
+        ("全文搜索", test_search_index),
+        ("工作区", test_workspaces),
+        ("解码图片缓存", test_decoded_image_cache),
+        ("空数据目录主页", test_main_page_without_data)
     ]
     
     passed = 0
@@ -95,13 +1492,15 @@ def main():
     for test_name, test_func in tests:
         print(f"\n📋 测试: {test_name}")
         try:
-            if test_func():
+            # 检查失败时抛出异常；返回 False 也表示失败，不返回值表示通过
+            if test_func() is not False:
                 passed += 1
                 print(f"✅ {test_name} 测试通过")
             else:
                 print(f"❌ {test_name} 测试失败")
         except Exception as e:
-            print(f"❌ {test_name} 测试异常: {e}")
+            print(f"❌ {test_name} 测试异常: {e!r}")
+            traceback.print_exc()
     
     print("\n" + "=" * 50)
     print(f"📊 测试结果: {passed}/{total} 通过")
@@ -118,6 +1517,8 @@ def main():
         print("   1. 确保Python版本 >= 3.7")
         print("   2. 运行 pip install -r requirements.txt")
         print("   3. 检查是否有足够的磁盘空间")
+    return passed == total
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # 有测试失败时以非零状态退出，便于在脚本和持续集成中检查
+    sys.exit(0 if main() else 1) 
\ No newline at end of file
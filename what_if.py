@@ -0,0 +1,192 @@
+"""
+假设分析模块
+评估耗材价格、克重、运费和配件/包装成本变化对整个产品线利润率的影响。
+产品线是几个等长的数组（克重、每克耗材价格、每克运费、配件包装成本、售价），
+一批情景的成本用 NumPy 广播一次算出（情景 × 产品的矩阵），统计只做数组归约，不逐个情景循环；
+情景很多时按块计算，内存占用与情景数量无关。
+支持网格（每个因子取若干等间距的值，计算全部组合）和蒙特卡洛（按价格分布随机抽样）两种方式
+"""
+
+import numpy as np
+import pandas as pd
+
+# 情景因子：各项成本相对当前值的倍数
+FACTORS = ['耗材价格', '克重', '运费', '配件包装']
+DISTRIBUTIONS = ['正态', '均匀', '三角']
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# 每块计算的矩阵元素数（情景数 × 产品数）上限
+CHUNK_ELEMENTS = 2_000_000
+
+
+def product_line(records, materials_df):
+    """从带售价的历史记录构造产品线。
+    records 需要 打印材料、克重、打印材料成本、配件成本、包装成本、售价 列（通常为按当前价格重算后的结果）；
+    每克成本按材料表拆分为耗材价格和运费两部分，材料已不在表中时全部计为耗材价格"""
+    sale = pd.to_numeric(records.get('售价'), errors='coerce')
+    weight = pd.to_numeric(records.get('克重'), errors='coerce')
+    df = records[(sale > 0) & (weight > 0)]
+    weight = weight[df.index].to_numpy(dtype=float)
+    material_cost = pd.to_numeric(df['打印材料成本'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    names = df['打印材料'].astype(object).fillna('').astype(str).to_numpy()
+
+    shipping_share = np.zeros(len(df))
+    if materials_df is not None and not materials_df.empty and '名称' in materials_df.columns:
+        price = pd.to_numeric(materials_df.get('购买价'), errors='coerce').fillna(0)
+        shipping = pd.to_numeric(materials_df.get('运费'), errors='coerce').fillna(0)
+        total = price + shipping
+        shares = pd.Series(np.where(total > 0, shipping / total.where(total > 0, 1), 0.0),
+                           index=materials_df['名称'].astype(str))
+        shares = shares[~shares.index.duplicated()]
+        shipping_share = shares.reindex(names).fillna(0).to_numpy(dtype=float)
+
+    unit_cost = material_cost / weight
+    items = sum(pd.to_numeric(df.get(column), errors='coerce').fillna(0).to_numpy(dtype=float)
+                for column in ('配件成本', '包装成本'))
+    return pd.DataFrame({
+        '时间': df['时间'].to_numpy() if '时间' in df.columns else pd.NaT,
+        '打印材料': names,
+        '克重': weight,
+        '耗材单价': unit_cost * (1 - shipping_share),
+        '运费单价': unit_cost * shipping_share,
+        '配件包装成本': items,
+        '售价': sale[df.index].to_numpy(dtype=float),
+    })
+
+
+def _arrays(products):
+    return (products['克重'].to_numpy(dtype=float), products['耗材单价'].to_numpy(dtype=float),
+            products['运费单价'].to_numpy(dtype=float), products['配件包装成本'].to_numpy(dtype=float),
+            products['售价'].to_numpy(dtype=float))
+
+
+class _Accumulator:
+    """按块累计每个情景的汇总和每个产品在全部情景中的统计"""
+
+    def __init__(self, products, target_margin):
+        self.weight, self.price, self.shipping, self.items, self.sale = _arrays(products)
+        self.revenue = self.sale.sum()
+        self.target_margin = target_margin
+        self.margins, self.losses, self.below_target = [], [], []
+        count = len(products)
+        self.margin_sum = np.zeros(count)
+        self.margin_min = np.full(count, np.inf)
+        self.margin_max = np.full(count, -np.inf)
+        self.loss_count = np.zeros(count)
+        self.scenarios = 0
+
+    def add(self, price_factor, weight_factor, shipping_factor, item_factor):
+        """各因子为 (情景数, 1) 或 (情景数, 产品数) 的数组"""
+        cost = (self.weight * weight_factor) * (self.price * price_factor + self.shipping * shipping_factor) \
+            + self.items * item_factor
+        margin = (self.sale - cost) / self.sale
+        self.margins.append((self.revenue - cost.sum(axis=1)) / self.revenue)
+        self.losses.append((margin < 0).sum(axis=1))
+        self.below_target.append((margin < self.target_margin).sum(axis=1))
+        self.margin_sum += margin.sum(axis=0)
+        np.minimum(self.margin_min, margin.min(axis=0), out=self.margin_min)
+        np.maximum(self.margin_max, margin.max(axis=0), out=self.margin_max)
+        self.loss_count += (margin < 0).sum(axis=0)
+        self.scenarios += len(margin)
+
+    def result(self, products):
+        per_product = products[['时间', '打印材料', '克重', '售价']].copy()
+        per_product['平均利润率'] = self.margin_sum / self.scenarios
+        per_product['最低利润率'] = self.margin_min
+        per_product['最高利润率'] = self.margin_max
+        per_product['亏损比例'] = self.loss_count / self.scenarios
+        return {
+            '利润率': np.concatenate(self.margins),
+            '亏损产品数': np.concatenate(self.losses),
+            '低于目标产品数': np.concatenate(self.below_target),
+            '产品': per_product,
+        }
+
+
+def _chunk_rows(product_count):
+    return max(1, CHUNK_ELEMENTS // max(product_count, 1))
+
+
+def factor_values(low, high, steps):
+    """变化范围（百分比）内等间距取 steps 个值，转换为倍数"""
+    if high <= low or steps <= 1:
+        return np.array([1 + (low + high) / 200])
+    return 1 + np.linspace(low, high, steps) / 100
+
+
+def factor_grid(price_factors, weight_factors, shipping_factors, item_factors):
+    """全部因子组合，(情景数, 4)，列顺序同 FACTORS"""
+    grids = np.meshgrid(np.asarray(price_factors, dtype=float), np.asarray(weight_factors, dtype=float),
+                        np.asarray(shipping_factors, dtype=float), np.asarray(item_factors, dtype=float),
+                        indexing='ij')
+    return np.stack([grid.ravel() for grid in grids], axis=1)
+
+
+def evaluate_grid(products, factors, target_margin=0.0):
+    """按因子网格计算，factors 为 factor_grid 的结果；返回每个情景的利润率等汇总和每个产品的统计"""
+    accumulator = _Accumulator(products, target_margin)
+    step = _chunk_rows(len(products))
+    for start in range(0, len(factors), step):
+        chunk = factors[start:start + step]
+        accumulator.add(*(chunk[:, [i]] for i in range(len(FACTORS))))
+    result = accumulator.result(products)
+    result['因子'] = pd.DataFrame(factors, columns=FACTORS)
+    return result
+
+
+def sample_factors(rng, distribution, spread, size):
+    """围绕1的随机倍数：正态分布的标准差、均匀/三角分布的半宽为 spread，结果不小于0"""
+    if spread <= 0:
+        return np.ones(size)
+    if distribution == '正态':
+        return np.clip(rng.normal(1.0, spread, size), 0.0, None)
+    if distribution == '均匀':
+        return np.clip(rng.uniform(1.0 - spread, 1.0 + spread, size), 0.0, None)
+    return np.clip(rng.triangular(1.0 - spread, 1.0, 1.0 + spread, size), 0.0, None)
+
+
+def simulate(products, samples, price_spread=0.1, distribution='正态', per_material=True,
+             weight_range=(1.0, 1.0), shipping_spread=0.0, item_spread=0.0, target_margin=0.0, seed=None):
+    """蒙特卡洛：每次抽样为一个情景。per_material 为 True 时每种材料的价格独立变化，
+    否则所有材料同涨同跌；克重倍数在 weight_range 中均匀抽样，每个产品独立"""
+    rng = np.random.default_rng(seed)
+    accumulator = _Accumulator(products, target_margin)
+    count = len(products)
+    materials, material_index = np.unique(products['打印材料'].to_numpy(dtype=str), return_inverse=True)
+    step = _chunk_rows(count)
+    for start in range(0, samples, step):
+        rows = min(step, samples - start)
+        if per_material:
+            price_factor = sample_factors(rng, distribution, price_spread, (rows, len(materials)))[:, material_index]
+        else:
+            price_factor = sample_factors(rng, distribution, price_spread, (rows, 1))
+        low, high = weight_range
+        weight_factor = rng.uniform(low, high, (rows, count)) if high > low else np.full((rows, 1), low)
+        accumulator.add(price_factor, weight_factor, sample_factors(rng, distribution, shipping_spread, (rows, 1)),
+                        sample_factors(rng, distribution, item_spread, (rows, 1)))
+    return accumulator.result(products)
+
+
+def baseline_margin(products):
+    """所有因子为1（当前价格）时的整体利润率"""
+    weight, price, shipping, items, sale = _arrays(products)
+    revenue = sale.sum()
+    return (revenue - (weight * (price + shipping) + items).sum()) / revenue if revenue > 0 else None
+
+
+def distribution_summary(values, bins=40):
+    """分位数、均值、标准差和直方图（一次排序/计数，不逐个取值）"""
+    values = np.asarray(values, dtype=float)
+    summary = {f"P{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    summary['平均'] = float(values.mean())
+    summary['标准差'] = float(values.std())
+    counts, edges = np.histogram(values, bins=bins)
+    histogram = pd.Series(counts, index=np.round((edges[:-1] + edges[1:]) / 2, 4), name='情景数')
+    histogram.index.name = '利润率'
+    return summary, histogram
+
+
+def grid_table(result, rows='耗材价格', columns='克重'):
+    """网格结果按两个因子汇总（其余因子取平均）的利润率表"""
+    df = result['因子'].assign(利润率=result['利润率'])
+    return df.pivot_table(index=rows, columns=columns, values='利润率', aggfunc='mean')
@@ -0,0 +1,101 @@
+"""
+工作区模块
+一个进程可以同时服务多个工作区（如不同的车间、品牌或店铺），每个工作区是一个独立的数据目录，
+有各自的数据表、图片、历史记录、变更日志和库存台账，目录结构与默认的 data/ 相同。
+默认工作区使用 data/，其他工作区保存在 workspaces/<名称>/ 中；
+应用为每个工作区单独创建数据目录、缓存和锁，只在有会话打开这个工作区时才创建；
+一个工作区的操作（如压缩历史分区、备份）不会阻塞其他工作区
+"""
+
+import os
+import re
+import threading
+
+from schema import PRINT_MATERIALS_SCHEMA, UNIT_ITEMS_SCHEMA, MATERIAL_LOTS_SCHEMA
+
+DEFAULT_WORKSPACE = "默认"
+# 工作区名称同时是目录名：字母、数字、汉字、下划线和短横线
+NAME_PATTERN = re.compile(r'^[\w\-]{1,40}$')
+
+
+class Workspace:
+    """一个工作区的各数据文件和目录路径，以及访问这些文件时使用的锁（每个进程中每个工作区只创建一个对象）"""
+
+    def __init__(self, name, data_dir, backup_dir):
+        self.name = name
+        self.data_dir = data_dir
+        self.backup_dir = backup_dir
+        # 历史记录和汇总表的读取-修改-写入、备份和清理、数据结构迁移
+        self.history_lock = threading.RLock()
+        self.backup_lock = threading.Lock()
+        self.migration_lock = threading.Lock()
+        self.print_materials_file = os.path.join(data_dir, "print_materials.xlsx")
+        self.accessories_file = os.path.join(data_dir, "accessories.xlsx")
+        self.packaging_file = os.path.join(data_dir, "packaging.xlsx")
+        self.material_lots_file = os.path.join(data_dir, "material_lots.xlsx")
+        self.images_dir = os.path.join(data_dir, "images")
+        self.materials_images_dir = os.path.join(self.images_dir, "materials")
+        self.accessories_images_dir = os.path.join(self.images_dir, "accessories")
+        self.packaging_images_dir = os.path.join(self.images_dir, "packaging")
+        self.orphaned_images_dir = os.path.join(self.images_dir, "orphaned")
+        # 历史计算记录（按月分区保存在 history_costs/ 中），超过保留月数的分区移到归档目录
+        self.history_file = os.path.join(data_dir, "history_costs.xlsx")
+        self.history_archive_dir = os.path.join(data_dir, "history_archive")
+        self.price_history_file = os.path.join(data_dir, "price_history.csv")
+        self.inventory_file = os.path.join(data_dir, "inventory_ledger.csv")
+        self.journal_dir = os.path.join(data_dir, "journal")
+        self.image_check_state_file = os.path.join(data_dir, "image_check_state.json")
+        self.batch_jobs_dir = os.path.join(data_dir, "batch_jobs")
+        self.exports_dir = os.path.join(data_dir, "exports")
+        self.quotes_dir = os.path.join(data_dir, "quotes")
+
+    @property
+    def catalog_tables(self):
+        """各数据表的文件和列类型定义"""
+        return {
+            'print_materials': (self.print_materials_file, PRINT_MATERIALS_SCHEMA),
+            'accessories': (self.accessories_file, UNIT_ITEMS_SCHEMA),
+            'packaging': (self.packaging_file, UNIT_ITEMS_SCHEMA),
+            'material_lots': (self.material_lots_file, MATERIAL_LOTS_SCHEMA),
+        }
+
+    def image_dir(self, table):
+        return {'print_materials': self.materials_images_dir, 'accessories': self.accessories_images_dir,
+                'packaging': self.packaging_images_dir}[table]
+
+    def ensure_dirs(self):
+        """确保数据目录和图片目录存在"""
+        for directory in (self.data_dir, self.materials_images_dir, self.accessories_images_dir,
+                          self.packaging_images_dir):
+            os.makedirs(directory, exist_ok=True)
+        return self
+
+
+def list_workspaces(workspaces_dir):
+    """默认工作区和 workspaces_dir 中的全部工作区"""
+    names = []
+    if os.path.isdir(workspaces_dir):
+        with os.scandir(workspaces_dir) as entries:
+            names = sorted(entry.name for entry in entries
+                           if entry.is_dir() and NAME_PATTERN.match(entry.name) and entry.name != DEFAULT_WORKSPACE)
+    return [DEFAULT_WORKSPACE] + names
+
+
+def open_workspace(name, default_data_dir, workspaces_dir, backup_dir):
+    """工作区的路径；默认工作区使用 default_data_dir 和 backup_dir，其他工作区的备份保存在 backup_dir/workspaces/ 中"""
+    if name == DEFAULT_WORKSPACE:
+        return Workspace(name, default_data_dir, backup_dir)
+    if not NAME_PATTERN.match(name or ''):
+        raise ValueError(f"工作区名称无效: {name}")
+    return Workspace(name, os.path.join(workspaces_dir, name), os.path.join(backup_dir, "workspaces", name))
+
+
+def create_workspace(name, workspaces_dir):
+    """新建一个空的工作区目录，返回名称"""
+    name = (name or '').strip()
+    if not NAME_PATTERN.match(name):
+        raise ValueError("名称只能包含字母、数字、汉字、下划线和短横线，最多40个字符")
+    if name == DEFAULT_WORKSPACE or name in list_workspaces(workspaces_dir):
+        raise ValueError(f"工作区 {name} 已存在")
+    os.makedirs(os.path.join(workspaces_dir, name))
+    return name
@@ -0,0 +1,212 @@
+"""
+后台写入队列模块
+保存操作先放入队列立即返回，由后台线程写入文件：
+同一数据表在短时间内的多次修改合并为一次写入（以最后一次为准），
+同一文件的多条追加记录合并为一次追加；
+写入按首次提交的顺序进行，同一个键的写入不会乱序；程序退出时写完所有待写入的数据。
+写入失败的数据不会丢弃：保留这个键最新的数据，等待一段时间（逐次加倍）后重试，期间先写入其他键，
+失败的键在页面上显示，flush 返回是否全部写入，close 返回没有写入的键
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+# 写入失败后第一次重试前等待的秒数，之后每次加倍，最多等待 MAX_RETRY_DELAY 秒
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 30.0
+# flush 等待写入失败的数据重试到这个次数，仍然失败时返回（数据留在队列中继续重试）
+FLUSH_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+class _WriteTask:
+    __slots__ = ('write', 'payload', 'append', 'attempts', 'error', 'retry_at')
+
+    def __init__(self, write, payload, append):
+        self.write = write
+        self.payload = payload
+        self.append = append
+        self.attempts = 0
+        self.error = None
+        self.retry_at = 0.0
+
+    def run(self):
+        self.write(list(self.payload) if self.append else self.payload)
+
+
+class WriteBehindQueue:
+    """后台写入队列"""
+
+    def __init__(self, coalesce_delay=0.2, latency_samples=200):
+        self.coalesce_delay = coalesce_delay
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._busy_key = None
+        self._closed = False
+        self.flush_count = 0
+        self.coalesced_count = 0
+        self.error_count = 0
+        self.last_error = None
+        self.flush_latencies = deque(maxlen=latency_samples)
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, key, write, payload):
+        """提交一次整体写入：同一个键尚未写入的旧数据会被新数据替换"""
+        with self._cond:
+            if self._closed:
+                write(payload)
+                return
+            task = self._pending.get(key)
+            if task is not None:
+                task.write, task.payload = write, payload
+                self.coalesced_count += 1
+            else:
+                self._pending[key] = _WriteTask(write, payload, append=False)
+            self._cond.notify_all()
+
+    def submit_append(self, key, write, record):
+        """提交一条追加记录：同一个键尚未写入的记录会合并后一次写入"""
+        with self._cond:
+            if self._closed:
+                write([record])
+                return
+            task = self._pending.get(key)
+            if task is not None:
+                task.payload.append(record)
+                self.coalesced_count += 1
+            else:
+                self._pending[key] = _WriteTask(write, [record], append=True)
+            self._cond.notify_all()
+
+    def _requeue(self, key, task):
+        """写入失败的任务放回队首；期间又有新提交时与之合并（整体写入以新数据为准，立即重试）"""
+        newer = self._pending.pop(key, None)
+        if newer is not None:
+            if task.append:
+                task.payload.extend(newer.payload)
+            else:
+                task = newer
+        self._pending[key] = task
+        self._pending.move_to_end(key, last=False)
+
+    def _next_ready(self):
+        """最早提交的、不在等待重试的任务的键；没有时返回 (None, 最短等待秒数)"""
+        now = time.monotonic()
+        wait = None
+        for key, task in self._pending.items():
+            if task.retry_at <= now:
+                return key, None
+            wait = task.retry_at - now if wait is None else min(wait, task.retry_at - now)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._pending:
+                        if self._closed:
+                            return
+                        self._cond.wait()
+                        continue
+                    key, wait = self._next_ready()
+                    if key is not None:
+                        break
+                    self._cond.wait(wait)
+                closed = self._closed
+                first_attempt = not self._pending[key].attempts
+            # 等待一小段时间，把连续的修改合并为一次写入
+            if not closed and first_attempt and self.coalesce_delay:
+                time.sleep(self.coalesce_delay)
+            with self._cond:
+                task = self._pending.pop(key)
+                self._busy_key = key
+            start = time.perf_counter()
+            try:
+                task.attempts += 1
+                task.run()
+                failed = False
+            except Exception as e:
+                failed = True
+                self.error_count += 1
+                self.last_error = f"{key}: {e}"
+                task.error = str(e) or type(e).__name__
+                task.retry_at = time.monotonic() + min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (task.attempts - 1))
+            elapsed = time.perf_counter() - start
+            with self._cond:
+                self._busy_key = None
+                if failed:
+                    self._requeue(key, task)
+                else:
+                    self.flush_count += 1
+                    self.flush_latencies.append(elapsed)
+                self._cond.notify_all()
+
+    @property
+    def depth(self):
+        """待写入的任务数（包括正在写入的）"""
+        with self._cond:
+            return len(self._pending) + (1 if self._busy_key is not None else 0)
+
+    def is_pending(self, key):
+        with self._cond:
+            return key in self._pending or key == self._busy_key
+
+    def failures(self):
+        """写入失败、正在等待重试的数据：键 -> (尝试次数, 错误信息)"""
+        with self._cond:
+            return {key: (task.attempts, task.error) for key, task in self._pending.items() if task.error}
+
+    def unwritten(self):
+        """还没有写入的键"""
+        with self._cond:
+            keys = list(self._pending)
+            if self._busy_key is not None:
+                keys.insert(0, self._busy_key)
+            return keys
+
+    def flush(self, timeout=None):
+        """等待所有已提交的数据写入完成；超时或剩下的数据都已多次写入失败时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy_key is not None:
+                if not self._thread.is_alive():
+                    return False
+                if self._busy_key is None and all(task.error and task.attempts >= FLUSH_ATTEMPTS
+                                                  for task in self._pending.values()):
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=30):
+        """停止接收新任务，写完队列中剩余的数据（失败的数据在超时前继续重试）；返回没有写入的键"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        unwritten = self.unwritten()
+        if unwritten:
+            logger.error("后台写入队列关闭时仍有数据没有写入: %s（最近错误: %s）", unwritten, self.last_error)
+        return unwritten
+
+    def stats(self):
+        latencies = list(self.flush_latencies)
+        return {
+            '队列深度': self.depth,
+            '写入次数': self.flush_count,
+            '合并次数': self.coalesced_count,
+            '失败次数': self.error_count,
+            '最近写入耗时': latencies[-1] if latencies else None,
+            '平均写入耗时': sum(latencies) / len(latencies) if latencies else None,
+            '最大写入耗时': max(latencies) if latencies else None,
+            '最近错误': self.last_error,
+            '未写入': self.failures(),
+        }